@@ -0,0 +1,140 @@
+import random
+import socket
+import threading
+import time
+import uuid
+
+import httplib2
+import six
+from googleapiclient.errors import HttpError
+
+from ccp.gcp.metrics import registry, request_labels
+from ccp.gcp.rate_limiter import get_rate_limiter, is_mutation
+from ccp.gcp.tracing import span
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# 403 reasons that mean the call was throttled, not refused
+RETRYABLE_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_CALL_DEADLINE = 90.0  # seconds, for a call and all its retries
+MIN_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 32.0
+
+
+def retry_reason(error):
+    """ input: an exception raised by request.execute()
+        output: a short name for the transient error, None if the call should not be retried
+    """
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES:
+            return 'http_{0}'.format(status)
+        content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else error.content
+        if status == 403 and any(reason in content for reason in RETRYABLE_REASONS):
+            return 'rate_limited'
+        return None
+    if isinstance(error, socket.timeout):
+        return 'timeout'
+    if isinstance(error, (socket.error, httplib2.HttpLib2Error, six.moves.http_client.HTTPException)):
+        return 'connection'
+    return None
+
+
+def is_not_found(error):
+    """ a resource that is already gone counts as deleted
+    """
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+class RetryPolicy(object):
+    """ retries transient Compute API errors with capped exponential backoff and jitter,
+        until the call succeeds, fails for good, runs out of attempts or passes its deadline
+        keeps the number of retries per reason and of calls that gave up
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, deadline=DEFAULT_CALL_DEADLINE):
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._retries = {}
+        self._exhausted = 0
+
+    def run(self, call, labels=None):
+        """ input: callable making one attempt, and the metric labels of the call
+            output: the result of the first successful attempt
+        """
+        deadline = time.time() + self.deadline
+        delay = MIN_RETRY_DELAY
+        attempt = 1
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None:
+                    raise
+                sleep_for = delay / 2 + random.uniform(0, delay / 2)
+                if attempt >= self.max_attempts or time.time() + sleep_for > deadline:
+                    with self._lock:
+                        self._exhausted += 1
+                    raise
+                with self._lock:
+                    self._retries[reason] = self._retries.get(reason, 0) + 1
+                registry.inc('gcp_api_retries_total', dict(labels or {}, reason=reason),
+                             help='Compute API calls retried after a transient error')
+            time.sleep(sleep_for)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {'retries': dict(self._retries), 'exhausted': self._exhausted}
+
+
+default_policy = RetryPolicy()
+
+
+def _set_request_id(request):
+    """ mutations carry a requestId, so the server ignores a retry of a call it already accepted
+    """
+    uri = getattr(request, 'uri', None)
+    if not isinstance(uri, six.string_types) or 'requestId=' in uri:
+        return
+    request.uri = '{0}{1}requestId={2}'.format(uri, '&' if '?' in uri else '?', uuid.uuid4())
+
+
+def execute(request, project, policy=default_policy):
+    """ input: a googleapiclient request and the project whose quota it is charged to
+        output: the response - json
+        every Compute API call of the driver goes through here, so it stays within the project's budgets
+        and transient errors are retried
+    """
+    mutation = is_mutation(request)
+    if mutation:
+        _set_request_id(request)
+    labels = request_labels(request)
+
+    def attempt():
+        throttled = get_rate_limiter(project).acquire(mutation=mutation)
+        if throttled:
+            registry.inc('gcp_api_throttled_seconds_total', labels, amount=throttled,
+                         help='Seconds Compute API calls waited for the client side rate limiter')
+        started = time.time()
+        try:
+            return request.execute()
+        except Exception as e:
+            registry.inc('gcp_api_errors_total', dict(labels, code=_error_code(e)),
+                         help='Compute API calls that failed, retried or not')
+            raise
+        finally:
+            registry.observe('gcp_api_request_duration_seconds', time.time() - started, labels,
+                             help='Compute API call latency')
+
+    with span(labels['method'] or 'api_call', zone=labels['zone']):
+        return policy.run(attempt, labels)
+
+
+def _error_code(error):
+    if isinstance(error, HttpError):
+        return str(error.resp.status)
+    return type(error).__name__
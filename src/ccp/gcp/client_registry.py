@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import google.auth
+import googleapiclient.discovery
+from google.oauth2 import service_account
+
+from ccp.gcp.http_pool import HttpPool
+
+API_NAME = 'compute'
+API_VERSION = 'v1'
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+DISCOVERY_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gcp_shell_discovery')
+DISCOVERY_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds, discovery documents change rarely
+
+_DISCOVERY_URL_PATTERN = re.compile(r'/apis/(?P<api>[^/]+)/(?P<version>[^/]+)/rest')
+
+_clients = {}
+_credentials = {}
+_clients_lock = threading.Lock()
+_discovery_url = None
+
+
+class FileDiscoveryCache(object):
+    """ on disk cache of discovery documents, keyed by api name and version
+        implements the get/set interface googleapiclient.discovery.build expects from its cache argument
+    """
+
+    def __init__(self, directory=DISCOVERY_CACHE_DIR, max_age=DISCOVERY_CACHE_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, url):
+        match = _DISCOVERY_URL_PATTERN.search(url)
+        if match:
+            key = '{0}.{1}'.format(match.group('api'), match.group('version'))
+        else:
+            key = re.sub(r'[^A-Za-z0-9_.-]', '_', url)
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path) as f:
+                content = f.read()
+            json.loads(content)  # a truncated document is a cache miss
+            return content
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, url, content):
+        path = self._path(url)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # write to a temp file first so concurrent readers never see a partial document
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
+
+
+def load_credentials(json_cred_path):
+    """ input: path to a service account json key, or empty to use the execution server's default credentials
+        output: explicit (not yet authenticated) credentials
+    """
+    if json_cred_path:
+        return service_account.Credentials.from_service_account_file(json_cred_path, scopes=SCOPES)
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    return credentials
+
+
+def build_client(credentials, cache=None):
+    """ input: credentials
+        output: a compute client, built from the cached discovery document when one is available
+        the client sends its requests through a pool of keep-alive connections, so threads can share it
+    """
+    if _discovery_url:
+        # another endpoint, its document must not replace the cached one of the real API
+        return googleapiclient.discovery.build(API_NAME, API_VERSION, http=HttpPool(credentials),
+                                               discoveryServiceUrl=_discovery_url, cache_discovery=False)
+    return googleapiclient.discovery.build(API_NAME, API_VERSION, http=HttpPool(credentials),
+                                           cache=cache or FileDiscoveryCache())
+
+
+def set_discovery_url(url):
+    """ input: the discovery document url of another compute endpoint, e.g. a local stand-in, None for the real API
+        clients built for the previous endpoint are dropped
+    """
+    global _discovery_url
+    with _clients_lock:
+        _discovery_url = url
+        _clients.clear()
+
+
+def get_credentials(json_cred_path):
+    """ input: credentials path
+        output: the process wide credentials loaded from that path
+    """
+    with _clients_lock:
+        credentials = _credentials.get(json_cred_path)
+        if credentials is None:
+            credentials = load_credentials(json_cred_path)
+            _credentials[json_cred_path] = credentials
+        return credentials
+
+
+def get_client(project, json_cred_path):
+    """ input: project and credentials path
+        output: the process wide compute client for that project and credentials, built on first use
+    """
+    credentials = get_credentials(json_cred_path)
+    key = (project, json_cred_path)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = build_client(credentials)
+            _clients[key] = client
+        return client
+
+
+def release_client(project, json_cred_path):
+    with _clients_lock:
+        _clients.pop((project, json_cred_path), None)
+        if not any(path == json_cred_path for _, path in _clients):
+            _credentials.pop(json_cred_path, None)
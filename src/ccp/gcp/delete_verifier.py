@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+from ccp.gcp.api_executor import is_not_found
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_RETRY_DELAY = 5.0  # seconds, doubled on every retry
+MAX_OUTCOMES = 1000
+
+
+class DeleteOutcome(object):
+    def __init__(self, instance_name, zone):
+        self.instance_name = instance_name
+        self.zone = zone
+        self.started = time.time()
+        self.attempts = 1
+        self.finished = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def succeeded(self):
+        return self.done and self.error is None
+
+    def __str__(self):
+        if not self.done:
+            status = 'pending'
+        elif self.succeeded:
+            status = 'deleted in {0:.1f}s'.format(self.finished - self.started)
+        else:
+            status = 'failed: {0}'.format(self.error)
+        return 'delete {0} in {1} ({2} attempts) {3}'.format(self.instance_name, self.zone, self.attempts, status)
+
+
+class DeleteVerifier(object):
+    """ verifies in the background that accepted instance deletes complete
+        failed deletes are issued again with backoff, and the outcome of every delete is kept for inspection
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY, max_outcomes=MAX_OUTCOMES):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_outcomes = max_outcomes
+        self._outcomes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, service, instance_name, zone, operation):
+        """
+        :param GCPService service: the service that issued the delete, used to wait, retry and log
+        :param dict operation: the accepted delete operation
+        :rtype: DeleteOutcome
+        """
+        outcome = DeleteOutcome(instance_name, zone)
+        with self._lock:
+            self._outcomes.pop((service.project, instance_name), None)
+            self._outcomes[(service.project, instance_name)] = outcome
+            while len(self._outcomes) > self.max_outcomes:
+                self._outcomes.popitem(last=False)
+        self._track(service, outcome, operation)
+        return outcome
+
+    def outcomes(self):
+        with self._lock:
+            return list(self._outcomes.values())
+
+    def outcome(self, project, instance_name):
+        with self._lock:
+            return self._outcomes.get((project, instance_name))
+
+    def pending_count(self):
+        return len([outcome for outcome in self.outcomes() if not outcome.done])
+
+    def _track(self, service, outcome, operation):
+        future = service._get_tracker().register(operation, zone=outcome.zone)
+        future.add_done_callback(lambda f: self._on_done(service, outcome, f.exception()))
+
+    def _on_done(self, service, outcome, error):
+        if error is None or is_not_found(error):
+            outcome.finished = time.time()
+            service.logger.info(str(outcome))
+            return
+
+        if outcome.attempts >= self.max_attempts:
+            outcome.error = error
+            outcome.finished = time.time()
+            service.logger.error(str(outcome))
+            return
+
+        delay = self.retry_delay * 2 ** (outcome.attempts - 1)
+        service.logger.warning('delete {0} failed, retrying in {1}s: {2}'.format(outcome.instance_name, delay, error))
+        timer = threading.Timer(delay, self._retry, args=(service, outcome))
+        timer.daemon = True
+        timer.start()
+
+    def _retry(self, service, outcome):
+        outcome.attempts += 1
+        try:
+            operation = service.issue_delete(outcome.instance_name, outcome.zone)
+        except Exception as e:
+            self._on_done(service, outcome, e)
+            return
+        self._track(service, outcome, operation)
+
+
+delete_verifier = DeleteVerifier()
@@ -0,0 +1,75 @@
+import threading
+
+DEFAULT_WINDOW = 0.5  # seconds a batch stays open for concurrent deploys of the same shape
+MAX_BATCH_SIZE = 100
+
+
+class _Batch(object):
+    def __init__(self):
+        self.names = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = {}
+        self.error = None
+
+
+class DeployCoalescer(object):
+    """ collects concurrent deploys of the same shape over a short window and flushes them together
+        the first caller of a batch becomes its leader: it waits for the window to close, flushes the batch
+        and fans the per instance results back to every caller
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, name, flush, window=DEFAULT_WINDOW):
+        """
+        :param key: hashable shape of the deploy, only deploys with equal keys are coalesced
+        :param str name: the instance name of this deploy
+        :param flush: callable taking the list of instance names of a batch and returning a dict of
+                      name to result, or to the exception raised for that instance
+        :param float window: seconds to wait for more deploys of the same shape
+        :return: the result of this deploy
+        """
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._open[key] = batch
+            batch.names.append(name)
+            if len(batch.names) >= self.max_batch_size:
+                self._close(key, batch)
+
+        if leader:
+            batch.full.wait(window)
+            with self._lock:
+                self._close(key, batch)
+            try:
+                batch.results = flush(list(batch.names))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        result = batch.results.get(name)
+        if result is None:
+            raise Exception('No result for {0} in its deploy batch'.format(name))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _close(self, key, batch):
+        if self._open.get(key) is batch:
+            del self._open[key]
+        batch.full.set()
+
+
+# concurrent Deploy commands of the process meet here to be coalesced
+deploy_coalescer = DeployCoalescer()
@@ -0,0 +1,16 @@
+MAX_FILTER_TERMS = 50  # keep list filters well below the API's filter length limit
+
+
+def name_filter(names):
+    """ input: resource names
+        output: a list filter expression matching any of the names
+    """
+    return ' OR '.join('(name = "{0}")'.format(name) for name in names)
+
+
+def chunks(items, size=MAX_FILTER_TERMS):
+    """ input: a list and a chunk size
+        output: consecutive slices of the list, each at most size long
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
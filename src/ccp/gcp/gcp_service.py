@@ -1,34 +1,143 @@
+import copy
+import json
+import random
 import re
+import threading
+import time
 import traceback
 import uuid
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 from cloudshell.cp.core.models import *
-import googleapiclient.discovery
-import os
+import google_auth_httplib2
+import httplib2
 from wait_operations import *
+from operation_tracker import get_tracker
+from client_registry import get_client, get_credentials, release_client
+from filters import name_filter, chunks
+from teardown import TeardownEngine, TeardownNode
+from resource_cache import template_cache, image_cache, region_zones_cache, instance_zone_cache
+from deploy_coalescer import deploy_coalescer
+from lazy_logging import LogPayload
+from delete_verifier import delete_verifier
+from api_executor import execute, is_not_found
+from rate_limiter import get_rate_limiter
+from token_cache import token_cache
+from tracing import span, current_span
+from googleapiclient.errors import HttpError
+
+DEFAULT_REGION = 'us-west1'
+DEFAULT_ZONE = 'us-west1-b'  # the first choice of its region when neither the app nor the provider set zones
+RESERVATION_LABEL = 'cloudshell-reservation-id'
+SHELL_LABEL = 'cloudshell-shell'
+RESOURCE_LABEL = 'cloudshell-resource'
+RUNNING_STATES = ['PROVISIONING', 'STAGING', 'RUNNING']
+STOPPED_STATES = ['STOPPING', 'TERMINATED']
+SUSPENDED_STATES = ['SUSPENDING', 'SUSPENDED']
+# the only instance fields a deploy cannot know before the instance exists
+ASSIGNED_ADDRESS_FIELDS = 'networkInterfaces(name,subnetwork,networkIP,accessConfigs/natIP)'
+# Instance fields that the InstanceProperties of a bulkInsert does not have
+INSTANCE_ONLY_FIELDS = ('kind', 'zone', 'deletionProtection')
+IP_V4_PATTERN = re.compile(r'^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$')
+DEFAULT_REFRESH_IP_TIMEOUT = 600  # seconds
+MIN_IP_POLL_INTERVAL = 1.0
+MAX_IP_POLL_INTERVAL = 10.0
+
+_token_lock = threading.Lock()
+_compiled_patterns = {}
+
+
+def _compile(pattern):
+    """
+    :return: the compiled pattern, compiled once per process
+    """
+    compiled = _compiled_patterns.get(pattern)
+    if compiled is None:
+        compiled = _compiled_patterns[pattern] = re.compile(pattern)
+    return compiled
 
 
 class GCPService:
-    def __init__(self, project, json_cred_path, logger=None):
+    def __init__(self, project, json_cred_path, logger=None, minimize_round_trips=True,
+                 deploy_coalesce_window=0):
+        """
+        :param bool minimize_round_trips: build links and ids from operations and request bodies instead of
+                                          reading them back with extra GET calls
+        :param float deploy_coalesce_window: seconds to collect concurrent deploys of the same shape into one
+                                             bulkInsert, 0 (the default) inserts every instance on its own,
+                                             a lone deploy waits out the whole window
+        """
         self.project = project
         self.logger = logger
+        self.minimize_round_trips = minimize_round_trips
+        self.deploy_coalesce_window = deploy_coalesce_window
+        self.json_cred_path = json_cred_path
         self.client = None
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = json_cred_path
-
-        pass
+        self.credentials = get_credentials(json_cred_path)
 
     def _get_client(self):
         if self.client:
             return self.client
 
-        self.client = googleapiclient.discovery.build('compute', 'v1')
+        self.client = get_client(self.project, self.json_cred_path)
         return self.client
 
+    #######################################################
+    # Session lifecycle                                   #
+    #######################################################
+
+    def matches(self, project, json_cred_path):
+        return self.project == project and self.json_cred_path == json_cred_path
+
+    def with_logger(self, logger):
+        """
+        :return: a view of this service that shares its client and credentials but logs to the given logger
+        :rtype: GCPService
+        """
+        service = copy.copy(self)
+        service.logger = logger
+        return service
+
+    def warm_up(self):
+        """
+        builds the client and fetches an access token, so the first command only pays for its own API calls
+        """
+        self._get_client()
+        self.refresh_token()
+
+    def refresh_token(self):
+        """
+        refreshes the access token when it is missing or about to expire
+        a token another driver process already refreshed is reused from the shared token cache
+        """
+        with _token_lock:
+            token_cache.refresh(self.credentials, google_auth_httplib2.Request(httplib2.Http()))
+
+    def release(self):
+        release_client(self.project, self.json_cred_path)
+        self.client = None
+
+    def set_rate_limits(self, read_rate=None, mutation_rate=None):
+        """
+        :param float read_rate: read calls per second allowed for the project, shared by every command
+        :param float mutation_rate: mutating calls per second allowed for the project
+        """
+        get_rate_limiter(self.project).configure(read_rate=read_rate, mutation_rate=mutation_rate)
+
+    def _execute(self, request):
+        return execute(request, self.project)
+
+    def _get_tracker(self):
+        return get_tracker(self._get_client(), self.project, logger=self.logger)
+
     def can_connect(self):
         ret = False
 
         client = self._get_client()
 
-        response = client.healthChecks().list(project=self.project).execute()
+        response = self._execute(client.healthChecks().list(project=self.project))
 
         return len(response) > 0
 
@@ -55,7 +164,7 @@ class GCPService:
 
         cidr = prepare_infra_action.actionParams.cidr
         network_link = None
-        region = "us-west1" #TODO: take from resource, maybe in init
+        region = self._get_region(cloud_provider_resource)
 
         try:
             # handle PrepareInfraAction - extract sandbox CIDR and create/allocate a network in the cloud provider with
@@ -81,12 +190,15 @@ class GCPService:
             }
 
             request = client.networks().insert(project=self.project, body=network_body)
-            response = request.execute()
-            global_wait(client, self.project, response['name'])
+            response = self._execute(request)
+            operation = global_wait(client, self.project, response['name'], logger=self.logger)
 
-            request = client.networks().get(project=self.project, network=network_name)
-            response = request.execute()
-            network_link = response["selfLink"]
+            if self.minimize_round_trips:
+                network_link = operation['targetLink']
+            else:
+                request = client.networks().get(project=self.project, network=network_name)
+                response = self._execute(request)
+                network_link = response["selfLink"]
 
             results.append(PrepareCloudInfraResult(prepare_infra_action.actionId))
         except:
@@ -112,11 +224,14 @@ class GCPService:
         #check_cancellation_context_and_do_rollback(cancellation_context)
 
         # handle PrepareSubnetsAction
+        # all inserts are issued first and their operations awaited together, so preparing N subnets takes about
+        # as long as preparing one
+        subnet_results = {}
+        pending_subnets = []
+        tracker = self._get_tracker()
+
         for action in prepare_subnet_actions:
             try:
-                # subnet = driver.ex_create_subnetwork('sub1', action.actionParams.cidr, network_custom, region)
-                #network_custom = client.ex_get_network('networkvpc1')
-
                 subnet_name = self.normalize_name(action.actionParams.alias) + '-' + str(uuid.uuid4())[:6]
                 cidr = action.actionParams.cidr
                 subnetwork_body = {
@@ -128,18 +243,25 @@ class GCPService:
                 }
 
                 request = client.subnetworks().insert(project=self.project, region=region, body=subnetwork_body)
-                response = request.execute()
-                region_wait(client, self.project, region, response['name'])
+                response = self._execute(request)
+                pending_subnets.append((action, subnet_name, tracker.register(response, region=region)))
+            except:
+                self.logger.error(traceback.format_exc())
+                subnet_results[action.actionId] = PrepareSubnetActionResult(action.actionId,
+                                                                            success=False,
+                                                                            errorMessage=traceback.format_exc())
 
-                # subnet_id = HeavenlyCloudService.prepare_subnet(action.actionParams.cidr,
-                #                                                 action.actionParams.isPublic,
-                #                                                 action.actionParams.subnetServiceAttributes)
-                results.append(PrepareSubnetActionResult(action.actionId, subnet_id=subnet_name))
+        for action, subnet_name, future in pending_subnets:
+            try:
+                future.result()
+                subnet_results[action.actionId] = PrepareSubnetActionResult(action.actionId, subnet_id=subnet_name)
             except:
                 self.logger.error(traceback.format_exc())
-                results.append(PrepareSubnetActionResult(action.actionId,
-                                                         success=False,
-                                                         errorMessage=traceback.format_exc()))
+                subnet_results[action.actionId] = PrepareSubnetActionResult(action.actionId,
+                                                                            success=False,
+                                                                            errorMessage=traceback.format_exc())
+
+        results.extend(subnet_results[action.actionId] for action in prepare_subnet_actions)
 
         #check_cancellation_context_and_do_rollback(cancellation_context)
 
@@ -151,22 +273,130 @@ class GCPService:
         client = self._get_client()
 
         network_name = "netvpc-" + reservation_id
-        region = "us-west1"  # TODO: take from resource, maybe in init
 
         request = client.networks().get(project=self.project, network=network_name)
-        response = request.execute()
+        network = self._execute(request)
 
-        for sn in response['subnetworks']:
-            request = client.subnetworks().delete(project=self.project, region=region, subnetwork=sn.split("/")[-1])
-            response = request.execute()
-            region_wait(client, self.project, region, response['name'])
+        engine = TeardownEngine(self._get_tracker(), self.logger)
+        with span('teardown'):
+            failed = engine.run(self._reservation_teardown_layers(reservation_id, network))
 
-        request = client.networks().delete(project=self.project, network=network_name)
-        response = request.execute()
-        #global_wait(client, self.project, response['name']) # no need to wait at teardown
+        if failed:
+            return CleanupNetworkResult(actionId=cleanup_action.actionId,
+                                        success=False,
+                                        errorMessage='Failed to delete: ' + ', '.join(str(node) for node in failed))
 
         return CleanupNetworkResult(actionId=cleanup_action.actionId)
 
+    def _reservation_teardown_layers(self, reservation_id, network):
+        """
+        :param dict network: network resource json
+        :return: the resources of the reservation, in the order they have to be deleted
+        :rtype: List[List[TeardownNode]]
+        """
+        client = self._get_client()
+        network_filter = 'network = "{}"'.format(network['selfLink'])
+        reservation_filter = self._reservation_filter(reservation_id)
+
+        # instances and disks carry the reservation label, networks, firewalls and routes can not be labeled
+        instances = []
+        for instance in self._aggregated_instances(filter=reservation_filter):
+            zone = instance['zone'].split('/')[-1]
+            instances.append(TeardownNode('instance', instance['name'], zone=zone,
+                                          delete=self._delete_call(client.instances(), zone=zone,
+                                                                   instance=instance['name'])))
+
+        attached = []
+        # only disks left behind by their instances, attached disks are auto deleted with their instance
+        for disk in self._aggregated_items(client.disks(), 'disks', filter=reservation_filter):
+            if disk.get('users'):
+                continue
+            zone = disk['zone'].split('/')[-1]
+            attached.append(TeardownNode('disk', disk['name'], zone=zone,
+                                         delete=self._delete_call(client.disks(), zone=zone, disk=disk['name'])))
+        for firewall in self._list(client.firewalls(), filter=network_filter):
+            attached.append(TeardownNode('firewall', firewall['name'],
+                                         delete=self._delete_call(client.firewalls(), firewall=firewall['name'])))
+        for route in self._list(client.routes(), filter=network_filter):
+            # the generated default and subnet routes are removed together with the network
+            if route['name'].startswith('default-route-'):
+                continue
+            attached.append(TeardownNode('route', route['name'],
+                                         delete=self._delete_call(client.routes(), route=route['name'])))
+        for subnet_link in network.get('subnetworks', []):
+            region, subnet_name = subnet_link.split('/')[-3], subnet_link.split('/')[-1]
+            attached.append(TeardownNode('subnetwork', subnet_name, region=region,
+                                         delete=self._delete_call(client.subnetworks(), region=region,
+                                                                  subnetwork=subnet_name)))
+
+        network_node = TeardownNode('network', network['name'],
+                                    delete=self._delete_call(client.networks(), network=network['name']))
+
+        return [instances, attached, [network_node]]
+
+    def _reservation_instances(self, reservation_id):
+        """
+        :return: the instances deployed by the reservation, found by their reservation label
+        :rtype: List[dict]
+        """
+        return list(self._aggregated_instances(filter=self._reservation_filter(reservation_id)))
+
+    @staticmethod
+    def reservation_labels(reservation_id, cloud_provider_resource):
+        """
+        :return: the labels of every resource deployed for the reservation
+        :rtype: dict
+        """
+        return {
+            RESERVATION_LABEL: GCPService._label_value(reservation_id),
+            SHELL_LABEL: GCPService._label_value(cloud_provider_resource.cloudshell_model_name),
+            RESOURCE_LABEL: GCPService._label_value(cloud_provider_resource.name)
+        }
+
+    @staticmethod
+    def _reservation_filter(reservation_id):
+        return 'labels.{} = "{}"'.format(RESERVATION_LABEL, GCPService._label_value(reservation_id))
+
+    @staticmethod
+    def _label_value(value):
+        # label values may only hold lowercase letters, digits, '-' and '_', up to 63 characters
+        return re.sub('[^a-z0-9_-]', '-', (value or '').lower())[:63]
+
+    def _delete_call(self, resource, **kwargs):
+        """
+        :return: a callable that issues the delete and returns its operation json
+        """
+        return lambda: self._execute(resource.delete(project=self.project, **kwargs))
+
+    def _list(self, resource, **kwargs):
+        """
+        iterates over all the items of a list call, following its pages
+        """
+        request = resource.list(project=self.project, **kwargs)
+        while request is not None:
+            response = self._execute(request)
+            for item in response.get('items', []):
+                yield item
+            request = resource.list_next(request, response)
+
+    def _aggregated_instances(self, **kwargs):
+        """
+        iterates over the instances of all zones returned by instances().aggregatedList, following its pages
+        """
+        return self._aggregated_items(self._get_client().instances(), 'instances', **kwargs)
+
+    def _aggregated_items(self, resource, items_key, **kwargs):
+        """
+        iterates over the items of all scopes returned by an aggregatedList call, following its pages
+        """
+        request = resource.aggregatedList(project=self.project, **kwargs)
+        while request is not None:
+            response = self._execute(request)
+            for scoped_list in response.get('items', {}).values():
+                for item in scoped_list.get(items_key, []):
+                    yield item
+            request = resource.aggregatedList_next(request, response)
+
     #######################################################
     # VM functions                                        #
     #######################################################
@@ -215,7 +445,10 @@ class GCPService:
                                                       deployment_model_attributes[deployment_path + '.Disk Type'],
                                                       deployment_model_attributes[deployment_path + '.Disk Size'],
                                                       network_data,
-                                                      image_source_type=deployment_model_attributes[deployment_path + '.Image Source'])
+                                                      image_source_type=deployment_model_attributes[deployment_path + '.Image Source'],
+                                                      app_zone=deployment_model_attributes.get(deployment_path + '.Zone', ''),
+                                                      labels=self.reservation_labels(context.reservation.reservation_id,
+                                                                                     cloud_provider_resource))
             except Exception as e:
                 self.logger.exception("==>")
                 return DeployAppResult(actionId=deploy_app_action.actionId, success=False, errorMessage=e.message)
@@ -271,7 +504,11 @@ class GCPService:
                                                                     cloud_provider_resource,
                                                                     vm_unique_name,
                                                                     deployment_model_attributes[deployment_path + '.Template Name'],
-                                                                    network_data)
+                                                                    network_data,
+                                                                    app_zone=deployment_model_attributes.get(deployment_path + '.Zone', ''),
+                                                                    labels=self.reservation_labels(
+                                                                        context.reservation.reservation_id,
+                                                                        cloud_provider_resource))
             except Exception as e:
                 return DeployAppResult(actionId=deploy_app_action.actionId, success=False, errorMessage=e.message)
 
@@ -293,12 +530,9 @@ class GCPService:
 
     def _create_instance(self, actionId, cloud_provider_resource, vm_unique_name, image_project, image_id, machine_type,
                          disk_type, disk_size, network_data, input_user='', decrypted_input_password='',
-                         image_source_type='public'):
-
-        client = self._get_client()
+                         image_source_type='public', app_zone='', labels=None):
 
-        region = "us-west1"  # TODO: take from resource, maybe in init
-        zone = 'us-west1-b' # TODO: take from app? or cp?
+        region = self._get_region(cloud_provider_resource)
         subnet = network_data.keys()[0] # TODO: handle multiple networks?
         disk_size = disk_size.lower().replace("gb","") # just in case someone provides value as 10GB
 
@@ -306,70 +540,74 @@ class GCPService:
 
         source_image_uri = self._prepare_source_image(image_id, image_project, image_source_type)
 
-        instance_body = {
-            "kind": "compute#instance",
-            "name": vm_unique_name,
-            "zone": "projects/{}/zones/{}".format(self.project, zone),
-            "machineType": "projects/{}/zones/{}/machineTypes/{}".format(self.project, zone, machine_type),
-            "displayDevice": {
-                "enableDisplay": False
-            },
-            "metadata": {
-                "kind": "compute#metadata",
-                "items": []
-            },
-            "tags": {
-                "items": []
-            },
-            "disks": [
-                {
-                    "kind": "compute#attachedDisk",
-                    "type": "PERSISTENT",
-                    "boot": True,
-                    "mode": "READ_WRITE",
-                    "autoDelete": True,
-                    "deviceName": "instance-1",
-                    "initializeParams": {
-                        "sourceImage": source_image_uri,
-                        "diskType": "projects/{}/zones/{}/diskTypes/pd-{}".format(self.project, zone, diskType),
-                        "diskSizeGb": disk_size
-                    }
-                }
-            ],
-            "canIpForward": False,
-            "networkInterfaces": [
-                {
-                    "kind": "compute#networkInterface",
-                    "subnetwork": "projects/{}/regions/{}/subnetworks/{}".format(self.project, region, subnet),
-                    "accessConfigs": [
-                        {
-                            "kind": "compute#accessConfig",
-                            "name": "External NAT",
-                            "type": "ONE_TO_ONE_NAT",
-                            "networkTier": "STANDARD"
+        def instance_body_for(zone):
+            return {
+                "kind": "compute#instance",
+                "name": vm_unique_name,
+                "zone": "projects/{}/zones/{}".format(self.project, zone),
+                "machineType": "projects/{}/zones/{}/machineTypes/{}".format(self.project, zone, machine_type),
+                "displayDevice": {
+                    "enableDisplay": False
+                },
+                "metadata": {
+                    "kind": "compute#metadata",
+                    "items": []
+                },
+                "tags": {
+                    "items": []
+                },
+                "disks": [
+                    {
+                        "kind": "compute#attachedDisk",
+                        "type": "PERSISTENT",
+                        "boot": True,
+                        "mode": "READ_WRITE",
+                        "autoDelete": True,
+                        "deviceName": "instance-1",
+                        "initializeParams": {
+                            "sourceImage": source_image_uri,
+                            "diskType": "projects/{}/zones/{}/diskTypes/pd-{}".format(self.project, zone, diskType),
+                            "diskSizeGb": disk_size,
+                            "labels": labels or {}
                         }
-                    ],
-                    "aliasIpRanges": []
-                }
-            ],
-            "description": "",
-            "labels": {},
-            "scheduling": {
-                "preemptible": False,
-                "onHostMaintenance": "MIGRATE",
-                "automaticRestart": True,
-                "nodeAffinities": []
-            },
-            "deletionProtection": False
-        }
-
-        self.logger.info("instance_body: " + str(instance_body))
+                    }
+                ],
+                "canIpForward": False,
+                "networkInterfaces": [
+                    {
+                        "kind": "compute#networkInterface",
+                        "subnetwork": "projects/{}/regions/{}/subnetworks/{}".format(self.project, region, subnet),
+                        "accessConfigs": [
+                            {
+                                "kind": "compute#accessConfig",
+                                "name": "External NAT",
+                                "type": "ONE_TO_ONE_NAT",
+                                "networkTier": "STANDARD"
+                            }
+                        ],
+                        "aliasIpRanges": []
+                    }
+                ],
+                "description": "",
+                "labels": labels or {},
+                "scheduling": {
+                    "preemptible": False,
+                    "onHostMaintenance": "MIGRATE",
+                    "automaticRestart": True,
+                    "nodeAffinities": []
+                },
+                "deletionProtection": False
+            }
 
-        request = client.instances().insert(project=self.project, zone=zone, body=instance_body)
-        response = request.execute()
-        zone_wait(client, self.project, zone, response['name'])
+        # the zone is only known once the instance is placed
+        self.logger.info('instance_body: %s', LogPayload(instance_body_for(app_zone or '{zone}')))
 
-        vm_details_data = self.extract_vm_details(vm_unique_name, zone)
+        try:
+            zone, vm_details_data = self._place_instance(cloud_provider_resource, app_zone, instance_body_for)
+        except Exception:
+            # the image may have been deleted or deprecated since it was resolved
+            image_cache.invalidate(self._image_cache_key(image_id, image_project, image_source_type))
+            raise
 
         return DeployAppResult(actionId=actionId,
                                success=True,
@@ -379,30 +617,77 @@ class GCPService:
                                vmDetailsData=vm_details_data)
 
     def _prepare_source_image(self, image_id, image_project, image_source_type):
-        source_image_uri = ""
+        """
+        resolves the image (or image family) to a concrete image link, so a bad image fails before the insert
+        resolutions are cached across commands
+        :rtype: str
+        """
+        key = self._image_cache_key(image_id, image_project, image_source_type)
+        source_image_uri = image_cache.get_or_load(key, lambda: self._resolve_image(*key))
+        self.logger.debug("image cache: {}".format(image_cache.stats()))
+
+        return source_image_uri
+
+    def _image_cache_key(self, image_id, image_project, image_source_type):
         if image_source_type == "public":
-            source_image_uri = "projects/{}/global/images/{}".format(image_project, image_id)
+            return image_project, image_id
         elif image_source_type == "private":
-            source_image_uri = "global/images/{}".format(image_id)
+            return self.project, image_id
         else:
             raise ValueError("Unsupported image source {}".format(image_source_type))
 
-        return source_image_uri
+    def _resolve_image(self, image_project, image_id):
+        client = self._get_client()
+        try:
+            image = self._execute(client.images().get(project=image_project, image=image_id, fields='selfLink,status'))
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            try:
+                # not an image name, try it as an image family
+                image = self._execute(client.images().getFromFamily(project=image_project, family=image_id,
+                                                                    fields='selfLink,status'))
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                raise ValueError("Image or image family {} was not found in project {}".format(image_id,
+                                                                                               image_project))
 
-    def _create_instance_from_template(self, actionId, cloud_provider_resource, vm_unique_name, template_name,
-                                       network_data, input_user='', decrypted_input_password=''):
+        if image.get('status', 'READY') != 'READY':
+            raise ValueError("Image {} is not ready (status {})".format(image_id, image['status']))
 
-        client = self._get_client()
+        return image['selfLink']
+
+    def _resolve_template(self, template_name):
+        """
+        resolves the instance template link and labels, cached across commands
+        :rtype: (str, dict)
+        """
+        def load():
+            request = self._get_client().instanceTemplates().get(project=self.project, instanceTemplate=template_name,
+                                                                 fields='selfLink,properties/labels')
+            response = self._execute(request)
+            return response["selfLink"], response.get("properties", {}).get("labels", {})
 
-        region = "us-west1"  # TODO: take from resource, maybe in init
-        zone = 'us-west1-b' # TODO: take from app? or cp?
+        instance_template_url, template_labels = template_cache.get_or_load((self.project, template_name), load)
+        self.logger.debug("template cache: {}".format(template_cache.stats()))
+
+        return instance_template_url, template_labels
+
+    def _create_instance_from_template(self, actionId, cloud_provider_resource, vm_unique_name, template_name,
+                                       network_data, input_user='', decrypted_input_password='', app_zone='',
+                                       labels=None):
+
+        region = self._get_region(cloud_provider_resource)
         subnet = network_data.keys()[0] # TODO: handle multiple networks?
 
-        request = client.instanceTemplates().get(project=self.project, instanceTemplate=template_name)
-        response = request.execute()
-        instance_template_url = response["selfLink"]
+        instance_template_url, template_labels = self._resolve_template(template_name)
+
+        # instance labels replace the template's, so the template labels are merged in to keep them
+        instance_labels = dict(template_labels, **(labels or {}))
 
         body_for_template = {"name": vm_unique_name,
+                             "labels": instance_labels,
                              "networkInterfaces": [
                                  {
                                      "kind": "compute#networkInterface",
@@ -418,12 +703,13 @@ class GCPService:
                                      ],
                                      "aliasIpRanges": []
                                  }]}
-        request = client.instances().insert(project=self.project, zone=zone, body=body_for_template,
-                                            sourceInstanceTemplate=instance_template_url)
-        response = request.execute()
-        zone_wait(client, self.project, zone, response['name'])
-
-        vm_details_data = self.extract_vm_details(vm_unique_name, zone)
+        try:
+            zone, vm_details_data = self._place_instance(cloud_provider_resource, app_zone,
+                                                         lambda zone: body_for_template, instance_template_url)
+        except Exception:
+            # the template may have been replaced since it was resolved
+            template_cache.invalidate((self.project, template_name))
+            raise
 
         return DeployAppResult(actionId=actionId,
                                success=True,
@@ -432,29 +718,387 @@ class GCPService:
                                deployedAppAddress=vm_details_data.vmNetworkData[0].privateIpAddress,
                                vmDetailsData=vm_details_data)
 
-    def delete_vm(self, instance_name):
+    #######################################################
+    # Placement                                           #
+    #######################################################
+
+    def _get_region(self, cloud_provider_resource):
+        return cloud_provider_resource.region or DEFAULT_REGION
+
+    def _candidate_zones(self, cloud_provider_resource, app_zone=''):
+        """
+        :return: the zones to deploy to, in order of preference: the app's zone, the cloud provider's 'Zones'
+                 and then the remaining zones of the region
+        :rtype: List[str]
+        :raises ValueError: if the app's zone or one of the 'Zones' is not in the cloud provider's region
+        """
+        region = self._get_region(cloud_provider_resource)
+
+        def load_region_zones():
+            request = self._get_client().regions().get(project=self.project, region=region, fields='zones')
+            return sorted(link.split('/')[-1] for link in self._execute(request)['zones'])
+
+        region_zones = region_zones_cache.get_or_load((self.project, region), load_region_zones)
+
+        preferred = [app_zone] if app_zone else []
+        preferred.extend(zone.strip() for zone in (cloud_provider_resource.zones or '').split(',') if zone.strip())
+
+        # subnets are regional, instances in other regions could not attach to them
+        outside = [zone for zone in preferred if zone not in region_zones]
+        if outside:
+            raise ValueError('zones {} are not in the region {} of the cloud provider'.format(', '.join(outside),
+                                                                                              region))
+        if not preferred and DEFAULT_ZONE in region_zones:
+            preferred = [DEFAULT_ZONE]
+
+        candidates = []
+        for zone in preferred + region_zones:
+            if zone not in candidates:
+                candidates.append(zone)
+        return candidates
+
+    def _place_instance(self, cloud_provider_resource, app_zone, instance_body_for, source_instance_template=None):
+        """
+        creates the instance in the first candidate zone that has capacity for it
+        with a 'Zone Race Count' above 1 the insert is raced in that many zones at once, the first instance to run
+        wins and the others are deleted
+        :param instance_body_for: callable returning the instance body for a zone
+        :return: the zone and details of the instance
+        :rtype: (str, VmDetailsData)
+        """
+        zones = self._candidate_zones(cloud_provider_resource, app_zone)
+        race_count = max(int(cloud_provider_resource.zone_race_count or 1), 1)
+        error = ValueError('No zones available in region {}'.format(self._get_region(cloud_provider_resource)))
+
+        for i in range(0, len(zones), race_count):
+            group = zones[i:i + race_count]
+            try:
+                if len(group) == 1:
+                    zone = group[0]
+                    vm_details = self._insert_instance(zone, instance_body_for(zone), source_instance_template)
+                else:
+                    zone, vm_details = self._race_instance(group, instance_body_for, source_instance_template)
+            except Exception as e:
+                if not is_capacity_error(e):
+                    raise
+                self.logger.warning('No capacity in {}, trying the next zones: {}'.format(group, e))
+                error = e
+                continue
+
+            instance_zone_cache.set((self.project, instance_body_for(zone)['name']), zone)
+            return zone, vm_details
+
+        raise error
+
+    def _race_instance(self, zones, instance_body_for, source_instance_template=None):
+        """
+        inserts the instance in all the zones at once
+        :return: the zone and details of the first instance to run
+        :rtype: (str, VmDetailsData)
+        """
+        results = queue.Queue()
+        parent = current_span()
+
+        def attempt(zone):
+            try:
+                with span('zone_attempt', parent=parent, zone=zone):
+                    body = instance_body_for(zone)
+                    results.put((zone, self._insert_single_instance(zone, body, source_instance_template), None))
+            except Exception as e:
+                results.put((zone, None, e))
+
+        for zone in zones:
+            thread = threading.Thread(target=attempt, args=(zone,), name='gcp-zone-race-' + zone)
+            thread.daemon = True
+            thread.start()
+
+        errors = []
+        for remaining in range(len(zones), 0, -1):
+            zone, vm_details, error = results.get()
+            if error is None:
+                self.logger.info('Zone race won by {}'.format(zone))
+                self._delete_race_losers(results, remaining - 1, instance_body_for(zone)['name'])
+                return zone, vm_details
+            errors.append(error)
+
+        if any(not is_capacity_error(e) for e in errors):
+            raise next(e for e in errors if not is_capacity_error(e))
+        raise errors[-1]
+
+    def _delete_race_losers(self, results, count, instance_name):
+        """
+        deletes, in the background, the instances of the zones that finish the race after the winner
+        only zones out of capacity are skipped, an insert that failed otherwise, e.g. timed out, may still create one
+        :return: the reaping thread
+        """
+        def reap():
+            client = self._get_client()
+            for _ in range(count):
+                zone, vm_details, error = results.get()
+                if error is not None and is_capacity_error(error):
+                    continue
+                try:
+                    self._execute(client.instances().delete(project=self.project, zone=zone, instance=instance_name))
+                    self.logger.info('Deleted zone race loser {} in {}'.format(instance_name, zone))
+                except Exception as e:
+                    # a 404 means the insert never created it
+                    if not is_not_found(e):
+                        self.logger.exception('Failed to delete zone race loser {} in {}'.format(instance_name, zone))
+
+        thread = threading.Thread(target=reap, name='gcp-zone-race-reaper')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _find_instance_zone(self, instance_name):
+        """
+        :return: the zone of an existing instance, remembered from its deploy or looked up with one aggregatedList
+        :rtype: str
+        """
+        def lookup():
+            candidates = list(self._aggregated_instances(filter=name_filter([instance_name])))
+            if not candidates:
+                raise ValueError('VM {} was not found'.format(instance_name))
+            return self._pick_instance(instance_name, candidates)['zone'].split('/')[-1]
+
+        return instance_zone_cache.get_or_load((self.project, instance_name), lookup)
+
+    def _pick_instance(self, instance_name, candidates):
+        """
+        zone race losers carry the winner's name until they are deleted, so a name may match instances in
+        several zones: the one in the zone the deploy placed it in wins, then any that is not being deleted
+        :param List[dict] candidates: the instances named instance_name
+        :rtype: dict
+        """
+        if len(candidates) == 1:
+            return candidates[0]
+        placed_zone = instance_zone_cache.get((self.project, instance_name))
+        for instance in candidates:
+            if instance['zone'].split('/')[-1] == placed_zone:
+                return instance
+        alive = [instance for instance in candidates if instance.get('status') not in STOPPED_STATES]
+        return (alive or candidates)[0]
+
+    def _insert_instance(self, zone, instance_body, source_instance_template=None):
+        """
+        inserts the instance and waits for it to run
+        concurrent inserts of the same shape are coalesced into a single instances().bulkInsert
+        :rtype: VmDetailsData
+        """
+        if not self.deploy_coalesce_window:
+            return self._insert_single_instance(zone, instance_body, source_instance_template)
+
+        shape = dict((key, value) for key, value in instance_body.items() if key != 'name')
+        batch_key = (self.project, zone, source_instance_template, json.dumps(shape, sort_keys=True))
+
+        return deploy_coalescer.submit(batch_key, instance_body['name'],
+                                       lambda names: self._insert_instances(zone, shape, names,
+                                                                            source_instance_template),
+                                       window=self.deploy_coalesce_window)
+
+    def _insert_single_instance(self, zone, instance_body, source_instance_template=None):
+        client = self._get_client()
+        kwargs = {'sourceInstanceTemplate': source_instance_template} if source_instance_template else {}
+
+        with span('insert', zone=zone, instances=1):
+            request = client.instances().insert(project=self.project, zone=zone, body=instance_body, **kwargs)
+            response = self._execute(request)
+        with span('operation_wait', zone=zone):
+            operation = self._get_tracker().register(response, zone=zone).result()
+
+        with span('detail_fetch', zone=zone):
+            return self._deployed_vm_details(operation, instance_body['name'], zone)
+
+    def _insert_instances(self, zone, shape, names, source_instance_template=None):
+        """
+        creates all the named instances of the same shape with one instances().bulkInsert
+        :return: VmDetailsData, or the error of that instance, by instance name
+        :rtype: dict
+        """
+        if len(names) == 1:
+            body = dict(shape, name=names[0])
+            return {names[0]: self._insert_single_instance(zone, body, source_instance_template)}
+
+        self.logger.info("coalescing {} deploys into one bulkInsert: {}".format(len(names), names))
+
+        bulk_body = {
+            "count": len(names),
+            "perInstanceProperties": dict((name, {}) for name in names),
+            "instanceProperties": self._instance_properties(shape)
+        }
+        if source_instance_template:
+            # the instance properties are merged over the template
+            bulk_body["sourceInstanceTemplate"] = source_instance_template
 
         client = self._get_client()
+        with span('insert', zone=zone, instances=len(names)):
+            request = client.instances().bulkInsert(project=self.project, zone=zone, body=bulk_body)
+            response = self._execute(request)
+        with span('operation_wait', zone=zone):
+            self._get_tracker().register(response, zone=zone).result()
+
+        with span('detail_fetch', zone=zone):
+            vms_details = self.get_vms_details(names)
+
+        results = {}
+        for vm_details in vms_details:
+            if vm_details.errorMessage:
+                results[vm_details.appName] = Exception(vm_details.errorMessage)
+            else:
+                results[vm_details.appName] = vm_details
+        return results
 
-        zone = 'us-west1-b'  # TODO: take from app? or cp?
+    @staticmethod
+    def _instance_properties(shape):
+        """
+        converts an instance body (without its name) to the instanceProperties bulkInsert expects,
+        which reference machine and disk types by name instead of by zonal link
+        """
+        properties = json.loads(json.dumps(shape))
+        for field in INSTANCE_ONLY_FIELDS:
+            properties.pop(field, None)
+        if "machineType" in properties:
+            properties["machineType"] = properties["machineType"].split('/')[-1]
+        for disk in properties.get("disks", []):
+            initialize_params = disk.get("initializeParams", {})
+            if "diskType" in initialize_params:
+                initialize_params["diskType"] = initialize_params["diskType"].split('/')[-1]
+        return properties
+
+    def delete_vm(self, instance_name, wait=True):
+        """
+        :param bool wait: False returns as soon as GCP accepted the delete, its completion is then verified
+                          (and the delete retried if needed) in the background
+        """
+        zone = self._find_instance_zone(instance_name)
 
-        request = client.instances().delete(project=self.project, zone=zone, instance=instance_name)
-        response = request.execute()
-        zone_wait(client, self.project, zone, response['name'])
+        response = self.issue_delete(instance_name, zone)
+        instance_zone_cache.invalidate((self.project, instance_name))
+
+        if not wait:
+            delete_verifier.submit(self, instance_name, zone, response)
+            return True
+
+        self._get_tracker().register(response, zone=zone).result()
         return True
 
-    def set_power_on(self, vm_uuid):
-        pass
+    def issue_delete(self, instance_name, zone):
+        """
+        :return: the delete operation
+        :rtype: dict
+        """
+        request = self._get_client().instances().delete(project=self.project, zone=zone, instance=instance_name)
+        return self._execute(request)
+
+    def set_power_on(self, vm_name):
+        """
+        starts the instance, or resumes it when it was suspended
+        """
+        self._raise_power_errors(self.set_power_state([vm_name], power_on=True))
+
+    def set_power_off(self, vm_name, suspend=False):
+        """
+        stops the instance, or suspends it to keep its memory state so that powering it on is faster than a cold boot
+        """
+        self._raise_power_errors(self.set_power_state([vm_name], power_on=False, suspend=suspend))
+
+    def power_cycle(self, vm_name, delay=0, suspend=False):
+        self.set_power_off(vm_name, suspend=suspend)
+        time.sleep(delay)
+        self.set_power_on(vm_name)
+
+    def set_reservation_power(self, reservation_id, power_on, suspend=False):
+        """
+        powers every instance of the reservation in parallel
+        :return: the error of each instance that failed, by instance name
+        :rtype: dict
+        """
+        names = [instance['name'] for instance in self._reservation_instances(reservation_id)]
+        return dict((name, error) for name, error in self.set_power_state(names, power_on, suspend).items() if error)
+
+    def set_power_state(self, vm_names, power_on, suspend=False):
+        """
+        issues the start/resume or stop/suspend calls of all the instances, then waits for all of them together
+        instances already in the requested state are left alone
+        :return: None, or the error of that instance, by instance name
+        :rtype: dict
+        """
+        client = self._get_client()
+        instances = {}
+        for names in chunks(sorted(set(vm_names))):
+            for instance in self._aggregated_instances(filter=name_filter(names)):
+                instances[instance['name']] = instance
+
+        errors = {}
+        pending = []
+        for vm_name in vm_names:
+            instance = instances.get(vm_name)
+            if instance is None:
+                errors[vm_name] = ValueError('VM {} was not found'.format(vm_name))
+                continue
+
+            status = instance['status']
+            if power_on:
+                method = None if status in RUNNING_STATES else 'resume' if status in SUSPENDED_STATES else 'start'
+            elif suspend:
+                method = None if status in SUSPENDED_STATES + STOPPED_STATES else 'suspend'
+            else:
+                method = None if status in STOPPED_STATES else 'stop'
+
+            errors[vm_name] = None
+            if method is None:
+                continue
+
+            zone = instance['zone'].split('/')[-1]
+            try:
+                self.logger.info('{} {} ({})'.format(method, vm_name, status))
+                request = getattr(client.instances(), method)(project=self.project, zone=zone, instance=vm_name)
+                pending.append((vm_name, self._get_tracker().register(self._execute(request), zone=zone)))
+            except Exception as e:
+                errors[vm_name] = e
+
+        for vm_name, future in pending:
+            errors[vm_name] = future.exception()
 
-    def set_power_off(self, vm_uuid):
-        pass
+        return errors
+
+    @staticmethod
+    def _raise_power_errors(errors):
+        for vm_name, error in errors.items():
+            if error:
+                raise error
+
+    def _deployed_vm_details(self, operation, vm_unique_name, zone):
+        """
+        :param dict operation: the finished insert operation of the instance
+        :rtype: VmDetailsData
+        """
+        if not self.minimize_round_trips:
+            return self.extract_vm_details(vm_unique_name, zone)
+
+        # the instance id comes with the operation, only the assigned addresses have to be fetched
+        client = self._get_client()
+        request = client.instances().get(project=self.project, zone=zone, instance=vm_unique_name,
+                                         fields=ASSIGNED_ADDRESS_FIELDS)
+        response = self._execute(request)
+        response['id'] = operation['targetId']
+
+        return self._vm_details_from_instance(response)
 
     def extract_vm_details(self, vm_unique_name, zone):
 
         client = self._get_client()
         request = client.instances().get(project=self.project, zone=zone, instance=vm_unique_name)
-        response = request.execute()
+        response = self._execute(request)
+
+        return self._vm_details_from_instance(response)
 
+    @staticmethod
+    def _vm_details_from_instance(response):
+        """
+        :param dict response: instance resource json
+        :rtype: VmDetailsData
+        """
         vm_instance_data = [
             VmDetailsProperty(key='Instance Id', value=response['id'])
         ]
@@ -484,34 +1128,111 @@ class GCPService:
 
     def get_vm_details(self, vm_name):
 
-        zone = 'us-west1-b'  # TODO: take from app? or cp?
+        zone = self._find_instance_zone(vm_name)
         vm_details = self.extract_vm_details(vm_name, zone)
         vm_details.appName = vm_name
 
         return vm_details
 
-    def refresh_ip(self, cloudshell_session, app_fullname, app_private_ip, app_public_ip, ip_regex):
-
-        IP_V4_PATTERN = re.compile('^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$')
+    def get_vms_details(self, vm_names):
+        """
+        resolves all the VMs with filtered aggregatedList calls instead of one instances().get per VM
+        :param List[str] vm_names:
+        :return: details for every requested VM in the same order, VMs that were not found carry an errorMessage
+        :rtype: List[VmDetailsData]
+        """
+        found = {}
+        for names in chunks(sorted(set(vm_names))):
+            for instance in self._aggregated_instances(filter=name_filter(names)):
+                found.setdefault(instance['name'], []).append(instance)
 
-        zone = 'us-west1-b'  # TODO: take from app? or cp?
+        instances = {}
+        for name, candidates in found.items():
+            instance = self._pick_instance(name, candidates)
+            instances[name] = instance
+            instance_zone_cache.set((self.project, name), instance['zone'].split('/')[-1])
 
-        is_ip_match = re.compile(ip_regex).match
+        results = []
+        for vm_name in vm_names:
+            if vm_name not in instances:
+                results.append(VmDetailsData(appName=vm_name, errorMessage='VM {} was not found'.format(vm_name)))
+                continue
+            try:
+                vm_details = self._vm_details_from_instance(instances[vm_name])
+                vm_details.appName = vm_name
+            except Exception as e:
+                self.logger.exception('Failed to read details of {}'.format(vm_name))
+                vm_details = VmDetailsData(appName=vm_name, errorMessage=str(e))
+            results.append(vm_details)
 
-        vm_details = self.extract_vm_details(app_fullname, zone)
-        network_data = vm_details.vmNetworkData[0]
-        private_ip = network_data.privateIpAddress
-        public_ip = network_data.publicIpAddress
+        return results
 
-        if private_ip:
-            if IP_V4_PATTERN.match(private_ip) and is_ip_match(private_ip):
-                if app_private_ip != private_ip:
-                    cloudshell_session.UpdateResourceAddress(app_fullname, private_ip)
+    def refresh_ip(self, cloudshell_session, app_fullname, app_private_ip, app_public_ip, ip_regex,
+                   timeout=DEFAULT_REFRESH_IP_TIMEOUT, cancellation_context=None):
+        """
+        waits until the instance has a private IP, and a public IP if it has an external access config,
+        and updates the deployed app with the ones that match ip_regex
+        polls with backoff until the timeout expires, instances that already have their addresses cost a single GET
+        """
+        zone = self._find_instance_zone(app_fullname)
+        is_ip_match = _compile(ip_regex).match
+
+        def matching(ip):
+            return ip if ip and IP_V4_PATTERN.match(ip) and is_ip_match(ip) else None
+
+        deadline = time.time() + timeout
+        delay = MIN_IP_POLL_INTERVAL
+        while True:
+            private_ip, public_ip, has_external_access = self._instance_ips(app_fullname, zone)
+            # only unassigned addresses are waited for, ip_regex picks which of the assigned ones are used
+            if private_ip and (public_ip or not has_external_access):
+                private_ip, public_ip = matching(private_ip), matching(public_ip)
+                break
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise Exception('No IP was assigned to {} within {} seconds'.format(app_fullname, timeout))
+            self.logger.debug('waiting for the IPs of {}'.format(app_fullname))
+            if self._sleep_unless_cancelled(min(delay / 2 + random.uniform(0, delay / 2), remaining),
+                                            cancellation_context):
+                self.logger.info('refresh IP of {} was cancelled'.format(app_fullname))
+                return
+            delay = min(delay * 2, MAX_IP_POLL_INTERVAL)
+
+        if private_ip and app_private_ip != private_ip:
+            cloudshell_session.UpdateResourceAddress(app_fullname, private_ip)
+
+        if public_ip and app_public_ip != public_ip:
+            cloudshell_session.SetAttributeValue(app_fullname, "Public IP", public_ip)
+
+    def _instance_ips(self, instance_name, zone):
+        """
+        :return: the private and public IPs of the first interface, and whether it has an external access config
+        :rtype: (str, str, bool)
+        """
+        request = self._get_client().instances().get(project=self.project, zone=zone, instance=instance_name,
+                                                     fields=ASSIGNED_ADDRESS_FIELDS)
+        interfaces = self._execute(request).get('networkInterfaces', [])
+        if not interfaces:
+            return None, None, False
+        access_configs = interfaces[0].get('accessConfigs', [])
+        public_ip = access_configs[0].get('natIP') if access_configs else None
+        return interfaces[0].get('networkIP'), public_ip, bool(access_configs)
 
-        if public_ip:
-            if IP_V4_PATTERN.match(public_ip) and is_ip_match(public_ip):
-                if app_public_ip != public_ip:
-                    cloudshell_session.SetAttributeValue(app_fullname, "Public IP", public_ip)
+    @staticmethod
+    def _sleep_unless_cancelled(seconds, cancellation_context):
+        """
+        sleeps in short steps so a cancellation is noticed quickly
+        :return: True if the command was cancelled
+        """
+        deadline = time.time() + seconds
+        while True:
+            if cancellation_context is not None and cancellation_context.is_cancelled:
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, 0.5))
 
 
     #######################################################
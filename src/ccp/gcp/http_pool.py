@@ -0,0 +1,67 @@
+import threading
+
+import google_auth_httplib2
+import httplib2
+
+DEFAULT_POOL_SIZE = 16
+# seconds, above the ~2 minutes an operations.wait long poll may hold the connection
+DEFAULT_SOCKET_TIMEOUT = 180
+
+
+class HttpPool(object):
+    """ a thread safe pool of authorized httplib2.Http objects, each keeping its connections alive
+        it has the request() method of httplib2.Http, so a single googleapiclient client built on it
+        can be shared by every thread: each request borrows an idle Http, or a new one while the pool is
+        below max_size, and waits for one to be returned otherwise
+        the most recently returned Http is reused first, so TLS handshakes happen once per pooled connection
+    """
+
+    def __init__(self, credentials, max_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_SOCKET_TIMEOUT, http_factory=None):
+        self.credentials = credentials
+        self.max_size = max_size
+        self.timeout = timeout
+        self._http_factory = http_factory or self._authorized_http
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._waits = 0
+        self._condition = threading.Condition()
+
+    def _authorized_http(self):
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+
+    def request(self, *args, **kwargs):
+        http = self._acquire()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self._release(http)
+
+    def _acquire(self):
+        with self._condition:
+            while not self._idle and self._created >= self.max_size:
+                self._waits += 1
+                self._condition.wait()
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return self._http_factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, http):
+        with self._condition:
+            self._in_use -= 1
+            self._idle.append(http)
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {'created': self._created, 'in_use': self._in_use, 'idle': len(self._idle), 'waits': self._waits}
@@ -0,0 +1,171 @@
+import atexit
+import json
+import logging
+import re
+import threading
+
+import six
+from six.moves import queue
+
+MAX_PAYLOAD_CHARS = 32 * 1024  # longer payloads are cut, the record says by how much
+REDACTED = '***'
+QUEUE_CAPACITY = 10000  # records waiting to be written, loggers only block when that many are behind
+
+_SECRET_NAME = r'[^"\\]*(?:password|passwd|secret|token|private_?key|access_?key)[^"\\]*'
+# secrets as json fields, as name/value attribute pairs, and both again inside json strings embedded in json
+_SECRET_PATTERNS = [
+    re.compile(r'("' + _SECRET_NAME + r'"\s*:\s*)"(?:[^"\\]|\\.)*"', re.I),
+    re.compile(r'("(?:attributeName|name)"\s*:\s*"' + _SECRET_NAME +
+               r'"\s*,\s*"(?:attributeValue|value)"\s*:\s*)"(?:[^"\\]|\\.)*"', re.I),
+    re.compile(r'(\\"' + _SECRET_NAME + r'\\"\s*:\s*)\\"(?:(?!\\").)*\\"', re.I),
+    re.compile(r'(\\"(?:attributeName|name)\\"\s*:\s*\\"' + _SECRET_NAME +
+               r'\\"\s*,\s*\\"(?:attributeValue|value)\\"\s*:\s*)\\"(?:(?!\\").)*\\"', re.I),
+]
+# a secret whose value was cut by the truncation
+_CUT_SECRET = re.compile(r'(\\?"' + _SECRET_NAME + r'\\?"\s*:\s*)\\?"[^"]*$', re.I)
+
+
+def redact(text):
+    """ input: serialized payload
+        output: the payload with the values of password, secret, token and key fields replaced
+    """
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(r'\1"' + REDACTED + '"', text)
+    return text
+
+
+def _serialize(obj, limit):
+    """ output: at least the first limit characters of the json of obj, and whether it was cut
+        the encoding stops once past the limit, so a huge payload is never serialized in full
+    """
+    encoder = json.JSONEncoder(default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+    chunks = []
+    size = 0
+    for chunk in encoder.iterencode(obj):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return ''.join(chunks), True
+    return ''.join(chunks), False
+
+
+@six.python_2_unicode_compatible
+class LogPayload(object):
+    """ a command payload rendered only when its record is written: serialized, redacted and truncated
+        pass objects the command no longer changes, they are rendered later, on the logging thread
+    """
+
+    __slots__ = ('obj', 'max_chars')
+
+    def __init__(self, obj, max_chars=MAX_PAYLOAD_CHARS):
+        self.obj = obj
+        self.max_chars = max_chars
+
+    def __str__(self):
+        obj = self.obj
+        # look past the limit, so a secret at the cut is still recognized
+        limit = self.max_chars + 1024
+        if isinstance(obj, six.string_types):
+            text, cut = obj[:limit + 1], len(obj) > limit
+            total = len(obj)
+        elif isinstance(obj, (bool, int, float)) or obj is None:
+            text, cut, total = six.text_type(obj), False, None
+        else:
+            text, cut = _serialize(obj, limit)
+            total = None
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+
+        text = redact(text)
+        if not cut and len(text) <= self.max_chars:
+            return text
+        text = _CUT_SECRET.sub(r'\1"' + REDACTED + '"', text[:self.max_chars])
+        return u'{0}... [truncated, {1} chars]'.format(text, total if total is not None else
+                                                       'more than {0}'.format(self.max_chars))
+
+
+class BackgroundHandler(logging.Handler):
+    """ stands in front of the handlers of a logger and hands its records to the logging thread,
+        so command threads do not wait for the log files
+    """
+
+    def __init__(self, handlers):
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+
+    def emit(self, record):
+        _writer.put(self, record)
+
+    def write(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+
+class _LogWriter(object):
+    """ the thread writing the records of every BackgroundHandler, started on first use
+    """
+
+    def __init__(self, capacity=QUEUE_CAPACITY):
+        self._queue = queue.Queue(capacity)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, handler, record):
+        if self._thread is None:
+            self._start()
+        self._queue.put((handler, record))
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name='gcp-log-writer')
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            handler, record = self._queue.get()
+            try:
+                handler.write(record)
+            except Exception:
+                handler.handleError(record)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """ blocks until the records queued so far are written
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+
+_writer = _LogWriter()
+_install_lock = threading.Lock()
+
+
+def queue_logger(logger):
+    """ input: a logger, e.g. the one of a command
+        output: the same logger, its handlers moved behind a BackgroundHandler the first time
+    """
+    with _install_lock:
+        handlers = list(logger.handlers)
+        if handlers and not any(isinstance(handler, BackgroundHandler) for handler in handlers):
+            for handler in handlers:
+                logger.removeHandler(handler)
+            logger.addHandler(BackgroundHandler(handlers))
+    return logger
+
+
+def flush_logs():
+    """ waits for the queued records to be written, e.g. before the driver process ends
+    """
+    _writer.flush()
+
+
+atexit.register(flush_logs)
@@ -0,0 +1,247 @@
+import atexit
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_EXPORT_INTERVAL = 60  # seconds
+# seconds, from a fields-limited GET up to a long operations.wait or a deploy
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_LOCATION_PATTERN = re.compile(r'/(?:zones|regions)/([^/?]+)')
+_context = threading.local()
+
+
+def current_command():
+    """ output: the driver command running on this thread, empty outside of commands
+    """
+    return getattr(_context, 'command', '')
+
+
+def request_labels(request):
+    """ input: a googleapiclient request
+        output: its API method and zone (or region) labels
+    """
+    method = str(getattr(request, 'methodId', '') or '')
+    match = _LOCATION_PATTERN.search(str(getattr(request, 'uri', '') or ''))
+    return {'method': method, 'zone': match.group(1) if match else ''}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry(object):
+    """ thread safe counters and latency histograms, labelled by API method, zone and driver command
+        renders them in the Prometheus text format
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, labels=None, amount=1, help=''):
+        labels = dict(labels or {}, command=current_command())
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None, help=''):
+        labels = dict(labels or {}, command=current_command())
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, name, labels=None, help=''):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - started, labels, help)
+
+    def render(self, extra_labels=()):
+        """ output: every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append('# HELP {0} {1}'.format(name, self._help.get(name) or name))
+                lines.append('# TYPE {0} counter'.format(name))
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append('{0}{1} {2}'.format(name, _format_labels(key, extra_labels), value))
+            for name in sorted(self._histograms):
+                lines.append('# HELP {0} {1}'.format(name, self._help.get(name) or name))
+                lines.append('# TYPE {0} histogram'.format(name))
+                for key, histogram in sorted(self._histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        le = (('le', repr(float(bound))),)
+                        lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(key, extra_labels + le), count))
+                    lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(key, extra_labels + (('le', '+Inf'),)),
+                                                            histogram.count))
+                    lines.append('{0}_sum{1} {2}'.format(name, _format_labels(key, extra_labels), histogram.sum))
+                    lines.append('{0}_count{1} {2}'.format(name, _format_labels(key, extra_labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """ output: call count, total seconds and errors per API method, for a compact log line
+        """
+        result = {}
+        with self._lock:
+            for key, histogram in self._histograms.get('gcp_api_request_duration_seconds', {}).items():
+                method = dict(key)['method']
+                entry = result.setdefault(method, {'calls': 0, 'seconds': 0.0, 'errors': 0})
+                entry['calls'] += histogram.count
+                entry['seconds'] = round(entry['seconds'] + histogram.sum, 3)
+            for key, value in self._counters.get('gcp_api_errors_total', {}).items():
+                method = dict(key)['method']
+                result.setdefault(method, {'calls': 0, 'seconds': 0.0, 'errors': 0})['errors'] += value
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+@contextmanager
+def command_scope(command):
+    """ labels the metrics recorded on this thread with the driver command, and times the command
+    """
+    previous = current_command()
+    _context.command = command
+    try:
+        with registry.timed('gcp_command_duration_seconds', help='Driver command duration'):
+            yield
+    except Exception:
+        registry.inc('gcp_command_errors_total', help='Driver commands that failed')
+        raise
+    finally:
+        _context.command = previous
+
+
+class MetricsExporter(object):
+    """ periodically writes the registry to a Prometheus textfile and logs a structured summary line
+        every driver process writes its own file, labelled with its pid
+    """
+
+    def __init__(self, metrics_registry, directory, interval=DEFAULT_EXPORT_INTERVAL, logger=None):
+        self.registry = metrics_registry
+        self.directory = directory
+        self.interval = interval
+        self.logger = logger
+        self.path = os.path.join(directory, 'gcp_shell_{0}.prom'.format(os.getpid()))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='gcp-metrics-exporter')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """ stops exporting and removes the textfile, so the collector drops the series of this process
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as e:
+            if self.logger:
+                self.logger.warning('Failed to remove {0}: {1}'.format(self.path, e))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def export(self):
+        self.write_textfile()
+        if self.logger:
+            self.logger.info('gcp metrics {0}'.format(json.dumps(self.registry.summary(), sort_keys=True)))
+
+    def write_textfile(self):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # the collector must never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.registry.render(extra_labels=(('pid', os.getpid()),)))
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            if self.logger:
+                self.logger.warning('Failed to write metrics to {0}: {1}'.format(self.path, e))
+
+
+registry = MetricsRegistry()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_export(directory, logger=None, interval=DEFAULT_EXPORT_INTERVAL):
+    """ starts the process wide exporter once, later calls only update its logger
+        metrics are only kept in memory while directory is empty
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None and directory:
+            _exporter = MetricsExporter(registry, directory=directory, interval=interval, logger=logger)
+            _exporter.start()
+        elif _exporter is not None and logger is not None:
+            _exporter.logger = logger
+        return _exporter
+
+
+def stop_export():
+    """ stops the process wide exporter and removes its textfile, e.g. when the driver is destroyed
+    """
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.stop()
+
+
+atexit.register(stop_export)
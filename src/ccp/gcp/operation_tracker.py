@@ -0,0 +1,226 @@
+import threading
+import time
+
+from ccp.gcp.api_executor import execute
+from ccp.gcp.filters import name_filter, chunks
+from ccp.gcp.metrics import registry
+from ccp.gcp.wait_operations import OperationError, OperationTimeoutError, DEFAULT_TIMEOUT, MIN_POLL_INTERVAL
+
+MAX_TRACKER_INTERVAL = 5.0  # seconds, the tracker should notice completions quickly even when idle
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(client, project, logger=None):
+    """ input: client and project
+        output: the process wide OperationTracker for that client and project
+    """
+    key = (id(client), project)
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None or tracker.client is not client:
+            tracker = OperationTracker(client, project, logger=logger)
+            _trackers[key] = tracker
+        return tracker
+
+
+class OperationFuture(object):
+    """ the pending result of a single compute operation
+    """
+
+    def __init__(self, name, zone=None, region=None, timeout=DEFAULT_TIMEOUT):
+        self.name = name
+        self.zone = zone
+        self.region = region
+        self.created = time.time()
+        self.deadline = self.created + timeout
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    @property
+    def scope(self):
+        if self.zone:
+            return 'zone', self.zone
+        if self.region:
+            return 'region', self.region
+        return 'global', None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """ blocks until the operation is done, returns the operation json
+            raises OperationError if it finished with an error
+        """
+        if not self._event.wait(timeout):
+            raise OperationTimeoutError("operation {0} not done after {1} seconds".format(self.name, timeout))
+        if self._exception:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """ blocks until the operation is done, returns the error it finished with or None
+        """
+        if not self._event.wait(timeout):
+            raise OperationTimeoutError("operation {0} not done after {1} seconds".format(self.name, timeout))
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """ fn is called with this future once it is done, immediately if it already is
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _resolve(self, result=None, exception=None):
+        with self._lock:
+            if self.done():
+                return
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class OperationTracker(object):
+    """ tracks pending compute operations of one project and resolves them as futures
+        every poll issues a single filtered *Operations().list call per zone/region, so
+        the polling cost grows with the number of zones and not with the number of operations
+    """
+
+    def __init__(self, client, project, logger=None):
+        self.client = client
+        self.project = project
+        self.logger = logger
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, operation, zone=None, region=None, timeout=DEFAULT_TIMEOUT):
+        """ input: an operation json (as returned by insert/delete calls) or its name, and its zone/region
+            output: OperationFuture, polled in the background until done
+        """
+        if isinstance(operation, dict):
+            name = operation['name']
+            zone = zone or _last_segment(operation.get('zone'))
+            region = region or _last_segment(operation.get('region'))
+        else:
+            name, operation = operation, None
+
+        future = OperationFuture(name, zone=zone, region=region, timeout=timeout)
+
+        if operation is not None and operation.get('status') == 'DONE':
+            self._complete(future, operation)
+            return future
+
+        with self._lock:
+            self._pending[(future.scope, name)] = future
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='gcp-operation-tracker')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def poll(self):
+        """ checks every pending operation once
+            output: number of operations resolved by this poll
+        """
+        with self._lock:
+            by_scope = {}
+            for future in self._pending.values():
+                by_scope.setdefault(future.scope, []).append(future)
+
+        resolved = 0
+        for scope, futures in by_scope.items():
+            try:
+                resolved += self._poll_scope(scope, futures)
+            except Exception as e:
+                # transient listing failures are retried on the next poll, expired futures still time out
+                if self.logger:
+                    self.logger.warning("failed to poll operations in {0}: {1}".format(scope, e))
+
+        now = time.time()
+        for futures in by_scope.values():
+            for future in futures:
+                if not future.done() and future.deadline <= now:
+                    self._discard(future)
+                    future._resolve(exception=OperationTimeoutError(
+                        "operation {0} not done before its deadline".format(future.name)))
+                    resolved += 1
+        return resolved
+
+    def _poll_scope(self, scope, futures):
+        kind, location = scope
+        if kind == 'zone':
+            resource, args = self.client.zoneOperations(), {'zone': location}
+        elif kind == 'region':
+            resource, args = self.client.regionOperations(), {'region': location}
+        else:
+            resource, args = self.client.globalOperations(), {}
+
+        by_name = dict((f.name, f) for f in futures)
+        resolved = 0
+        for names in chunks(sorted(by_name)):
+            request = resource.list(project=self.project, filter=name_filter(names), **args)
+            while request is not None:
+                response = execute(request, self.project)
+                for operation in response.get('items', []):
+                    future = by_name.get(operation['name'])
+                    if future and operation['status'] == 'DONE':
+                        self._complete(future, operation)
+                        resolved += 1
+                request = resource.list_next(request, response)
+        return resolved
+
+    def _complete(self, future, operation):
+        self._discard(future)
+        registry.observe('gcp_operation_duration_seconds', time.time() - future.created,
+                         {'method': operation.get('operationType', ''), 'zone': future.zone or future.region or ''},
+                         help='Time from registering a compute operation until it was seen done')
+        if 'error' in operation:
+            future._resolve(exception=OperationError(operation))
+        else:
+            future._resolve(result=operation)
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.pop((future.scope, future.name), None)
+
+    def _run(self):
+        interval = MIN_POLL_INTERVAL
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+
+            self._wakeup.wait(interval)
+            if self._wakeup.is_set():
+                # new operations were registered, poll them soon
+                self._wakeup.clear()
+                interval = MIN_POLL_INTERVAL
+
+            if self.poll():
+                interval = MIN_POLL_INTERVAL
+            else:
+                interval = min(interval * 2, MAX_TRACKER_INTERVAL)
+
+
+def _last_segment(link):
+    if not link:
+        return None
+    return link.split('/')[-1]
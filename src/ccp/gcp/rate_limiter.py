@@ -0,0 +1,103 @@
+import threading
+import time
+
+DEFAULT_READ_RATE = 20.0  # requests per second
+DEFAULT_MUTATION_RATE = 10.0
+MUTATION_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(project):
+    """ input: project
+        output: the process wide RateLimiter for that project
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(project)
+        if limiter is None:
+            limiter = _limiters[project] = RateLimiter()
+        return limiter
+
+
+def is_mutation(request):
+    """ input: a googleapiclient request
+        output: True if the request changes resources, operations.wait only reads even though it is a POST
+    """
+    if str(getattr(request, 'methodId', '')).endswith('Operations.wait'):
+        return False
+    return getattr(request, 'method', None) in MUTATION_METHODS
+
+
+class TokenBucket(object):
+    """ a thread safe token bucket, callers reserve their token up front and then sleep until it is due,
+        so waiting callers are served in the order they arrived
+    """
+
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self.configure(rate, burst)
+        self._tokens = self.burst
+        self._updated = time.time()
+
+    def configure(self, rate, burst=None):
+        with self._lock:
+            self.rate = float(rate)
+            self.burst = float(burst or max(rate, 1))
+
+    def reserve(self):
+        """ takes a token, output: the seconds the caller has to wait before using it
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter(object):
+    """ separate read and mutation budgets for the Compute API calls of one project
+        keeps queueing metrics: how many calls waited, for how long, and how many are waiting now
+    """
+
+    def __init__(self, read_rate=DEFAULT_READ_RATE, mutation_rate=DEFAULT_MUTATION_RATE):
+        self._buckets = {'read': TokenBucket(read_rate), 'mutation': TokenBucket(mutation_rate)}
+        self._lock = threading.Lock()
+        self._stats = dict((kind, {'calls': 0, 'queued': 0, 'waiting': 0, 'wait_seconds': 0.0, 'max_wait': 0.0})
+                           for kind in self._buckets)
+
+    def configure(self, read_rate=None, mutation_rate=None):
+        """ changes the budgets in place, None keeps the current one
+        """
+        if read_rate:
+            self._buckets['read'].configure(read_rate)
+        if mutation_rate:
+            self._buckets['mutation'].configure(mutation_rate)
+
+    def acquire(self, mutation=False):
+        """ blocks until the call fits in its budget
+        """
+        kind = 'mutation' if mutation else 'read'
+        stats = self._stats[kind]
+        delay = self._buckets[kind].reserve()
+        with self._lock:
+            stats['calls'] += 1
+            if delay > 0:
+                stats['queued'] += 1
+                stats['waiting'] += 1
+                stats['wait_seconds'] += delay
+                stats['max_wait'] = max(stats['max_wait'], delay)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                with self._lock:
+                    stats['waiting'] -= 1
+        return delay
+
+    def stats(self):
+        with self._lock:
+            return dict((kind, dict(stats)) for kind, stats in self._stats.items())
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 256
+DEFAULT_TTL = 10 * 60  # seconds, image families move and templates get replaced, so entries have to expire
+
+
+class TTLCache(object):
+    """ a bounded, thread safe cache whose entries expire after ttl seconds
+        the least recently used entry is evicted when the cache is full
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return default
+            self._entries[key] = entry  # most recently used goes last
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        """ returns the cached value, or calls loader() and caches its result on a miss
+            loader errors are not cached
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ drops every entry and resets the hit/miss counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# shared by every command of the driver process
+template_cache = TTLCache()
+image_cache = TTLCache()
+region_zones_cache = TTLCache(ttl=24 * 60 * 60)
+instance_zone_cache = TTLCache(max_size=4096, ttl=24 * 60 * 60)
@@ -0,0 +1,99 @@
+import time
+
+from ccp.gcp.api_executor import is_not_found
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 2.0  # seconds, doubled on every retry of a layer
+
+
+class TeardownNode(object):
+    """ a single cloud resource to delete
+        delete is a callable that issues the delete call and returns its operation json
+    """
+
+    def __init__(self, kind, name, delete, zone=None, region=None):
+        self.kind = kind
+        self.name = name
+        self.delete = delete
+        self.zone = zone
+        self.region = region
+        self.attempts = 0
+        self.duration = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.duration is not None and self.error is None
+
+    def __str__(self):
+        if self.succeeded:
+            status = 'deleted in {0:.1f}s'.format(self.duration)
+        else:
+            status = 'failed: {0}'.format(self.error)
+        return '{0} {1} ({2} attempts) {3}'.format(self.kind, self.name, self.attempts, status)
+
+
+class TeardownEngine(object):
+    """ deletes a dependency graph of resources, given as layers that must be deleted in order
+        every node of a layer is deleted in parallel and only the failed nodes of a layer are retried,
+        so a teardown takes about as long as the sum of its slowest deletes per layer
+    """
+
+    def __init__(self, tracker, logger, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY):
+        self.tracker = tracker
+        self.logger = logger
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def run(self, layers):
+        """
+        :param List[List[TeardownNode]] layers: the first layer is deleted first, e.g. instances before subnets
+        :return: the nodes that could not be deleted, the remaining layers are not attempted after a failed layer
+        :rtype: List[TeardownNode]
+        """
+        for index, layer in enumerate(layers):
+            failed = self._run_layer(layer)
+            for node in layer:
+                self.logger.info('teardown layer {0}: {1}'.format(index, node))
+            if failed:
+                return failed
+        return []
+
+    def _run_layer(self, layer):
+        pending = list(layer)
+        delay = self.retry_delay
+
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+
+            started = []
+            for node in pending:
+                node.attempts += 1
+                node.error = None
+                start = time.time()
+                try:
+                    operation = node.delete()
+                    future = self.tracker.register(operation, zone=node.zone, region=node.region)
+                    started.append((node, start, future))
+                except Exception as e:
+                    self._finish(node, start, e)
+
+            for node, start, future in started:
+                self._finish(node, start, future.exception())
+
+            pending = [node for node in pending if not node.succeeded]
+            if not pending:
+                break
+
+        return pending
+
+    @staticmethod
+    def _finish(node, start, error):
+        if error is None or is_not_found(error):
+            node.duration = time.time() - start
+            node.error = None
+        else:
+            node.duration = None
+            node.error = error
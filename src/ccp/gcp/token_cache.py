@@ -0,0 +1,111 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # windows execution servers
+    fcntl = None
+    import msvcrt
+
+TOKEN_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gcp_shell_tokens')
+DEFAULT_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+_EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _lock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileTokenCache(object):
+    """ on disk cache of access tokens shared by every driver process of the execution server,
+        keyed by service account identity and scopes
+        only one process refreshes an expiring token, the others wait on the file lock and reuse its result
+    """
+
+    def __init__(self, directory=TOKEN_CACHE_DIR, margin=DEFAULT_REFRESH_MARGIN):
+        self.directory = directory
+        self.margin = margin
+
+    def _path(self, credentials):
+        identity = getattr(credentials, 'service_account_email', None) or type(credentials).__name__
+        scopes = ' '.join(sorted(getattr(credentials, 'scopes', None) or []))
+        key = hashlib.sha256('{0}|{1}'.format(identity, scopes).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def _is_fresh(self, token, expiry):
+        return bool(token) and expiry is not None and expiry - datetime.datetime.utcnow() > self.margin
+
+    def load(self, credentials):
+        """ sets the cached token on the credentials
+            output: True if a token valid for longer than the margin was found
+        """
+        try:
+            with open(self._path(credentials)) as f:
+                entry = json.load(f)
+            expiry = datetime.datetime.strptime(entry['expiry'], _EXPIRY_FORMAT)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return False
+        if not self._is_fresh(entry['token'], expiry):
+            return False
+        credentials.token = entry['token']
+        credentials.expiry = expiry
+        return True
+
+    def refresh(self, credentials, request):
+        """ makes sure the credentials hold a token valid for longer than the margin,
+            reusing the cached one or refreshing it under the file lock and caching the new one
+        """
+        if self._is_fresh(credentials.token, credentials.expiry) or self.load(credentials):
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            lock_file = open(self._path(credentials) + '.lock', 'a+')
+        except (IOError, OSError):
+            # no usable cache directory, every process refreshes on its own
+            credentials.refresh(request)
+            return
+
+        with lock_file:
+            _lock(lock_file)
+            try:
+                # another process may have refreshed the token while we waited for the lock
+                if self.load(credentials):
+                    return
+                credentials.refresh(request)
+                self._store(credentials)
+            finally:
+                _unlock(lock_file)
+
+    def _store(self, credentials):
+        if not credentials.token or credentials.expiry is None:
+            return
+        path = self._path(credentials)
+        try:
+            # tokens are secrets: the temp file is created readable by its owner only
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'token': credentials.token, 'expiry': credentials.expiry.strftime(_EXPIRY_FORMAT)}, f)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
+
+
+token_cache = FileTokenCache()
@@ -0,0 +1,172 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+MAX_TRACE_FILE_BYTES = 20 * 1024 * 1024  # the file is rotated to a single .1 backup past this size
+FLUSH_INTERVAL = 5.0  # seconds, spans are buffered in between and flushed when the process exits
+# attributes every child span copies from its parent, so any span can be tied to its sandbox and action
+INHERITED_ATTRIBUTES = ('command', 'reservation_id', 'action_id')
+
+_context = threading.local()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def _stack():
+    stack = getattr(_context, 'stack', None)
+    if stack is None:
+        stack = _context.stack = []
+    return stack
+
+
+def current_span():
+    """ output: the innermost open span of this thread, None outside of spans
+    """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+class Span(object):
+    """ one timed phase of a driver command, the root span of a command has no parent
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict((key, parent.attributes[key]) for key in INHERITED_ATTRIBUTES
+                               if parent and key in parent.attributes)
+        self.attributes.update(attributes or {})
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        """ output: the span with the field names of the OTLP JSON encoding
+        """
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': int(self.start * 1e9),
+            'endTimeUnixNano': int((self.end or time.time()) * 1e9),
+            'attributes': self.attributes,
+            'status': {'code': 'ERROR', 'message': self.error} if self.error else {'code': 'OK'}
+        }
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """ times the block as a child of parent, or of the current span of this thread
+        pass parent explicitly for work handed to another thread
+    """
+    current = Span(name, parent or current_span(), attributes)
+    stack = _stack()
+    stack.append(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = '{0}: {1}'.format(type(e).__name__, e)
+        raise
+    finally:
+        stack.pop()
+        current.end = time.time()
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(current)
+
+
+class JsonLinesSpanExporter(object):
+    """ appends finished spans as JSON lines to a local file, one file per driver process
+        writes are buffered and flushed at most every flush_interval seconds
+    """
+
+    def __init__(self, path, max_bytes=MAX_TRACE_FILE_BYTES, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._flushed = time.time()
+
+    def export(self, finished_span):
+        line = json.dumps(finished_span.to_dict(), sort_keys=True, default=str) + '\n'
+        with self._lock:
+            try:
+                if self._file is None:
+                    directory = os.path.dirname(self.path)
+                    if not os.path.isdir(directory):
+                        os.makedirs(directory)
+                    self._file = open(self.path, 'a')
+                self._file.write(line)
+                if self._file.tell() > self.max_bytes:
+                    self._rotate()
+                elif time.time() - self._flushed >= self.flush_interval:
+                    self._flush()
+            except (IOError, OSError):
+                # tracing must never fail a command
+                self._file = None
+
+    def flush(self):
+        with self._lock:
+            try:
+                self._flush()
+            except (IOError, OSError):
+                self._file = None
+
+    def _flush(self):
+        if self._file is not None:
+            self._file.flush()
+        self._flushed = time.time()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        backup = self.path + '.1'
+        if os.path.exists(backup):
+            os.remove(backup)
+        os.rename(self.path, backup)
+
+
+def start_tracing(directory):
+    """ exports the spans of this process to <directory>/spans_<pid>.jsonl, once
+        tracing stays off while directory is empty
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None and directory:
+            path = os.path.join(directory, 'spans_{0}.jsonl'.format(os.getpid()))
+            _exporter = JsonLinesSpanExporter(path)
+        return _exporter
+
+
+def set_exporter(exporter):
+    """ replaces the process wide exporter, None stops exporting
+    """
+    global _exporter
+    with _exporter_lock:
+        _exporter = exporter
+
+
+def flush_spans():
+    """ writes the buffered spans, e.g. before the driver process ends
+    """
+    exporter = _exporter
+    if exporter is not None:
+        exporter.flush()
+
+
+atexit.register(flush_spans)
@@ -0,0 +1,86 @@
+import json
+from json.encoder import encode_basestring_ascii
+
+import six
+from cloudshell.cp.core.models import VmDetailsData, VmDetailsNetworkInterface, VmDetailsProperty
+
+SCHEMA_CLASSES = (VmDetailsData, VmDetailsProperty, VmDetailsNetworkInterface)
+
+
+def _compile(cls):
+    """ input: a model class whose constructor has defaults for all its fields
+        output: its fields in key order, each with the json text that precedes its value
+    """
+    fields = sorted(vars(cls()))
+    return tuple((name, ('{' if i == 0 else ',') + encode_basestring_ascii(name) + ':')
+                 for i, name in enumerate(fields))
+
+
+# compiled once per process, from the fields the models set in their constructors
+_SCHEMAS = dict((cls, _compile(cls)) for cls in SCHEMA_CLASSES)
+_STRING_TYPES = (six.binary_type, six.text_type)
+_INTEGER_TYPES = six.integer_types
+
+
+def _fallback(value):
+    return json.dumps(value, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+
+
+def _encode(value, append):
+    value_type = type(value)
+    if value_type in _STRING_TYPES:
+        append(encode_basestring_ascii(value))
+    elif value_type is bool:
+        append('true' if value else 'false')
+    elif value_type in _INTEGER_TYPES:
+        append(str(value))
+    elif value is None:
+        append('null')
+    elif value_type is list or value_type is tuple:
+        if not value:
+            append('[]')
+            return
+        separator = '['
+        for item in value:
+            append(separator)
+            _encode(item, append)
+            separator = ','
+        append(']')
+    elif value_type in _SCHEMAS:
+        _encode_model(value, _SCHEMAS[value_type], append)
+    else:
+        append(_fallback(value))
+
+
+def _encode_model(model, schema, append):
+    fields = model.__dict__
+    if len(fields) != len(schema):
+        # fields were added or removed after construction
+        append(_fallback(model))
+        return
+    try:
+        values = [fields[name] for name, _ in schema]
+    except KeyError:
+        append(_fallback(model))
+        return
+    for (_, prefix), value in zip(schema, values):
+        # strings and flags are most of the fields, they are written without another call
+        value_type = type(value)
+        if value_type in _STRING_TYPES:
+            append(prefix + encode_basestring_ascii(value))
+        elif value_type is bool:
+            append(prefix + ('true' if value else 'false'))
+        else:
+            append(prefix)
+            _encode(value, append)
+    append('}')
+
+
+def encode_vm_details(vm_details):
+    """ input: VmDetailsData or a list of them
+        output: the same json as json.dumps(vm_details, default=lambda o: o.__dict__, sort_keys=True,
+                separators=(',', ':')), written field by field from the precompiled model schemas
+    """
+    chunks = []
+    _encode(vm_details, chunks.append)
+    return ''.join(chunks)
@@ -1,52 +1,149 @@
+import random
 import time
 
+from googleapiclient.errors import HttpError
 
-def zone_wait(client, project, zone, operation):
-    """ input: client, project, zone, and operation
+from ccp.gcp.api_executor import execute
+from ccp.gcp.metrics import registry
+
+DEFAULT_TIMEOUT = 600  # seconds, overall deadline for a single operation
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 16.0
+LONG_POLL_SECONDS = 120  # operations.wait returns the current status after about this long
+# errors that mean the zone is out of capacity, the same request may succeed in another zone
+CAPACITY_ERROR_CODES = ('ZONE_RESOURCE_POOL_EXHAUSTED', 'ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS')
+
+
+class OperationError(Exception):
+    """ raised when a compute operation finished with an error
+    """
+    def __init__(self, operation):
+        super(OperationError, self).__init__(operation.get('error'))
+        self.operation = operation
+
+
+def is_capacity_error(error):
+    """ input: an exception raised by an API call or an operation wait
+        output: True if the zone had no capacity for the request
+    """
+    if isinstance(error, OperationError):
+        codes = [e.get('code') for e in error.operation.get('error', {}).get('errors', [])]
+        return any(code in CAPACITY_ERROR_CODES for code in codes)
+    if isinstance(error, HttpError):
+        content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else error.content
+        return any(code in content for code in CAPACITY_ERROR_CODES)
+    return False
+
+
+class OperationTimeoutError(Exception):
+    """ raised when a compute operation did not finish before its deadline
+    """
+    pass
+
+
+def _operations_resource(client, project, zone=None, region=None):
+    """ input: client, project and the scope of the operation
+        output: the matching *Operations resource and the scope arguments for its methods
+    """
+    if zone:
+        return client.zoneOperations(), {'project': project, 'zone': zone}
+    if region:
+        return client.regionOperations(), {'project': project, 'region': region}
+    return client.globalOperations(), {'project': project}
+
+
+def _check_done(result):
+    """ input: operation resource - json
+        output: True if the operation finished successfully, False if it is still running
+        raises OperationError if the operation finished with an error
+    """
+    if result['status'] != 'DONE':
+        return False
+    if 'error' in result:
+        raise OperationError(result)
+    return True
+
+
+def _backoff(delay):
+    """ input: current poll interval
+        output: the jittered interval to sleep now and the next (capped) interval
+    """
+    sleep_for = delay / 2 + random.uniform(0, delay / 2)
+    return sleep_for, min(delay * 2, MAX_POLL_INTERVAL)
+
+
+def wait_for_operation(client, project, operation, zone=None, region=None, timeout=DEFAULT_TIMEOUT, logger=None):
+    """ input: client, project, operation name and its zone/region (neither for global operations)
         output: request result - json
-        sleep/waits for zone operation to complete
+        waits for the operation to complete using the server side operations.wait long poll,
+        falls back to polling operations.get with capped exponential backoff and jitter, and switches to it
+        once the deadline is closer than a long poll
+        raises OperationTimeoutError if the operation is not done before the deadline
     """
+    resource, scope = _operations_resource(client, project, zone, region)
+    started = time.time()
+    deadline = started + timeout
+    long_poll = True
+    delay = MIN_POLL_INTERVAL
+
     while True:
-        result = client.zoneOperations().get(project=project, zone=zone, operation=operation).execute()
-        if result['status'] == 'DONE':
-            print("done")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
+        if long_poll and deadline - time.time() < LONG_POLL_SECONDS:
+            # a long poll could block past the deadline
+            long_poll = False
+        polled = time.time()
+        if long_poll:
+            try:
+                # returns as soon as the operation is done, or after ~2 minutes with the current status
+                result = execute(resource.wait(operation=operation, **scope), project)
+            except (AttributeError, HttpError) as e:
+                # discovery document without operations.wait, or the endpoint is unavailable
+                if logger:
+                    logger.warning("operations.wait unavailable for {0}, polling instead: {1}".format(operation, e))
+                long_poll = False
+                continue
         else:
-            print("waiting for " + operation)
-        time.sleep(1)
+            result = execute(resource.get(operation=operation, **scope), project)
+
+        if _check_done(result):
+            registry.observe('gcp_operation_duration_seconds', time.time() - started,
+                             {'method': result.get('operationType', ''), 'zone': zone or region or ''},
+                             help='Time from registering a compute operation until it was seen done')
+            if logger:
+                logger.debug("operation {0} done".format(operation))
+            return result
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise OperationTimeoutError("operation {0} not done after {1} seconds".format(operation, timeout))
+
+        if logger:
+            logger.debug("waiting for {0}".format(operation))
+
+        # operations.wait may return early, even at once, when the server is overloaded
+        if not long_poll or time.time() - polled < LONG_POLL_SECONDS / 2:
+            sleep_for, delay = _backoff(delay)
+            time.sleep(min(sleep_for, remaining))
+
 
+def zone_wait(client, project, zone, operation, timeout=DEFAULT_TIMEOUT, logger=None):
+    """ input: client, project, zone, and operation
+        output: request result - json
+        waits for zone operation to complete
+    """
+    return wait_for_operation(client, project, operation, zone=zone, timeout=timeout, logger=logger)
 
-def region_wait(client, project, region, operation):
+
+def region_wait(client, project, region, operation, timeout=DEFAULT_TIMEOUT, logger=None):
     """ input: gce connection and operation
         output: request result - json
-        sleep/waits for region operation to complete
+        waits for region operation to complete
     """
-    while True:
-        result = client.regionOperations().get(project=project, region=region, operation=operation).execute()
-        if result['status'] == 'DONE':
-            print("done")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
-        else:
-            print("waiting for " + operation)
-        time.sleep(1)
+    return wait_for_operation(client, project, operation, region=region, timeout=timeout, logger=logger)
 
 
-def global_wait(client, project, operation):
+def global_wait(client, project, operation, timeout=DEFAULT_TIMEOUT, logger=None):
     """ input: gce client and operation
         output: request result - json
-        sleep/waits for global operation to complete
+        waits for global operation to complete
     """
-    while True:
-        result = client.globalOperations().get(project=project, operation=operation).execute()
-        if result['status'] == 'DONE':
-            print("done")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
-        else:
-            print("waiting for " + operation)
-        time.sleep(1)
+    return wait_for_operation(client, project, operation, timeout=timeout, logger=logger)
@@ -184,6 +184,141 @@ class GoogleCloudProvider(object):
         """
         self.attributes['Google Cloud Provider.project'] = value
 
+    @property
+    def zones(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['Google Cloud Provider.Zones'] if 'Google Cloud Provider.Zones' in self.attributes else None
+
+    @zones.setter
+    def zones(self, value=''):
+        """
+        Comma separated zones of the region to deploy to, in order of preference. Leave empty to use all the zones of the region
+        :type value: str
+        """
+        self.attributes['Google Cloud Provider.Zones'] = value
+
+    @property
+    def zone_race_count(self):
+        """
+        :rtype: int
+        """
+        return self.attributes['Google Cloud Provider.Zone Race Count'] if 'Google Cloud Provider.Zone Race Count' in self.attributes else None
+
+    @zone_race_count.setter
+    def zone_race_count(self, value=1):
+        """
+        The number of candidate zones to try a deployment in at once. The first instance to start wins and the others are deleted
+        :type value: int
+        """
+        self.attributes['Google Cloud Provider.Zone Race Count'] = value
+
+    @property
+    def deploy_coalesce_window(self):
+        """
+        :rtype: float
+        """
+        return self.attributes['Google Cloud Provider.Deploy Coalesce Window'] if 'Google Cloud Provider.Deploy Coalesce Window' in self.attributes else None
+
+    @deploy_coalesce_window.setter
+    def deploy_coalesce_window(self, value=0):
+        """
+        Seconds to collect concurrent deploys of the same shape into one bulk insert. 0 inserts every instance on its own
+        :type value: float
+        """
+        self.attributes['Google Cloud Provider.Deploy Coalesce Window'] = value
+
+    @property
+    def power_off_mode(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['Google Cloud Provider.Power Off Mode'] if 'Google Cloud Provider.Power Off Mode' in self.attributes else None
+
+    @power_off_mode.setter
+    def power_off_mode(self, value='Stop'):
+        """
+        Stop shuts the VMs down. Suspend keeps their memory state, so powering them on is faster than a cold boot
+        :type value: str
+        """
+        self.attributes['Google Cloud Provider.Power Off Mode'] = value
+
+    @property
+    def async_delete(self):
+        """
+        :rtype: bool
+        """
+        return self.attributes['Google Cloud Provider.Async Delete'] if 'Google Cloud Provider.Async Delete' in self.attributes else None
+
+    @async_delete.setter
+    def async_delete(self, value=False):
+        """
+        Return from Delete Instance once GCP accepted the delete, and verify its completion in the background
+        :type value: bool
+        """
+        self.attributes['Google Cloud Provider.Async Delete'] = value
+
+    @property
+    def api_read_rate(self):
+        """
+        :rtype: float
+        """
+        return self.attributes['Google Cloud Provider.API Read Rate'] if 'Google Cloud Provider.API Read Rate' in self.attributes else None
+
+    @api_read_rate.setter
+    def api_read_rate(self, value=20):
+        """
+        Compute API read calls per second allowed for the project, shared by every command of the driver
+        :type value: float
+        """
+        self.attributes['Google Cloud Provider.API Read Rate'] = value
+
+    @property
+    def api_mutation_rate(self):
+        """
+        :rtype: float
+        """
+        return self.attributes['Google Cloud Provider.API Mutation Rate'] if 'Google Cloud Provider.API Mutation Rate' in self.attributes else None
+
+    @api_mutation_rate.setter
+    def api_mutation_rate(self, value=10):
+        """
+        Compute API calls per second that create, change or delete resources, shared by every command of the driver
+        :type value: float
+        """
+        self.attributes['Google Cloud Provider.API Mutation Rate'] = value
+
+    @property
+    def metrics_directory(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['Google Cloud Provider.Metrics Directory'] if 'Google Cloud Provider.Metrics Directory' in self.attributes else None
+
+    @metrics_directory.setter
+    def metrics_directory(self, value=''):
+        """
+        Directory the driver writes its Prometheus textfile metrics to, metrics are not exported when empty
+        :type value: str
+        """
+        self.attributes['Google Cloud Provider.Metrics Directory'] = value
+
+    @property
+    def trace_directory(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['Google Cloud Provider.Trace Directory'] if 'Google Cloud Provider.Trace Directory' in self.attributes else None
+
+    @trace_directory.setter
+    def trace_directory(self, value=''):
+        """
+        Directory the driver writes the spans of its commands to as JSON lines, tracing is off when empty
+        :type value: str
+        """
+        self.attributes['Google Cloud Provider.Trace Directory'] = value
+
     @property
     def networking_type(self):
         """
@@ -1,4 +1,6 @@
 import json
+import logging
+from contextlib import contextmanager
 from cloudshell.cp.core import DriverRequestParser
 from cloudshell.shell.core.resource_driver_interface import ResourceDriverInterface
 from cloudshell.cp.core.models import DriverResponse, DeployApp, PrepareCloudInfra, CreateKeys, \
@@ -9,8 +11,13 @@ from cloudshell.shell.core.driver_context import InitCommandContext, AutoLoadCom
 from cloudshell.shell.core.session.logging_session import LoggingSessionContext
 from cloudshell.shell.core.session.cloudshell_session import CloudShellSessionContext
 from cloudshell.core.context.error_handling_context import ErrorHandlingContext
+from cloudshell.core.logger.qs_logger import get_qs_logger
 from data_model import *
-from ccp.gcp.gcp_service import GCPService
+from ccp.gcp.gcp_service import GCPService, DEFAULT_REFRESH_IP_TIMEOUT
+from ccp.gcp.metrics import command_scope, start_export, stop_export
+from ccp.gcp.tracing import span, current_span, start_tracing
+from ccp.gcp.lazy_logging import LogPayload, queue_logger, flush_logs
+from ccp.gcp.vm_details_encoder import encode_vm_details
 
 class GcCloudProviderDriver (ResourceDriverInterface):
 
@@ -19,6 +26,7 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         ctor must be without arguments, it is created with reflection at run time
         """
         self.request_parser = DriverRequestParser()
+        self._gcp_service = None
 
     def initialize(self, context):
         """
@@ -26,17 +34,57 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         This is a good place to load and cache the client configuration, initiate sessions etc.
         :param InitCommandContext context: the context the command runs on
         """
-        pass
+        logger = get_qs_logger(log_group='inventory', log_file_prefix=context.resource.name)
+        cloud_provider_resource = GoogleCloudProvider.create_from_context(context)
+        start_export(cloud_provider_resource.metrics_directory, logger)
+        start_tracing(cloud_provider_resource.trace_directory)
+
+        try:
+            gcp_service = GCPService(project=cloud_provider_resource.project, logger=logger,
+                                     json_cred_path=cloud_provider_resource.credentials_json_path)
+            gcp_service.set_rate_limits(self._rate(cloud_provider_resource.api_read_rate),
+                                        self._rate(cloud_provider_resource.api_mutation_rate))
+            gcp_service.warm_up()
+            self._gcp_service = gcp_service
+        except Exception:
+            # commands will build the service on demand and surface the error themselves
+            logger.exception('Failed to warm up the GCP service')
 
     # <editor-fold desc="Discovery">
 
-    @staticmethod
-    def _get_service(cloud_provider_resource, logger):
+    def _get_service(self, cloud_provider_resource, logger):
         project = cloud_provider_resource.project
         json_path = cloud_provider_resource.credentials_json_path
 
-        gcp_service = GCPService(project=project, logger=logger, json_cred_path=json_path)
-        return gcp_service
+        gcp_service = self._gcp_service
+        if gcp_service is None or not gcp_service.matches(project, json_path):
+            with span('client_build'):
+                gcp_service = GCPService(project=project, logger=logger, json_cred_path=json_path)
+            self._gcp_service = gcp_service
+
+        gcp_service.set_rate_limits(self._rate(cloud_provider_resource.api_read_rate),
+                                    self._rate(cloud_provider_resource.api_mutation_rate))
+        gcp_service.deploy_coalesce_window = self._rate(cloud_provider_resource.deploy_coalesce_window) or 0
+        with span('auth'):
+            gcp_service.refresh_token()
+        return gcp_service.with_logger(logger)
+
+    @staticmethod
+    @contextmanager
+    def _command(name, context, logger):
+        """
+        labels the metrics of the command and traces it, with the reservation id as an attribute of its spans
+        the command's log records are written by the logging thread
+        """
+        queue_logger(logger)
+        reservation = getattr(context, 'reservation', None) or getattr(context, 'remote_reservation', None)
+        with command_scope(name), span(name, command=name,
+                                       reservation_id=getattr(reservation, 'reservation_id', '') or ''):
+            yield
+
+    @staticmethod
+    def _rate(value):
+        return float(value) if value not in (None, '') else None
 
     def get_inventory(self, context):
         """
@@ -46,7 +94,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :rtype: AutoLoadDetails
         """
 
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('get_inventory', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'get_inventory_context_json', context)
 
@@ -73,7 +122,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :return:
         :rtype: str
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('Deploy', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'deploy_request', request)
                 self._log(logger, 'deploy_context', context)
@@ -83,7 +133,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
                 gcp_service = self._get_service(cloud_provider_resource, logger)
 
                 # parse the json strings into action objects
-                actions = self.request_parser.convert_driver_request_to_actions(request)
+                with span('parse_request'):
+                    actions = self.request_parser.convert_driver_request_to_actions(request)
 
                 # extract DeployApp action
                 deploy_action = single(actions, lambda x: isinstance(x, DeployApp))
@@ -94,6 +145,7 @@ class GcCloudProviderDriver (ResourceDriverInterface):
                 # if we have multiple supported deployment options use the 'deploymentPath' property
                 # to decide which deployment option to use.
                 deployment_name = deploy_action.actionParams.deployment.deploymentPath
+                current_span().set_attribute('action_id', deploy_action.actionId)
 
                 self._log(logger, 'deployment_name', deployment_name)
 
@@ -114,9 +166,10 @@ class GcCloudProviderDriver (ResourceDriverInterface):
 
                 # deploy_result = gcp_service.clone_vm(deploy_action, cloud_provider_resource.storage_container_uuid)
                 #
-                self._log(logger, 'deploy_result', str(deploy_results))
+                self._log(logger, 'deploy_result', deploy_results)
 
-                return DriverResponse(deploy_results).to_driver_response_json()
+                with span('serialize_response'):
+                    return DriverResponse(deploy_results).to_driver_response_json()
 
 
     def PowerOn(self, context, ports):
@@ -125,7 +178,13 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :param ResourceRemoteCommandContext context:
         :param ports:
         """
-        pass
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('PowerOn', context, logger):
+            self._log(logger, 'PowerOn_context', context)
+            cloud_provider_resource = GoogleCloudProvider.create_from_context(context)
+
+            gcp_service = self._get_service(cloud_provider_resource, logger)
+            gcp_service.set_power_on(context.remote_endpoints[0].fullname)
 
     def PowerOff(self, context, ports):
         """
@@ -133,10 +192,61 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :param ResourceRemoteCommandContext context:
         :param ports:
         """
-        pass
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('PowerOff', context, logger):
+            self._log(logger, 'PowerOff_context', context)
+            cloud_provider_resource = GoogleCloudProvider.create_from_context(context)
+
+            gcp_service = self._get_service(cloud_provider_resource, logger)
+            gcp_service.set_power_off(context.remote_endpoints[0].fullname,
+                                      suspend=self._is_suspend_mode(cloud_provider_resource))
 
     def PowerCycle(self, context, ports, delay):
-        pass
+        """
+        Will power off the compute resource, wait for the delay and power it on again
+        :param ResourceRemoteCommandContext context:
+        :param ports:
+        :param delay: seconds to wait between power off and power on
+        """
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('PowerCycle', context, logger):
+            self._log(logger, 'PowerCycle_context', context)
+            cloud_provider_resource = GoogleCloudProvider.create_from_context(context)
+
+            gcp_service = self._get_service(cloud_provider_resource, logger)
+            gcp_service.power_cycle(context.remote_endpoints[0].fullname,
+                                    delay=float(delay or 0),
+                                    suspend=self._is_suspend_mode(cloud_provider_resource))
+
+    def PowerOnReservation(self, context):
+        """
+        Will power on all the compute resources of the reservation in parallel
+        :param ResourceCommandContext context:
+        """
+        return self._set_reservation_power(context, power_on=True)
+
+    def PowerOffReservation(self, context):
+        """
+        Will power off all the compute resources of the reservation in parallel
+        :param ResourceCommandContext context:
+        """
+        return self._set_reservation_power(context, power_on=False)
+
+    def _set_reservation_power(self, context, power_on):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('PowerOnReservation' if power_on else 'PowerOffReservation', context, logger):
+            self._log(logger, 'SetReservationPower_context', context)
+            cloud_provider_resource = GoogleCloudProvider.create_from_context(context)
+
+            gcp_service = self._get_service(cloud_provider_resource, logger)
+            errors = gcp_service.set_reservation_power(context.reservation.reservation_id, power_on,
+                                                       suspend=self._is_suspend_mode(cloud_provider_resource))
+            if errors:
+                raise Exception('Failed to power {}: {}'.format('on' if power_on else 'off', errors))
+
+    @staticmethod
+    def _is_suspend_mode(cloud_provider_resource):
+        return (cloud_provider_resource.power_off_mode or '').lower() == 'suspend'
 
     def DeleteInstance(self, context, ports):
         """
@@ -144,7 +254,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :param ResourceRemoteCommandContext context:
         :param ports:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('DeleteInstance', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'DeleteInstance_context', context)
                 self._log(logger, 'DeleteInstance_ports', ports)
@@ -152,7 +263,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
 
                 gcp_service = self._get_service(cloud_provider_resource, logger)
                 resource_ep = context.remote_endpoints[0]
-                gcp_service.delete_vm(resource_ep.fullname)
+                gcp_service.delete_vm(resource_ep.fullname,
+                                      wait=str(cloud_provider_resource.async_delete).lower() != 'true')
 
     def GetVmDetails(self, context, requests, cancellation_context):
         """
@@ -162,7 +274,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :param CancellationContext cancellation_context:
         :return:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('GetVmDetails', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'GetVmDetails_context', context)
                 self._log(logger, 'GetVmDetails_requests', requests)
@@ -170,17 +283,15 @@ class GcCloudProviderDriver (ResourceDriverInterface):
 
                 gcp_service = self._get_service(cloud_provider_resource, logger)
 
-                results = []
+                with span('parse_request'):
+                    requests_loaded = json.loads(requests)
 
-                requests_loaded = json.loads(requests)
+                vm_names = [request[u'deployedAppJson'][u'name'] for request in requests_loaded[u'items']]
 
-                for request in requests_loaded[u'items']:
-                    vm_name = request[u'deployedAppJson'][u'name']
+                results = gcp_service.get_vms_details(vm_names)
 
-                    result = gcp_service.get_vm_details(vm_name)
-                    results.append(result)
-
-                result_json = json.dumps(results, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+                with span('serialize_response'):
+                    result_json = encode_vm_details(results)
 
                 self._log(logger, 'GetVmDetails_result', result_json)
 
@@ -194,7 +305,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :param CancellationContext cancellation_context:
         :return:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('remote_refresh_ip', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'remote_refresh_ip_context', context)
                 self._log(logger, 'remote_refresh_ip_ports', ports)
@@ -212,15 +324,17 @@ class GcCloudProviderDriver (ResourceDriverInterface):
 
                 public_ip_att = self._get_custom_attribute(resource_attributes, 'Public IP', None)
                 ip_regex = self._get_custom_attribute(resource_attributes, 'IP Regex', '.*')
-                refresh_ip_timeout = self._get_custom_attribute(resource_attributes, 'Refresh IP Timeout', 600)
+                refresh_ip_timeout = self._get_custom_attribute(resource_attributes, 'Refresh IP Timeout', '')
 
                 if public_ip_att:
-                    deployed_app_public_ip = public_ip_att['value']
+                    deployed_app_public_ip = public_ip_att
 
                 deployed_app_fullname = remote_ep.fullname
 
                 gcp_service.refresh_ip(cloudshell_session, deployed_app_fullname, deployed_app_private_ip,
-                                       deployed_app_public_ip, ip_regex)
+                                       deployed_app_public_ip, ip_regex,
+                                       timeout=float(refresh_ip_timeout or DEFAULT_REFRESH_IP_TIMEOUT),
+                                       cancellation_context=cancellation_context)
 
     # </editor-fold>
 
@@ -253,7 +367,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :return:
         :rtype: str
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('PrepareSandboxInfra', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'PrepareSandboxInfra_request', request)
                 self._log(logger, 'PrepareSandboxInfra_context', context)
@@ -263,7 +378,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
                 gcp_service = self._get_service(cloud_provider_resource, logger)
 
                 # parse the json strings into action objects
-                actions = self.request_parser.convert_driver_request_to_actions(request)
+                with span('parse_request'):
+                    actions = self.request_parser.convert_driver_request_to_actions(request)
 
                 # extract PrepareCloudInfra action
                 prepare_infra_action = single(actions, lambda x: isinstance(x, PrepareCloudInfra))
@@ -281,7 +397,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
                                                                    cancellation_context,
                                                                    context.reservation.reservation_id)
         
-                return DriverResponse(action_results).to_driver_response_json()
+                with span('serialize_response'):
+                    return DriverResponse(action_results).to_driver_response_json()
 
     def CleanupSandboxInfra(self, context, request):
         """
@@ -291,7 +408,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         :return:
         :rtype: str
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self._command('CleanupSandboxInfra', context, logger):
             with CloudShellSessionContext(context) as cloudshell_session:
                 self._log(logger, 'CleanupSandboxInfra_request', request)
                 self._log(logger, 'CleanupSandboxInfra_context', context)
@@ -301,7 +419,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
                 gcp_service = self._get_service(cloud_provider_resource, logger)
 
                 # parse the json strings into action objects
-                actions = self.request_parser.convert_driver_request_to_actions(request)
+                with span('parse_request'):
+                    actions = self.request_parser.convert_driver_request_to_actions(request)
 
                 # extract CleanupNetwork action
                 cleanup_action = single(actions, lambda x: isinstance(x, CleanupNetwork))
@@ -311,7 +430,8 @@ class GcCloudProviderDriver (ResourceDriverInterface):
 
                 self._log(logger, 'CleanupSandboxInfra_action_result', action_result)
 
-                return DriverResponse([action_result]).to_driver_response_json()
+                with span('serialize_response'):
+                    return DriverResponse([action_result]).to_driver_response_json()
 
 
     # </editor-fold>
@@ -335,19 +455,25 @@ class GcCloudProviderDriver (ResourceDriverInterface):
         Destroy the client session, this function is called everytime a client instance is destroyed
         This is a good place to close any open sessions, finish writing to log files, etc.
         """
-        pass
+        if self._gcp_service:
+            self._gcp_service.release()
+            self._gcp_service = None
+        stop_export()
+        flush_logs()
 
     def _log(self, logger, name, obj):
+        # the payload is serialized, redacted and truncated only when the record is written
+        if not logger.isEnabledFor(logging.INFO):
+            return
 
         if not obj:
             logger.info(name + ' Value is None')
 
         if not self._is_primitive(obj):
             name = name + '__json_serialized'
-            obj = json.dumps(obj, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
 
         logger.info(name)
-        logger.info(obj)
+        logger.info('%s', LogPayload(obj))
 
     @staticmethod
     def _is_primitive(thing):
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End to end benchmark of `GcCloudProviderDriver` against the local fake Compute API, no network needed.
+
+Runs sandboxes one after the other (PrepareSandboxInfra, Deploys, GetVmDetails, CleanupSandboxInfra) and reports
+the wall time, p50/p99 of every command and the Compute API calls each command made.
+
+    PYTHONPATH=src python -m tests.benchmark --iterations 5 --deploys 3 --latency 0.05
+"""
+
+import argparse
+import json
+import logging
+import math
+import time
+import uuid
+from collections import defaultdict
+
+from tests.driver_harness import DriverHarness
+from tests.fake_compute import FakeCompute
+
+COMMANDS = ('PrepareSandboxInfra', 'Deploy', 'GetVmDetails', 'CleanupSandboxInfra')
+
+
+def percentile(values, pct):
+    """ input: samples and a percentile in 0-100
+        output: the nearest rank percentile, None without samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def latency_summary(values):
+    return {'count': len(values), 'p50': percentile(values, 50), 'p99': percentile(values, 99),
+            'max': max(values) if values else None, 'total': sum(values)}
+
+
+class _CallCounter(object):
+    """ adds up the API calls the fake served during each command, the commands must not overlap
+    """
+
+    def __init__(self, compute):
+        self.compute = compute
+        self.calls = defaultdict(lambda: defaultdict(int))
+
+    def measure(self, command, call):
+        before = self.compute.stats()['calls']
+        try:
+            return call()
+        finally:
+            for method, count in self.compute.stats()['calls'].items():
+                if count - before.get(method, 0):
+                    self.calls[command][method] += count - before.get(method, 0)
+
+
+def run_benchmark(iterations=3, deploys=2, compute=None, attributes=None):
+    """ input: number of sandboxes, deploys per sandbox, the FakeCompute to run against and provider attributes
+        output: the report - dict
+    """
+    compute = compute or FakeCompute()
+    with DriverHarness(compute, attributes) as harness:
+        counter = _CallCounter(compute)
+        started = time.time()
+        for _ in range(iterations):
+            reservation_id = str(uuid.uuid4())
+            subnet_id = counter.measure('PrepareSandboxInfra', lambda: harness.prepare(reservation_id)[0])
+            vm_names = [counter.measure('Deploy', lambda: harness.deploy(reservation_id, 'app {0}'.format(i),
+                                                                         subnet_id))
+                        for i in range(deploys)]
+            counter.measure('GetVmDetails', lambda: harness.vm_details(reservation_id, vm_names))
+            counter.measure('CleanupSandboxInfra', lambda: harness.cleanup(reservation_id))
+        wall_time = time.time() - started
+
+        stats = compute.stats()
+        return {
+            'iterations': iterations,
+            'deploys_per_sandbox': deploys,
+            'wall_time': wall_time,
+            'commands': dict((command, latency_summary(harness.timings[command])) for command in COMMANDS),
+            'api_calls': dict((command, dict(counter.calls[command])) for command in COMMANDS),
+            'api_calls_total': stats['total'],
+            'api_errors': stats['errors'],
+            'leaked': {'instances': len(compute.instances), 'disks': len(compute.disks),
+                       'networks': len([name for name in compute.networks if name != 'default'])}
+        }
+
+
+def format_report(report):
+    lines = ['{0} sandboxes x {1} deploys in {2:.2f}s, {3} API calls'.format(
+        report['iterations'], report['deploys_per_sandbox'], report['wall_time'], report['api_calls_total'])]
+    lines.append('{0:<22}{1:>7}{2:>10}{3:>10}{4:>10}{5:>12}'.format('command', 'count', 'p50 s', 'p99 s', 'max s',
+                                                                   'calls/cmd'))
+    for command in COMMANDS:
+        summary = report['commands'][command]
+        if not summary['count']:
+            continue
+        calls = sum(report['api_calls'][command].values())
+        lines.append('{0:<22}{1:>7}{2:>10.3f}{3:>10.3f}{4:>10.3f}{5:>12.1f}'.format(
+            command, summary['count'], summary['p50'], summary['p99'], summary['max'],
+            float(calls) / summary['count']))
+    for command in COMMANDS:
+        lines.append('{0}: {1}'.format(command, json.dumps(report['api_calls'][command], sort_keys=True)))
+    if report['api_errors']:
+        lines.append('API errors: {0}'.format(json.dumps(report['api_errors'], sort_keys=True)))
+    if any(report['leaked'].values()):
+        lines.append('LEAKED after cleanup: {0}'.format(json.dumps(report['leaked'], sort_keys=True)))
+    return '\n'.join(lines)
+
+
+def compute_arguments(parser):
+    """ adds the options of the fake Compute API, shared with the load test
+    """
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds every API request takes')
+    parser.add_argument('--operation-latency', type=float, default=0.5,
+                        help='seconds until a mutation\'s operation is DONE')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with 503')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests per second the fake accepts')
+    parser.add_argument('--instance-quota', type=int, default=None, help='instances the fake project may hold')
+    parser.add_argument('--read-rate', default='', help='the driver\'s API Read Rate attribute')
+    parser.add_argument('--mutation-rate', default='', help='the driver\'s API Mutation Rate attribute')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    parser.add_argument('--verbose', action='store_true', help='show the driver logs')
+
+
+def compute_from_arguments(args):
+    """ output: the FakeCompute and the provider attributes the options ask for
+    """
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    compute = FakeCompute(latency=args.latency, operation_latency=args.operation_latency,
+                          error_rate=args.error_rate, rate_limit=args.rate_limit,
+                          instance_quota=args.instance_quota)
+    return compute, {'API Read Rate': args.read_rate, 'API Mutation Rate': args.mutation_rate}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=3, help='sandboxes to run, one after the other')
+    parser.add_argument('--deploys', type=int, default=2, help='deploys per sandbox')
+    compute_arguments(parser)
+    args = parser.parse_args(argv)
+
+    compute, attributes = compute_from_arguments(args)
+    report = run_benchmark(args.iterations, args.deploys, compute, attributes)
+    print(json.dumps(report, indent=2, sort_keys=True) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
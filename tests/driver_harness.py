@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Runs the commands of `GcCloudProviderDriver` against a `FakeComputeServer`, the way CloudShell calls them.
+
+Builds the command contexts and the JSON requests of a sandbox, and times every command.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from mock import MagicMock, patch
+
+from ccp.gcp.client_registry import set_discovery_url
+from driver import GcCloudProviderDriver
+from tests.fake_compute import FakeComputeServer
+
+PROJECT = 'fake-project'
+REGION = 'us-west1'
+CUSTOM_VM = 'Google Cloud Provider.Google Cloud Custom VM'
+
+
+class Resource(object):
+    def __init__(self, name, attributes):
+        self.name = name
+        self.model = 'Google Cloud Provider'
+        self.attributes = attributes
+
+
+class Reservation(object):
+    def __init__(self, reservation_id):
+        self.reservation_id = reservation_id
+
+
+class CommandContext(object):
+    def __init__(self, resource, reservation_id):
+        self.resource = resource
+        self.reservation = Reservation(reservation_id)
+
+
+class _LoggingSession(object):
+    """ stands in for LoggingSessionContext, which needs a CloudShell installation
+    """
+
+    def __init__(self, context):
+        pass
+
+    def __enter__(self):
+        return logging.getLogger('gcp_shell.harness')
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _CloudShellSession(_LoggingSession):
+    def __enter__(self):
+        return MagicMock()
+
+
+def _action_id():
+    return str(uuid.uuid4())
+
+
+def prepare_request(reservation_id, subnets=('Subnet A',)):
+    """ output: the PrepareSandboxInfra request json, one /24 subnet per alias
+    """
+    actions = [
+        {'type': 'prepareCloudInfra', 'actionId': _action_id(),
+         'actionParams': {'type': 'prepareCloudInfraParams', 'cidr': '10.0.0.0/16'}},
+        {'type': 'createKeys', 'actionId': _action_id()},
+    ]
+    for index, alias in enumerate(subnets):
+        actions.append({'type': 'prepareSubnet', 'actionId': _action_id(),
+                        'actionParams': {'type': 'prepareSubnetParams', 'alias': alias, 'isPublic': True,
+                                         'cidr': '10.0.{0}.0/24'.format(index)}})
+    return json.dumps({'driverRequest': {'actions': actions}})
+
+
+def deploy_request(app_name, subnet_id, image_id='debian-9', image_project='debian-cloud', zone=''):
+    attributes = {'Image Project': image_project, 'Image Id': image_id, 'Image Source': 'public',
+                  'Machine Type': 'n1-standard-1', 'Disk Type': 'standard', 'Disk Size': '10',
+                  'Autoload': 'False', 'Wait for IP': 'False', 'Zone': zone}
+    actions = [
+        {'type': 'deployApp', 'actionId': _action_id(),
+         'actionParams': {'type': 'deployAppParams', 'appName': app_name,
+                          'deployment': {'type': 'deployAppDeploymentInfo', 'deploymentPath': CUSTOM_VM,
+                                         'attributes': [{'type': 'attribute',
+                                                         'attributeName': CUSTOM_VM + '.' + name,
+                                                         'attributeValue': value}
+                                                        for name, value in sorted(attributes.items())]},
+                          'appResource': {'type': 'appResourceInfo', 'attributes': []}}},
+        {'type': 'connectSubnet', 'actionId': _action_id(),
+         'actionParams': {'type': 'connectToSubnetParams', 'subnetId': subnet_id, 'isPublic': True}},
+    ]
+    return json.dumps({'driverRequest': {'actions': actions}})
+
+
+def cleanup_request():
+    return json.dumps({'driverRequest': {'actions': [{'type': 'cleanupNetwork', 'actionId': _action_id()}]}})
+
+
+def vm_details_request(vm_names):
+    return json.dumps({'items': [{'deployedAppJson': {'name': name}} for name in vm_names]})
+
+
+def action_results(response):
+    return json.loads(response)['driverResponse']['actionResults']
+
+
+class DriverHarness(object):
+    """ a driver wired to a local fake Compute API, with the timings of every command it ran
+
+    :param FakeCompute compute: the fake to serve, a default one when None
+    :param dict attributes: cloud provider attribute overrides, by attribute name without the model prefix
+    """
+
+    def __init__(self, compute=None, attributes=None):
+        self.server = FakeComputeServer(compute)
+        self.compute = self.server.compute
+        self._directory = tempfile.mkdtemp()
+        provider = {'Credentials Json Path': os.path.join(self._directory, 'service_account.json'),
+                    'project': PROJECT, 'Region': REGION, 'Zones': '', 'Zone Race Count': '1',
+                    'API Read Rate': '', 'API Mutation Rate': ''}
+        provider.update(attributes or {})
+        self.resource = Resource('gcp', dict(('Google Cloud Provider.' + key, value)
+                                             for key, value in provider.items()))
+        self.driver = GcCloudProviderDriver()
+        self._lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self._patches = [patch('driver.LoggingSessionContext', _LoggingSession),
+                         patch('driver.CloudShellSessionContext', _CloudShellSession)]
+
+    def start(self):
+        self.server.start()
+        self.server.write_service_account(self.resource.attributes['Google Cloud Provider.Credentials Json Path'],
+                                          project=PROJECT)
+        set_discovery_url(self.server.discovery_url)
+        for p in self._patches:
+            p.start()
+        return self
+
+    def stop(self):
+        for p in reversed(self._patches):
+            p.stop()
+        self.driver.cleanup()
+        set_discovery_url(None)
+        self.server.stop()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        """ forgets the command timings and the API call counts so far
+        """
+        with self._lock:
+            self.timings = defaultdict(list)
+        self.compute.reset_stats()
+
+    def context(self, reservation_id):
+        return CommandContext(self.resource, reservation_id)
+
+    @contextmanager
+    def _timed(self, command):
+        started = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.timings[command].append(time.time() - started)
+
+    def prepare(self, reservation_id, subnets=('Subnet A',)):
+        """ output: the subnet id of every prepared subnet alias
+        """
+        with self._timed('PrepareSandboxInfra'):
+            response = self.driver.PrepareSandboxInfra(self.context(reservation_id),
+                                                       prepare_request(reservation_id, subnets), MagicMock())
+        results = action_results(response)
+        failed = [result for result in results if not result['success']]
+        if failed:
+            raise Exception('PrepareSandboxInfra failed: {0}'.format(failed[0]['errorMessage']))
+        return [result['subnetId'] for result in results if result['type'] == 'PrepareSubnet']
+
+    def deploy(self, reservation_id, app_name, subnet_id, **kwargs):
+        """ output: the name of the deployed VM
+        """
+        with self._timed('Deploy'):
+            response = self.driver.Deploy(self.context(reservation_id), deploy_request(app_name, subnet_id, **kwargs),
+                                          MagicMock())
+        result = action_results(response)[0]
+        if not result['success']:
+            raise Exception('Deploy failed: {0}'.format(result['errorMessage']))
+        return result['vmName']
+
+    def vm_details(self, reservation_id, vm_names):
+        with self._timed('GetVmDetails'):
+            response = self.driver.GetVmDetails(self.context(reservation_id), vm_details_request(vm_names),
+                                                MagicMock())
+        return json.loads(response)
+
+    def cleanup(self, reservation_id):
+        with self._timed('CleanupSandboxInfra'):
+            response = self.driver.CleanupSandboxInfra(self.context(reservation_id), cleanup_request())
+        result = action_results(response)[0]
+        if not result['success']:
+            raise Exception('CleanupSandboxInfra failed: {0}'.format(result['errorMessage']))
+
+    def sandbox(self, deploys=1, reservation_id=None):
+        """ the lifecycle of one sandbox: prepare, deploy, get the VM details and clean up
+            output: the names of the deployed VMs
+        """
+        reservation_id = reservation_id or str(uuid.uuid4())
+        subnet_id = self.prepare(reservation_id)[0]
+        vm_names = [self.deploy(reservation_id, 'app {0}'.format(i), subnet_id) for i in range(deploys)]
+        self.vm_details(reservation_id, vm_names)
+        self.cleanup(reservation_id)
+        return vm_names
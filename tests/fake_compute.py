@@ -0,0 +1,804 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for the Compute Engine API, for offline end to end tests and benchmarks of the driver.
+
+It serves a minimal discovery document, an OAuth token endpoint and the Compute methods the driver uses.
+Networks, subnetworks, instances, disks, templates, images and zone/region/global operations are kept in memory.
+Request latency, operation latency, error injection, rate limits and quotas are configurable.
+"""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+import rsa
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+SERVICE_PATH = 'compute/v1/projects/'
+CLIENT_EMAIL = 'driver@fake-project.iam.gserviceaccount.com'
+CAPACITY_ERROR = 'ZONE_RESOURCE_POOL_EXHAUSTED'
+IN_USE_ERROR = 'RESOURCE_IN_USE_BY_ANOTHER_RESOURCE'
+
+# resource, method, http method, path, extra query parameters, request body
+METHODS = [
+    ('networks', 'insert', 'POST', '{project}/global/networks', ['requestId'], 'Network'),
+    ('networks', 'get', 'GET', '{project}/global/networks/{network}', [], None),
+    ('networks', 'delete', 'DELETE', '{project}/global/networks/{network}', ['requestId'], None),
+    ('subnetworks', 'insert', 'POST', '{project}/regions/{region}/subnetworks', ['requestId'], 'Subnetwork'),
+    ('subnetworks', 'delete', 'DELETE', '{project}/regions/{region}/subnetworks/{subnetwork}', ['requestId'], None),
+    ('firewalls', 'list', 'GET', '{project}/global/firewalls', ['filter', 'pageToken', 'maxResults'], None),
+    ('firewalls', 'delete', 'DELETE', '{project}/global/firewalls/{firewall}', ['requestId'], None),
+    ('routes', 'list', 'GET', '{project}/global/routes', ['filter', 'pageToken', 'maxResults'], None),
+    ('routes', 'delete', 'DELETE', '{project}/global/routes/{route}', ['requestId'], None),
+    ('healthChecks', 'list', 'GET', '{project}/global/healthChecks', ['filter', 'pageToken', 'maxResults'], None),
+    ('images', 'getFromFamily', 'GET', '{project}/global/images/family/{family}', [], None),
+    ('images', 'get', 'GET', '{project}/global/images/{image}', [], None),
+    ('instanceTemplates', 'get', 'GET', '{project}/global/instanceTemplates/{instanceTemplate}', [], None),
+    ('regions', 'get', 'GET', '{project}/regions/{region}', [], None),
+    ('instances', 'aggregatedList', 'GET', '{project}/aggregated/instances', ['filter', 'pageToken', 'maxResults'],
+     None),
+    ('instances', 'bulkInsert', 'POST', '{project}/zones/{zone}/instances/bulkInsert', ['requestId'],
+     'BulkInsertInstanceResource'),
+    ('instances', 'insert', 'POST', '{project}/zones/{zone}/instances', ['requestId', 'sourceInstanceTemplate'],
+     'Instance'),
+    ('instances', 'get', 'GET', '{project}/zones/{zone}/instances/{instance}', [], None),
+    ('instances', 'delete', 'DELETE', '{project}/zones/{zone}/instances/{instance}', ['requestId'], None),
+    ('instances', 'start', 'POST', '{project}/zones/{zone}/instances/{instance}/start', ['requestId'], None),
+    ('instances', 'stop', 'POST', '{project}/zones/{zone}/instances/{instance}/stop', ['requestId'], None),
+    ('instances', 'suspend', 'POST', '{project}/zones/{zone}/instances/{instance}/suspend', ['requestId'], None),
+    ('instances', 'resume', 'POST', '{project}/zones/{zone}/instances/{instance}/resume', ['requestId'], None),
+    ('disks', 'aggregatedList', 'GET', '{project}/aggregated/disks', ['filter', 'pageToken', 'maxResults'], None),
+    ('disks', 'delete', 'DELETE', '{project}/zones/{zone}/disks/{disk}', ['requestId'], None),
+    ('zoneOperations', 'get', 'GET', '{project}/zones/{zone}/operations/{operation}', [], None),
+    ('zoneOperations', 'wait', 'POST', '{project}/zones/{zone}/operations/{operation}/wait', [], None),
+    ('zoneOperations', 'list', 'GET', '{project}/zones/{zone}/operations', ['filter', 'pageToken', 'maxResults'],
+     None),
+    ('regionOperations', 'get', 'GET', '{project}/regions/{region}/operations/{operation}', [], None),
+    ('regionOperations', 'wait', 'POST', '{project}/regions/{region}/operations/{operation}/wait', [], None),
+    ('regionOperations', 'list', 'GET', '{project}/regions/{region}/operations',
+     ['filter', 'pageToken', 'maxResults'], None),
+    ('globalOperations', 'get', 'GET', '{project}/global/operations/{operation}', [], None),
+    ('globalOperations', 'wait', 'POST', '{project}/global/operations/{operation}/wait', [], None),
+    ('globalOperations', 'list', 'GET', '{project}/global/operations', ['filter', 'pageToken', 'maxResults'], None),
+]
+
+_PATH_PARAMETER = re.compile(r'{(\w+)}')
+_FILTER_TERM = re.compile(r'^\(?\s*([\w.-]+)\s*=\s*"?([^"]*?)"?\s*\)?$')
+_ROUTES = [(resource, method, http_method,
+            re.compile('^' + _PATH_PARAMETER.sub(r'(?P<\1>[^/]+)', path) + '$'))
+           for resource, method, http_method, path, _, _ in METHODS]
+
+_private_key = []
+
+
+def _service_account_key():
+    """ a throw away RSA key, google.auth signs the token request with it
+    """
+    if not _private_key:
+        _, private_key = rsa.newkeys(1024)
+        _private_key.append(private_key.save_pkcs1().decode('utf-8'))
+    return _private_key[0]
+
+
+def discovery_document(root_url):
+    """ input: the root url of the fake server
+        output: a discovery document describing only the methods the fake implements
+    """
+    resources = {}
+    schemas = {}
+    for resource, method, http_method, path, query, body in METHODS:
+        parameters = dict((name, {'type': 'string', 'location': 'path', 'required': True})
+                          for name in _PATH_PARAMETER.findall(path))
+        for name in query:
+            parameters[name] = {'type': 'integer', 'format': 'uint32', 'location': 'query'} \
+                if name == 'maxResults' else {'type': 'string', 'location': 'query'}
+        response = 'Operation'
+        if method in ('list', 'aggregatedList'):
+            response = '{0}{1}'.format(resource, method)
+            schemas[response] = {'id': response, 'type': 'object',
+                                 'properties': {'items': {'type': 'any'}, 'nextPageToken': {'type': 'string'}}}
+        elif http_method == 'GET':
+            response = resource
+        schemas.setdefault(response, {'id': response, 'type': 'object'})
+        description = {
+            'id': 'compute.{0}.{1}'.format(resource, method),
+            'path': path,
+            'httpMethod': http_method,
+            'parameters': parameters,
+            'parameterOrder': _PATH_PARAMETER.findall(path),
+            'response': {'$ref': response}
+        }
+        if body:
+            schemas.setdefault(body, {'id': body, 'type': 'object'})
+            description['request'] = {'$ref': body}
+        resources.setdefault(resource, {'methods': {}})['methods'][method] = description
+
+    return {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': 'compute:v1',
+        'name': 'compute',
+        'version': 'v1',
+        'rootUrl': root_url,
+        'servicePath': SERVICE_PATH,
+        'batchPath': 'batch/compute/v1',
+        'protocol': 'rest',
+        'parameters': {
+            'alt': {'type': 'string', 'default': 'json', 'location': 'query'},
+            'fields': {'type': 'string', 'location': 'query'},
+            'prettyPrint': {'type': 'boolean', 'default': 'true', 'location': 'query'},
+            'quotaUser': {'type': 'string', 'location': 'query'}
+        },
+        'schemas': schemas,
+        'resources': resources
+    }
+
+
+class ApiError(Exception):
+    def __init__(self, status, reason, message):
+        super(ApiError, self).__init__(message)
+        self.status = status
+        self.reason = reason
+
+    def to_json(self):
+        return {'error': {'code': self.status, 'message': str(self),
+                          'errors': [{'domain': 'global', 'reason': self.reason, 'message': str(self)}]}}
+
+
+def _matches(item, expression):
+    """ supports the filters the driver sends: terms like name = "x" or labels.key = "v", joined by OR
+    """
+    if not expression:
+        return True
+    for term in re.split(r'\s+OR\s+', expression.strip()):
+        match = _FILTER_TERM.match(term.strip())
+        if not match:
+            raise ApiError(400, 'invalid', 'Invalid filter term: {0}'.format(term))
+        value = item
+        for key in match.group(1).split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None and str(value) == match.group(2):
+            return True
+    return False
+
+
+def _last(link):
+    return link.split('/')[-1] if link else link
+
+
+class FakeCompute(object):
+    """ the in memory state and behaviour of the fake project
+
+    :param dict regions: region name to its zone names
+    :param float latency: seconds every request takes
+    :param dict method_latency: per method id (e.g. compute.instances.insert) latency, overrides latency
+    :param float operation_latency: seconds from accepting a mutation until its operation is DONE
+    :param float error_rate: probability of a request failing with 503
+    :param dict fail_methods: method id to the number of its next calls that fail with 503
+    :param int rate_limit: requests per second accepted, above it requests fail with 403 rateLimitExceeded
+    :param int instance_quota: instances the project may hold, inserts above it fail with 403 quotaExceeded
+    :param capacity_exhausted_zones: zones whose instance inserts fail with ZONE_RESOURCE_POOL_EXHAUSTED
+    :param int page_size: items per page of list calls
+    :param float wait_timeout: seconds an operations.wait call holds the request at most
+    """
+
+    def __init__(self, regions=None, latency=0.0, method_latency=None, operation_latency=0.2, error_rate=0.0,
+                 fail_methods=None, rate_limit=None, instance_quota=None, capacity_exhausted_zones=(),
+                 page_size=500, wait_timeout=30.0, seed=None):
+        self.regions = regions or {'us-west1': ['us-west1-a', 'us-west1-b', 'us-west1-c']}
+        self.latency = latency
+        self.method_latency = dict(method_latency or {})
+        self.operation_latency = operation_latency
+        self.error_rate = error_rate
+        self.fail_methods = dict(fail_methods or {})
+        self.rate_limit = rate_limit
+        self.instance_quota = instance_quota
+        self.capacity_exhausted_zones = set(capacity_exhausted_zones)
+        self.page_size = page_size
+        self.wait_timeout = wait_timeout
+        self.base_url = None
+
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._calls = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._window = [0, 0]  # second, requests in it
+        self._ids = itertools.count(1000000000000000)
+
+        self.networks = {}
+        self.subnetworks = {}  # (region, name) to subnetwork
+        self.instances = {}  # (zone, name) to instance
+        self.disks = {}  # (zone, name) to disk
+        self.operations = {}  # name to operation, with internal '_' keys
+        self.request_ids = {}
+        self.images = {('debian-cloud', 'debian-9-stretch-v20190326'): {'family': 'debian-9', 'status': 'READY'}}
+        self.templates = {'benchmark-template': {
+            'machineType': 'n1-standard-1',
+            'labels': {'team': 'benchmark'},
+            'disks': [{'boot': True, 'autoDelete': True,
+                       'initializeParams': {'sourceImage': 'debian-9', 'diskSizeGb': '10'}}],
+            'networkInterfaces': [{'network': 'global/networks/default'}]
+        }}
+        self._ip_counters = defaultdict(int)
+        self._nat_counter = [0]
+
+    # ----------------------------------------------------------------------------------------------------------
+    # request handling
+
+    def handle(self, resource, method, http_method, params, body):
+        """ output: the response json, raises ApiError for error responses
+        """
+        method_id = 'compute.{0}.{1}'.format(resource, method)
+        with self._lock:
+            self._calls[method_id] += 1
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        try:
+            self._throttle(method_id)
+            delay = self.method_latency.get(method_id, self.latency)
+            if delay:
+                time.sleep(delay)
+            with self._lock:
+                self._advance()
+                request_id = params.get('requestId')
+                if request_id and request_id in self.request_ids:
+                    return self._public(self.operations[self.request_ids[request_id]])
+            if method == 'wait':
+                return self._wait(params)
+            with self._lock:
+                result = getattr(self, '_{0}_{1}'.format(resource, method))(params, body)
+                if request_id and result.get('kind') == 'compute#operation':
+                    self.request_ids[request_id] = result['name']
+                return result
+        except ApiError as e:
+            with self._lock:
+                self._errors['{0}:{1}'.format(method_id, e.status)] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _throttle(self, method_id):
+        with self._lock:
+            if self.fail_methods.get(method_id):
+                self.fail_methods[method_id] -= 1
+                raise ApiError(503, 'backendError', 'Injected failure')
+            if self.error_rate and self._random.random() < self.error_rate:
+                raise ApiError(503, 'backendError', 'Injected failure')
+            if self.rate_limit:
+                second = int(time.time())
+                if self._window[0] != second:
+                    self._window[:] = [second, 0]
+                self._window[1] += 1
+                if self._window[1] > self.rate_limit:
+                    raise ApiError(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+
+    def stats(self):
+        """ output: the number of calls per method id, of error responses per method id and status,
+            and the most requests served at once
+        """
+        with self._lock:
+            return {'calls': dict(self._calls), 'errors': dict(self._errors), 'total': sum(self._calls.values()),
+                    'max_in_flight': self._max_in_flight}
+
+    def reset_stats(self):
+        with self._lock:
+            self._calls.clear()
+            self._errors.clear()
+            self._max_in_flight = self._in_flight
+
+    # ----------------------------------------------------------------------------------------------------------
+    # links and operations
+
+    def _link(self, project, *parts):
+        return '{0}{1}{2}/{3}'.format(self.base_url, SERVICE_PATH, project, '/'.join(parts))
+
+    def _next_id(self):
+        return str(next(self._ids))
+
+    def _operation(self, project, operation_type, target_link, zone=None, region=None, finish=None,
+                   target_id=None):
+        """ finish is called, under the lock, once the operation is due
+            it may return an error code, the operation then ends with that error
+        """
+        name = 'operation-{0}'.format(self._next_id())
+        scope = ('zones', zone) if zone else ('regions', region) if region else ('global',)
+        operation = {
+            'kind': 'compute#operation',
+            'id': self._next_id(),
+            'name': name,
+            'operationType': operation_type,
+            'targetLink': target_link,
+            'targetId': target_id or self._next_id(),
+            'status': 'RUNNING',
+            'progress': 0,
+            'selfLink': self._link(project, *(scope + ('operations', name))),
+            '_due': time.time() + self.operation_latency,
+            '_finish': finish
+        }
+        if zone:
+            operation['zone'] = self._link(project, 'zones', zone)
+        if region:
+            operation['region'] = self._link(project, 'regions', region)
+        self.operations[name] = operation
+        return self._public(operation)
+
+    @staticmethod
+    def _public(operation):
+        return dict((key, value) for key, value in operation.items() if not key.startswith('_'))
+
+    def _advance(self):
+        """ completes the operations that are due, in the order they were accepted
+        """
+        now = time.time()
+        due = sorted((op for op in self.operations.values() if op['status'] != 'DONE' and op['_due'] <= now),
+                     key=lambda op: op['_due'])
+        for operation in due:
+            error = operation['_finish']() if operation['_finish'] else None
+            if error:
+                operation['error'] = {'errors': [{'code': error, 'message': error}]}
+            operation['status'] = 'DONE'
+            operation['progress'] = 100
+        if due:
+            self._changed.notify_all()
+
+    def _wait(self, params):
+        deadline = time.time() + self.wait_timeout
+        with self._lock:
+            while True:
+                self._advance()
+                operation = self._get_operation(params)
+                remaining = min(deadline, operation['_due']) - time.time()
+                if operation['status'] == 'DONE' or deadline <= time.time():
+                    return self._public(operation)
+                self._changed.wait(max(remaining, 0.01))
+
+    def _get_operation(self, params):
+        operation = self.operations.get(params['operation'])
+        if operation is None:
+            raise ApiError(404, 'notFound', 'The resource operation {0} was not found'.format(params['operation']))
+        return operation
+
+    def _list_operations(self, params, zone=None, region=None):
+        operations = [self._public(op) for op in self.operations.values()
+                      if _last(op.get('zone')) == zone and _last(op.get('region')) == region]
+        return self._page([op for op in operations if _matches(op, params.get('filter'))], params,
+                          'compute#operationList')
+
+    def _zoneOperations_get(self, params, body):
+        return self._public(self._get_operation(params))
+
+    _regionOperations_get = _globalOperations_get = _zoneOperations_get
+
+    def _zoneOperations_list(self, params, body):
+        return self._list_operations(params, zone=params['zone'])
+
+    def _regionOperations_list(self, params, body):
+        return self._list_operations(params, region=params['region'])
+
+    def _globalOperations_list(self, params, body):
+        return self._list_operations(params)
+
+    def _page(self, items, params, kind):
+        start = int(params.get('pageToken') or 0)
+        size = min(int(params.get('maxResults') or self.page_size), self.page_size)
+        response = {'kind': kind, 'items': items[start:start + size]}
+        if start + size < len(items):
+            response['nextPageToken'] = str(start + size)
+        return response
+
+    def _aggregated(self, items, params, key, kind):
+        """ items: (zone, resource) pairs, output: one aggregatedList page grouped by zone
+        """
+        matching = [(zone, item) for zone, item in sorted(items, key=lambda pair: (pair[0], pair[1]['name']))
+                    if _matches(item, params.get('filter'))]
+        page = self._page(matching, params, kind)
+        grouped = dict(('zones/' + zone, {'warning': {'code': 'NO_RESULTS_ON_PAGE'}})
+                       for zones in self.regions.values() for zone in zones)
+        for zone, item in page['items']:
+            grouped['zones/' + zone] = {key: grouped.get('zones/' + zone, {}).get(key, []) + [item]}
+        page['items'] = grouped
+        return page
+
+    def _not_found(self, kind, name):
+        return ApiError(404, 'notFound', "The resource '{0}/{1}' was not found".format(kind, name))
+
+    # ----------------------------------------------------------------------------------------------------------
+    # global resources
+
+    def _healthChecks_list(self, params, body):
+        return {'kind': 'compute#healthCheckList', 'items': []}
+
+    def _firewalls_list(self, params, body):
+        return self._page([], params, 'compute#firewallList')
+
+    def _routes_list(self, params, body):
+        return self._page([], params, 'compute#routeList')
+
+    def _firewalls_delete(self, params, body):
+        raise self._not_found('firewalls', params['firewall'])
+
+    def _routes_delete(self, params, body):
+        raise self._not_found('routes', params['route'])
+
+    def _images_get(self, params, body):
+        image = self.images.get((params['project'], params['image']))
+        if image is None:
+            raise self._not_found('images', params['image'])
+        return dict(image, name=params['image'], selfLink=self._link(params['project'], 'global/images',
+                                                                     params['image']))
+
+    def _images_getFromFamily(self, params, body):
+        for (project, name), image in sorted(self.images.items(), reverse=True):
+            if project == params['project'] and image.get('family') == params['family']:
+                return dict(image, name=name, selfLink=self._link(project, 'global/images', name))
+        raise self._not_found('images/family', params['family'])
+
+    def _instanceTemplates_get(self, params, body):
+        properties = self.templates.get(params['instanceTemplate'])
+        if properties is None:
+            raise self._not_found('instanceTemplates', params['instanceTemplate'])
+        return {'name': params['instanceTemplate'], 'properties': properties,
+                'selfLink': self._link(params['project'], 'global/instanceTemplates', params['instanceTemplate'])}
+
+    def _regions_get(self, params, body):
+        zones = self.regions.get(params['region'])
+        if zones is None:
+            raise self._not_found('regions', params['region'])
+        return {'name': params['region'], 'zones': [self._link(params['project'], 'zones', zone) for zone in zones]}
+
+    def _networks_insert(self, params, body):
+        project, name = params['project'], body['name']
+        if name in self.networks:
+            raise ApiError(409, 'alreadyExists', "The resource 'networks/{0}' already exists".format(name))
+        link = self._link(project, 'global/networks', name)
+        self.networks[name] = dict(body, id=self._next_id(), selfLink=link, subnetworks=[])
+        return self._operation(project, 'insert', link)
+
+    def _networks_get(self, params, body):
+        network = self.networks.get(params['network'])
+        if network is None:
+            raise self._not_found('networks', params['network'])
+        return network
+
+    def _networks_delete(self, params, body):
+        project, name = params['project'], params['network']
+        network = self._networks_get(params, body)
+
+        def finish():
+            if network['subnetworks']:
+                return IN_USE_ERROR
+            self.networks.pop(name, None)
+
+        return self._operation(project, 'delete', network['selfLink'], finish=finish)
+
+    def _subnetworks_insert(self, params, body):
+        project, region, name = params['project'], params['region'], body['name']
+        network = self.networks.get(_last(body.get('network')))
+        if network is None:
+            raise ApiError(400, 'invalid', 'Invalid value for field resource.network')
+        if (region, name) in self.subnetworks:
+            raise ApiError(409, 'alreadyExists', "The resource 'subnetworks/{0}' already exists".format(name))
+        link = self._link(project, 'regions', region, 'subnetworks', name)
+        self.subnetworks[(region, name)] = dict(body, id=self._next_id(), selfLink=link, region=region,
+                                                network=network['selfLink'])
+        network['subnetworks'].append(link)
+        return self._operation(project, 'insert', link, region=region)
+
+    def _subnetworks_delete(self, params, body):
+        project, region, name = params['project'], params['region'], params['subnetwork']
+        subnetwork = self.subnetworks.get((region, name))
+        if subnetwork is None:
+            raise self._not_found('subnetworks', name)
+
+        def finish():
+            if any(nic.get('subnetwork') == subnetwork['selfLink']
+                   for instance in self.instances.values() for nic in instance['networkInterfaces']):
+                return IN_USE_ERROR
+            self.subnetworks.pop((region, name), None)
+            network = self.networks.get(_last(subnetwork['network']))
+            if network and subnetwork['selfLink'] in network['subnetworks']:
+                network['subnetworks'].remove(subnetwork['selfLink'])
+
+        return self._operation(project, 'delete', subnetwork['selfLink'], region=region, finish=finish)
+
+    # ----------------------------------------------------------------------------------------------------------
+    # instances and disks
+
+    def _region_of(self, zone):
+        for region, zones in self.regions.items():
+            if zone in zones:
+                return region
+        raise ApiError(400, 'invalid', 'Unknown zone {0}'.format(zone))
+
+    def _subnetwork_for(self, project, zone, nic):
+        """ input: an interface of an insert request, output: the subnetwork it attaches to
+        """
+        if nic.get('subnetwork'):
+            region, name = nic['subnetwork'].split('/')[-3], _last(nic['subnetwork'])
+        else:
+            region, name = self._region_of(zone), 'default'
+        subnetwork = self.subnetworks.get((region, name))
+        if subnetwork is None and name == 'default':
+            # every project starts with the default network
+            self.networks.setdefault('default', {'name': 'default', 'id': self._next_id(), 'subnetworks': [],
+                                                 'selfLink': self._link(project, 'global/networks/default')})
+            subnetwork = self.subnetworks[(region, name)] = {
+                'name': 'default', 'ipCidrRange': '10.128.0.0/20', 'region': region,
+                'network': self.networks['default']['selfLink'],
+                'selfLink': self._link(project, 'regions', region, 'subnetworks', 'default')}
+            self.networks['default']['subnetworks'].append(subnetwork['selfLink'])
+        if subnetwork is None:
+            raise ApiError(400, 'invalid', "The resource 'subnetworks/{0}' was not found".format(name))
+        return subnetwork
+
+    def _new_instance(self, project, zone, properties):
+        """ builds the instance and its boot disk from request (or template) properties
+        """
+        name = properties['name']
+        if (zone, name) in self.instances:
+            raise ApiError(409, 'alreadyExists', "The resource 'instances/{0}' already exists".format(name))
+        interfaces = []
+        for index, nic in enumerate(properties.get('networkInterfaces') or [{}]):
+            subnetwork = self._subnetwork_for(project, zone, nic)
+            self._ip_counters[subnetwork['selfLink']] += 1
+            base = subnetwork['ipCidrRange'].split('/')[0].split('.')
+            count = self._ip_counters[subnetwork['selfLink']] + 1
+            interface = {'name': 'nic{0}'.format(index), 'network': subnetwork['network'],
+                         'subnetwork': subnetwork['selfLink'],
+                         'networkIP': '{0}.{1}.{2}.{3}'.format(base[0], base[1], int(base[2]) + count // 250,
+                                                               count % 250)}
+            if nic.get('accessConfigs'):
+                self._nat_counter[0] += 1
+                interface['accessConfigs'] = [{'name': 'External NAT', 'type': 'ONE_TO_ONE_NAT',
+                                               'natIP': '35.{0}.{1}.{2}'.format(200 + self._nat_counter[0] // 62500,
+                                                                                self._nat_counter[0] // 250 % 250,
+                                                                                self._nat_counter[0] % 250)}]
+            interfaces.append(interface)
+
+        instance_id = self._next_id()
+        link = self._link(project, 'zones', zone, 'instances', name)
+        disks = []
+        for index, disk in enumerate(properties.get('disks') or []):
+            disk_name = name if index == 0 else '{0}-{1}'.format(name, index)
+            init = disk.get('initializeParams', {})
+            self.disks[(zone, disk_name)] = {'name': disk_name, 'id': self._next_id(),
+                                             'zone': self._link(project, 'zones', zone),
+                                             'sizeGb': str(init.get('diskSizeGb', '10')),
+                                             'labels': dict(init.get('labels') or {}),
+                                             'users': [link],
+                                             'selfLink': self._link(project, 'zones', zone, 'disks', disk_name)}
+            disks.append({'deviceName': disk_name, 'boot': disk.get('boot', index == 0),
+                          'autoDelete': disk.get('autoDelete', True),
+                          'source': self.disks[(zone, disk_name)]['selfLink']})
+
+        return {'kind': 'compute#instance', 'id': instance_id, 'name': name, 'status': 'PROVISIONING',
+                'zone': self._link(project, 'zones', zone),
+                'machineType': self._link(project, 'zones', zone, 'machineTypes',
+                                          _last(properties.get('machineType', 'n1-standard-1'))),
+                'labels': dict(properties.get('labels') or {}), 'networkInterfaces': interfaces, 'disks': disks,
+                'selfLink': link}
+
+    def _check_quota(self, count):
+        if self.instance_quota is not None and len(self.instances) + count > self.instance_quota:
+            raise ApiError(403, 'quotaExceeded', "Quota 'INSTANCES' exceeded. Limit: {0}".format(self.instance_quota))
+
+    def _provision(self, zone, instances):
+        """ output: the finish callback of the insert operation of the instances
+        """
+        def finish():
+            if zone in self.capacity_exhausted_zones:
+                for instance in instances:
+                    self._remove_instance(zone, instance)
+                return CAPACITY_ERROR
+            for instance in instances:
+                instance['status'] = 'RUNNING'
+        return finish
+
+    def _remove_instance(self, zone, instance):
+        self.instances.pop((zone, instance['name']), None)
+        for disk in instance['disks']:
+            key = (zone, _last(disk['source']))
+            if disk['autoDelete']:
+                self.disks.pop(key, None)
+            elif key in self.disks:
+                self.disks[key]['users'] = []
+
+    def _template_properties(self, params):
+        template = params.get('sourceInstanceTemplate')
+        if not template:
+            return {}
+        properties = self.templates.get(_last(template))
+        if properties is None:
+            raise self._not_found('instanceTemplates', _last(template))
+        return properties
+
+    def _instances_insert(self, params, body):
+        project, zone = params['project'], params['zone']
+        self._region_of(zone)
+        self._check_quota(1)
+        properties = dict(self._template_properties(params))
+        properties.update(body)
+        instance = self._new_instance(project, zone, properties)
+        self.instances[(zone, instance['name'])] = instance
+        return self._operation(project, 'insert', instance['selfLink'], zone=zone,
+                               finish=self._provision(zone, [instance]), target_id=instance['id'])
+
+    def _instances_bulkInsert(self, params, body):
+        project, zone = params['project'], params['zone']
+        self._region_of(zone)
+        names = sorted(body.get('perInstanceProperties', {}))
+        self._check_quota(len(names))
+        properties = dict(self._template_properties({'sourceInstanceTemplate': body.get('sourceInstanceTemplate')}))
+        properties.update(body.get('instanceProperties', {}))
+        instances = []
+        for name in names:
+            instance = self._new_instance(project, zone, dict(properties, name=name))
+            self.instances[(zone, name)] = instance
+            instances.append(instance)
+        return self._operation(project, 'bulkInsert', self._link(project, 'zones', zone), zone=zone,
+                               finish=self._provision(zone, instances))
+
+    def _instance(self, params):
+        instance = self.instances.get((params['zone'], params['instance']))
+        if instance is None:
+            raise self._not_found('instances', params['instance'])
+        return instance
+
+    def _instances_get(self, params, body):
+        return self._instance(params)
+
+    def _instances_aggregatedList(self, params, body):
+        return self._aggregated([(zone, instance) for (zone, _), instance in self.instances.items()],
+                                params, 'instances', 'compute#instanceAggregatedList')
+
+    def _instances_delete(self, params, body):
+        zone, instance = params['zone'], self._instance(params)
+        instance['status'] = 'STOPPING'
+        return self._operation(params['project'], 'delete', instance['selfLink'], zone=zone, target_id=instance['id'],
+                               finish=lambda: self._remove_instance(zone, instance))
+
+    def _power(self, params, operation_type, status):
+        instance = self._instance(params)
+
+        def finish():
+            instance['status'] = status
+
+        return self._operation(params['project'], operation_type, instance['selfLink'], zone=params['zone'],
+                               target_id=instance['id'], finish=finish)
+
+    def _instances_start(self, params, body):
+        return self._power(params, 'start', 'RUNNING')
+
+    def _instances_stop(self, params, body):
+        return self._power(params, 'stop', 'TERMINATED')
+
+    def _instances_suspend(self, params, body):
+        return self._power(params, 'suspend', 'SUSPENDED')
+
+    def _instances_resume(self, params, body):
+        return self._power(params, 'resume', 'RUNNING')
+
+    def _disks_aggregatedList(self, params, body):
+        return self._aggregated([(zone, disk) for (zone, _), disk in self.disks.items()],
+                                params, 'disks', 'compute#diskAggregatedList')
+
+    def _disks_delete(self, params, body):
+        zone, name = params['zone'], params['disk']
+        disk = self.disks.get((zone, name))
+        if disk is None:
+            raise self._not_found('disks', name)
+        if disk['users']:
+            raise ApiError(400, 'resourceInUseByAnotherResource',
+                           "The disk resource '{0}' is already being used".format(disk['selfLink']))
+
+        def finish():
+            self.disks.pop((zone, name), None)
+
+        return self._operation(params['project'], 'delete', disk['selfLink'], zone=zone, finish=finish)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _dispatch(self, http_method):
+        compute = self.server.compute
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+
+        if url.path == '/token':
+            return self._send(200, {'access_token': 'fake-token', 'expires_in': 3600, 'token_type': 'Bearer'})
+        if url.path == '/discovery/compute/v1':
+            return self._send(200, discovery_document(compute.base_url))
+
+        path = url.path[len('/' + SERVICE_PATH):] if url.path.startswith('/' + SERVICE_PATH) else None
+        for resource, method, route_method, pattern in _ROUTES:
+            match = pattern.match(path or '') if route_method == http_method else None
+            if match:
+                params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+                params.update(match.groupdict())
+                body = json.loads(raw_body.decode('utf-8')) if raw_body else None
+                try:
+                    return self._send(200, compute.handle(resource, method, http_method, params, body))
+                except ApiError as e:
+                    return self._send(e.status, e.to_json())
+        return self._send(404, ApiError(404, 'notFound', 'No such method {0} {1}'.format(http_method,
+                                                                                          url.path)).to_json())
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+class FakeComputeServer(object):
+    """ serves a FakeCompute on a local port, in a background thread
+    """
+
+    def __init__(self, compute=None):
+        self.compute = compute or FakeCompute()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.compute = self.compute
+        self.url = 'http://127.0.0.1:{0}/'.format(self._server.server_address[1])
+        self.compute.base_url = self.url
+        self._thread = None
+
+    @property
+    def discovery_url(self):
+        return self.url + 'discovery/compute/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-compute')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def write_service_account(self, path, project='fake-project'):
+        """ writes a service account key whose token requests go to this server
+        """
+        with open(path, 'w') as f:
+            json.dump({'type': 'service_account', 'project_id': project, 'private_key_id': 'fake',
+                       'private_key': _service_account_key(), 'client_email': CLIENT_EMAIL,
+                       'client_id': '1', 'token_uri': self.url + 'token'}, f)
+        return path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Concurrent load test of `GcCloudProviderDriver` against the local fake Compute API.
+
+Runs M sandbox lifecycles at once (PrepareSandboxInfra, N Deploys, GetVmDetails, CleanupSandboxInfra) through one
+driver, the way one execution server shares its process wide clients, rate limiters and caches, for increasing M.
+Reports throughput, queueing, tail latency and the concurrency at which the driver saturates or starts failing.
+
+    PYTHONPATH=src python -m tests.load_generator --levels 1,2,4,8,16 --deploys 3 --latency 0.05
+"""
+
+import argparse
+import json
+import threading
+import time
+import traceback
+import uuid
+
+from ccp.gcp.rate_limiter import get_rate_limiter
+from tests.benchmark import COMMANDS, compute_arguments, compute_from_arguments, percentile
+from tests.driver_harness import PROJECT, DriverHarness
+from tests.fake_compute import FakeCompute
+
+DEFAULT_LEVELS = (1, 2, 4, 8)
+# a level saturates the driver when it adds less than this share of throughput over the previous level
+SATURATION_GAIN = 0.1
+
+
+def tail_latency(values):
+    return {'count': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95),
+            'p99': percentile(values, 99), 'max': max(values) if values else None}
+
+
+def _queueing(before, after):
+    """ input: rate limiter stats before and after a level
+        output: how many calls waited for the client side rate limiter, and for how long
+    """
+    result = {}
+    for kind in after:
+        result[kind] = {'calls': after[kind]['calls'] - before[kind]['calls'],
+                        'queued': after[kind]['queued'] - before[kind]['queued'],
+                        'wait_seconds': after[kind]['wait_seconds'] - before[kind]['wait_seconds']}
+    return result
+
+
+def _sandbox(harness, deploys, result):
+    """ one sandbox lifecycle, its timing and error are written to result
+        the sandbox is cleaned up even when a deploy fails, like CloudShell's teardown does
+    """
+    reservation_id = str(uuid.uuid4())
+    started = time.time()
+    try:
+        subnet_id = harness.prepare(reservation_id)[0]
+        try:
+            vm_names = [harness.deploy(reservation_id, 'app {0}'.format(i), subnet_id) for i in range(deploys)]
+            harness.vm_details(reservation_id, vm_names)
+        finally:
+            harness.cleanup(reservation_id)
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    result['duration'] = time.time() - started
+
+
+def run_level(harness, concurrency, deploys, rounds=1):
+    """ runs concurrency sandboxes at once, rounds times over
+        output: the report of the level - dict
+    """
+    harness.reset()
+    limiter_before = get_rate_limiter(PROJECT).stats()
+    results = []
+    started = time.time()
+    for _ in range(rounds):
+        threads = []
+        for _ in range(concurrency):
+            result = {}
+            results.append(result)
+            thread = threading.Thread(target=_sandbox, args=(harness, deploys, result))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    wall_time = time.time() - started
+
+    stats = harness.compute.stats()
+    succeeded = [result['duration'] for result in results if 'error' not in result]
+    errors = [result['error'] for result in results if 'error' in result]
+    return {
+        'concurrency': concurrency,
+        'sandboxes': len(results),
+        'failed': len(errors),
+        'errors': sorted(set(errors)),
+        'wall_time': wall_time,
+        'throughput': len(succeeded) / wall_time * 60,  # sandboxes per minute
+        'deploys_per_minute': len(harness.timings['Deploy']) / wall_time * 60,
+        'sandbox': tail_latency(succeeded),
+        'commands': dict((command, tail_latency(harness.timings[command])) for command in COMMANDS),
+        'queueing': _queueing(limiter_before, get_rate_limiter(PROJECT).stats()),
+        'api_calls': stats['total'],
+        'api_errors': stats['errors'],
+        'max_in_flight': stats['max_in_flight']
+    }
+
+
+def saturation(levels):
+    """ input: the level reports, by increasing concurrency
+        output: the concurrency that saturates the driver and the first one that had failures, None for either
+                when it was not reached
+    """
+    saturated = failing = None
+    for previous, level in zip([None] + levels[:-1], levels):
+        if failing is None and level['failed']:
+            failing = level['concurrency']
+        if saturated is None and previous and \
+                level['throughput'] < previous['throughput'] * (1 + SATURATION_GAIN):
+            saturated = level['concurrency']
+    return {'saturated_at': saturated, 'failing_at': failing}
+
+
+def run_load(levels=DEFAULT_LEVELS, deploys=2, rounds=1, compute=None, attributes=None, stop_on_failure=True):
+    """ input: the concurrency levels to run, deploys per sandbox, rounds per level, the FakeCompute to run
+               against and provider attributes
+        output: the report - dict
+    """
+    compute = compute or FakeCompute()
+    reports = []
+    with DriverHarness(compute, attributes) as harness:
+        for concurrency in levels:
+            reports.append(run_level(harness, concurrency, deploys, rounds))
+            if stop_on_failure and reports[-1]['failed']:
+                break
+        leaked = {'instances': len(compute.instances), 'disks': len(compute.disks),
+                  'networks': len([name for name in compute.networks if name != 'default'])}
+
+    return dict(saturation(reports), levels=reports, deploys_per_sandbox=deploys, rounds=rounds, leaked=leaked)
+
+
+def format_report(report):
+    lines = ['{0:>5}{1:>10}{2:>8}{3:>12}{4:>12}{5:>11}{6:>11}{7:>11}{8:>11}{9:>10}'.format(
+        'M', 'sandboxes', 'failed', 'sbx/min', 'deploy/min', 'sbx p50', 'sbx p99', 'dep p99', 'queued s',
+        'in flight')]
+    for level in report['levels']:
+        queued = sum(kind['wait_seconds'] for kind in level['queueing'].values())
+        lines.append('{0:>5}{1:>10}{2:>8}{3:>12.1f}{4:>12.1f}{5:>11.2f}{6:>11.2f}{7:>11.2f}{8:>11.2f}{9:>10}'.format(
+            level['concurrency'], level['sandboxes'], level['failed'], level['throughput'],
+            level['deploys_per_minute'], level['sandbox']['p50'] or 0, level['sandbox']['p99'] or 0,
+            level['commands']['Deploy']['p99'] or 0, queued, level['max_in_flight']))
+        for error in level['errors']:
+            lines.append('      error: {0}'.format(error))
+    lines.append('saturated at M={0}, failing at M={1}'.format(report['saturated_at'] or 'not reached',
+                                                             report['failing_at'] or 'not reached'))
+    if any(report['leaked'].values()):
+        lines.append('LEAKED after cleanup: {0}'.format(json.dumps(report['leaked'], sort_keys=True)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--levels', default=','.join(str(level) for level in DEFAULT_LEVELS),
+                        help='comma separated numbers of sandboxes to run at once')
+    parser.add_argument('--deploys', type=int, default=2, help='deploys per sandbox')
+    parser.add_argument('--rounds', type=int, default=1, help='times every level is run')
+    parser.add_argument('--keep-going', action='store_true', help='run the next levels after one had failures')
+    compute_arguments(parser)
+    args = parser.parse_args(argv)
+
+    compute, attributes = compute_from_arguments(args)
+    report = run_load([int(level) for level in args.levels.split(',')], args.deploys, args.rounds, compute,
+                           attributes, stop_on_failure=not args.keep_going)
+    print(json.dumps(report, indent=2, sort_keys=True) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
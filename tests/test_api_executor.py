@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `api_executor`
+"""
+
+import socket
+import unittest
+
+from googleapiclient.errors import HttpError
+from mock import MagicMock, patch
+
+from ccp.gcp.api_executor import RetryPolicy, execute, retry_reason
+
+
+def _http_error(status, content=b'{}'):
+    return HttpError(MagicMock(status=status), content)
+
+
+@patch('ccp.gcp.api_executor.time.sleep')
+class TestApiExecutor(unittest.TestCase):
+
+    def test_transient_errors_are_retried(self, sleep):
+        policy = RetryPolicy()
+        request = MagicMock(method='GET')
+        request.execute.side_effect = [_http_error(503), socket.error('reset'), {'name': 'vm-1'}]
+
+        self.assertEqual(execute(request, 'project', policy=policy), {'name': 'vm-1'})
+
+        self.assertEqual(request.execute.call_count, 3)
+        self.assertEqual(policy.stats()['retries'], {'http_503': 1, 'connection': 1})
+
+    def test_permanent_errors_are_raised_at_once(self, sleep):
+        request = MagicMock(method='GET')
+        request.execute.side_effect = _http_error(404)
+
+        with self.assertRaises(HttpError):
+            execute(request, 'project', policy=RetryPolicy())
+
+        self.assertEqual(request.execute.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_gives_up_after_max_attempts(self, sleep):
+        policy = RetryPolicy(max_attempts=3)
+        request = MagicMock(method='GET')
+        request.execute.side_effect = _http_error(429)
+
+        with self.assertRaises(HttpError):
+            execute(request, 'project', policy=policy)
+
+        self.assertEqual(request.execute.call_count, 3)
+        self.assertEqual(policy.stats()['exhausted'], 1)
+
+    def test_retried_mutation_keeps_its_request_id(self, sleep):
+        request = MagicMock(method='POST', methodId='compute.instances.insert',
+                            uri='https://compute/projects/p/zones/z/instances?alt=json')
+        uris = []
+
+        def execute_once():
+            uris.append(request.uri)
+            if len(uris) == 1:
+                raise _http_error(500)
+            return {}
+
+        request.execute.side_effect = execute_once
+
+        execute(request, 'project', policy=RetryPolicy())
+
+        self.assertIn('&requestId=', uris[0])
+        self.assertEqual(uris[0], uris[1])
+
+    def test_throttling_403_is_retryable(self, sleep):
+        self.assertEqual(retry_reason(_http_error(403, b'{"reason": "rateLimitExceeded"}')), 'rate_limited')
+        self.assertIsNone(retry_reason(_http_error(403, b'{"reason": "forbidden"}')))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
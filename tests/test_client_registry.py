@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `client_registry`
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from ccp.gcp import client_registry
+from ccp.gcp.client_registry import FileDiscoveryCache, get_client, release_client
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/compute/v1/rest'
+
+
+class TestFileDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = FileDiscoveryCache(directory=self.directory, max_age=60)
+
+    def test_document_is_keyed_by_api_and_version(self):
+        self.cache.set(DISCOVERY_URL + '?userIp=1.2.3.4', '{"name": "compute"}')
+
+        self.assertEqual(os.listdir(self.directory), ['compute.v1.json'])
+        self.assertEqual(self.cache.get(DISCOVERY_URL), '{"name": "compute"}')
+
+    def test_truncated_document_is_a_miss(self):
+        self.cache.set(DISCOVERY_URL, '{"name": "comp')
+
+        self.assertIsNone(self.cache.get(DISCOVERY_URL))
+
+    def test_expired_document_is_a_miss(self):
+        self.cache.set(DISCOVERY_URL, '{}')
+        path = os.path.join(self.directory, 'compute.v1.json')
+        old = time.time() - 120
+        os.utime(path, (old, old))
+
+        self.assertIsNone(self.cache.get(DISCOVERY_URL))
+
+
+class TestGetClient(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(client_registry._clients.clear)
+        self.addCleanup(client_registry._credentials.clear)
+
+    @patch('ccp.gcp.client_registry.load_credentials')
+    @patch('ccp.gcp.client_registry.build_client')
+    def test_one_client_per_project_and_credentials(self, build_client, load_credentials):
+        build_client.side_effect = lambda credentials: object()
+
+        first = get_client('project-a', '/keys/a.json')
+        again = get_client('project-a', '/keys/a.json')
+        other_project = get_client('project-b', '/keys/a.json')
+        other_key = get_client('project-a', '/keys/b.json')
+
+        self.assertIs(first, again)
+        self.assertEqual(len(set(map(id, [first, other_project, other_key]))), 3)
+        self.assertEqual(load_credentials.call_count, 2)
+
+        release_client('project-a', '/keys/a.json')
+        self.assertIsNot(get_client('project-a', '/keys/a.json'), first)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `DeleteVerifier`
+"""
+
+import time
+import unittest
+
+from mock import MagicMock
+
+from ccp.gcp.delete_verifier import DeleteVerifier
+
+
+class _DoneFuture(object):
+    def __init__(self, error):
+        self.error = error
+
+    def exception(self):
+        return self.error
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+
+class TestDeleteVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.verifier = DeleteVerifier(max_attempts=3, retry_delay=0.01)
+        self.service = MagicMock(project='project')
+
+    def _operation_results(self, *errors):
+        futures = [_DoneFuture(error) for error in errors]
+        self.service._get_tracker().register.side_effect = futures
+
+    def test_failed_delete_is_retried_until_it_succeeds(self):
+        self._operation_results(Exception('resource in use'), None)
+
+        outcome = self.verifier.submit(self.service, 'vm-1', 'zone-a', {'name': 'op-1'})
+        time.sleep(0.2)
+
+        self.assertTrue(outcome.succeeded)
+        self.assertEqual(outcome.attempts, 2)
+        self.service.issue_delete.assert_called_once_with('vm-1', 'zone-a')
+        self.assertIs(self.verifier.outcome('project', 'vm-1'), outcome)
+
+    def test_gives_up_after_max_attempts(self):
+        self._operation_results(Exception('a'), Exception('b'), Exception('c'))
+
+        outcome = self.verifier.submit(self.service, 'vm-1', 'zone-a', {'name': 'op-1'})
+        time.sleep(0.2)
+
+        self.assertTrue(outcome.done)
+        self.assertFalse(outcome.succeeded)
+        self.assertEqual(outcome.attempts, 3)
+        self.assertEqual(self.verifier.pending_count(), 0)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
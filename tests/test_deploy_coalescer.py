@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `DeployCoalescer`
+"""
+
+import threading
+import unittest
+
+from ccp.gcp.deploy_coalescer import DeployCoalescer
+
+
+class TestDeployCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.coalescer = DeployCoalescer()
+        self.flushed = []
+
+    def _flush(self, names):
+        self.flushed.append(sorted(names))
+        return dict((name, ValueError(name) if name == 'vm-bad' else name.upper()) for name in names)
+
+    def _submit_concurrently(self, keys_and_names):
+        results = {}
+
+        def submit(key, name):
+            try:
+                results[name] = self.coalescer.submit(key, name, self._flush, window=0.3)
+            except Exception as e:
+                results[name] = e
+
+        threads = [threading.Thread(target=submit, args=pair) for pair in keys_and_names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_same_shape_is_flushed_once(self):
+        results = self._submit_concurrently([('shape', 'vm-1'), ('shape', 'vm-2'), ('shape', 'vm-bad')])
+
+        self.assertEqual(self.flushed, [['vm-1', 'vm-2', 'vm-bad']])
+        self.assertEqual(results['vm-1'], 'VM-1')
+        self.assertEqual(results['vm-2'], 'VM-2')
+        self.assertIsInstance(results['vm-bad'], ValueError)
+
+    def test_different_shapes_are_not_mixed(self):
+        self._submit_concurrently([('shape-a', 'vm-1'), ('shape-b', 'vm-2')])
+
+        self.assertEqual(sorted(self.flushed), [['vm-1'], ['vm-2']])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `fake_compute` and the driver end to end against it
+"""
+
+import unittest
+
+from mock import patch
+
+from tests.benchmark import run_benchmark
+from tests.fake_compute import ApiError, FakeCompute, IN_USE_ERROR
+from tests.load_generator import run_load, saturation
+
+
+class TestFakeCompute(unittest.TestCase):
+
+    def setUp(self):
+        self.compute = FakeCompute(operation_latency=0)
+        self.compute.base_url = 'http://fake/'
+
+    def _call(self, resource, method, body=None, **params):
+        params.setdefault('project', 'p')
+        return self.compute.handle(resource, method, 'POST' if body else 'GET', params, body)
+
+    def _insert_instance(self, name, labels=None):
+        return self._call('instances', 'insert', {'name': name, 'labels': labels or {}, 'disks': [{'boot': True}],
+                                                  'networkInterfaces': [{}]}, zone='us-west1-a')
+
+    def test_instances_are_filtered_by_label_and_paged(self):
+        self.compute.page_size = 1
+        self._insert_instance('vm-1', {'cloudshell-reservation-id': 'r1'})
+        self._insert_instance('vm-2', {'cloudshell-reservation-id': 'r1'})
+        self._insert_instance('vm-3', {'cloudshell-reservation-id': 'r2'})
+
+        page = self._call('instances', 'aggregatedList', filter='labels.cloudshell-reservation-id = "r1"')
+        second = self._call('instances', 'aggregatedList', filter='labels.cloudshell-reservation-id = "r1"',
+                            pageToken=page['nextPageToken'])
+
+        self.assertEqual([i['name'] for i in page['items']['zones/us-west1-a']['instances']], ['vm-1'])
+        self.assertEqual([i['name'] for i in second['items']['zones/us-west1-a']['instances']], ['vm-2'])
+        self.assertNotIn('nextPageToken', second)
+
+    def test_network_in_use_fails_its_delete_operation(self):
+        self._call('networks', 'insert', {'name': 'net'})
+        self._call('subnetworks', 'insert', {'name': 'sub', 'network': 'global/networks/net',
+                                             'ipCidrRange': '10.0.0.0/24'}, region='us-west1')
+
+        operation = self._call('networks', 'delete', network='net')
+        done = self._call('globalOperations', 'get', operation=operation['name'])
+
+        self.assertEqual(done['error']['errors'][0]['code'], IN_USE_ERROR)
+        self.assertIn('net', self.compute.networks)
+
+    def test_quota_and_request_id(self):
+        self.compute.instance_quota = 1
+        first = self._call('instances', 'insert', {'name': 'vm-1'}, zone='us-west1-a', requestId='req')
+        retried = self._call('instances', 'insert', {'name': 'vm-1'}, zone='us-west1-a', requestId='req')
+
+        self.assertEqual(first['name'], retried['name'])
+        with self.assertRaises(ApiError) as raised:
+            self._insert_instance('vm-2')
+        self.assertEqual((raised.exception.status, raised.exception.reason), (403, 'quotaExceeded'))
+
+
+class TestDriverEndToEnd(unittest.TestCase):
+
+    @patch('ccp.gcp.operation_tracker.MIN_POLL_INTERVAL', 0.05)
+    def test_sandbox_lifecycle(self):
+        report = run_benchmark(iterations=1, deploys=2, compute=FakeCompute(operation_latency=0.05))
+
+        self.assertEqual(report['commands']['Deploy']['count'], 2)
+        self.assertEqual(report['api_calls']['Deploy']['compute.instances.insert'], 2)
+        self.assertEqual(report['api_calls']['GetVmDetails'], {'compute.instances.aggregatedList': 1})
+        self.assertEqual(report['leaked'], {'instances': 0, 'disks': 0, 'networks': 0})
+
+    @patch('ccp.gcp.operation_tracker.MIN_POLL_INTERVAL', 0.05)
+    def test_concurrent_sandboxes(self):
+        report = run_load(levels=(1, 3), deploys=1, compute=FakeCompute(operation_latency=0.05))
+
+        self.assertEqual([level['sandboxes'] for level in report['levels']], [1, 3])
+        self.assertEqual([level['failed'] for level in report['levels']], [0, 0])
+        self.assertEqual(report['levels'][1]['commands']['Deploy']['count'], 3)
+        self.assertEqual(report['leaked'], {'instances': 0, 'disks': 0, 'networks': 0})
+
+    def test_saturation_is_where_throughput_stops_growing(self):
+        levels = [{'concurrency': 1, 'throughput': 10, 'failed': 0},
+                  {'concurrency': 2, 'throughput': 19, 'failed': 0},
+                  {'concurrency': 4, 'throughput': 20, 'failed': 0},
+                  {'concurrency': 8, 'throughput': 12, 'failed': 3}]
+
+        self.assertEqual(saturation(levels), {'saturated_at': 4, 'failing_at': 8})
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -7,6 +7,8 @@ Tests for `GcCloudProviderDriver`
 
 import unittest
 
+from mock import MagicMock, patch
+
 from driver import GcCloudProviderDriver
 
 
@@ -21,6 +23,36 @@ class TestGcCloudProviderDriver(unittest.TestCase):
     def test_000_something(self):
         pass
 
+    @patch('driver.stop_export')
+    @patch('driver.start_tracing')
+    @patch('driver.start_export')
+    @patch('driver.get_qs_logger')
+    @patch('driver.GoogleCloudProvider')
+    @patch('driver.GCPService')
+    def test_warmed_up_service_is_reused_and_released(self, service_class, provider_class, *_):
+        provider = provider_class.create_from_context.return_value
+        provider.deploy_coalesce_window = ''
+        service = service_class.return_value
+        service.matches.return_value = True
+        driver = GcCloudProviderDriver()
+        logger = MagicMock()
+
+        driver.initialize(MagicMock())
+        first = driver._get_service(provider, logger)
+        second = driver._get_service(provider, logger)
+
+        self.assertEqual(service_class.call_count, 1)
+        service.warm_up.assert_called_once_with()
+        service.matches.assert_called_with(provider.project, provider.credentials_json_path)
+        self.assertIs(first, service.with_logger.return_value)
+        self.assertIs(second, first)
+        service.with_logger.assert_called_with(logger)
+
+        driver.cleanup()
+
+        service.release.assert_called_once_with()
+        self.assertIsNone(driver._gcp_service)
+
 
 if __name__ == '__main__':
     import sys
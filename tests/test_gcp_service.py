@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `GCPService`
+"""
+
+import unittest
+
+from googleapiclient.errors import HttpError
+from mock import MagicMock, patch
+from six.moves import queue
+
+from ccp.gcp.gcp_service import ASSIGNED_ADDRESS_FIELDS, GCPService
+from ccp.gcp.resource_cache import image_cache, instance_zone_cache, region_zones_cache
+from ccp.gcp.wait_operations import OperationError, OperationTimeoutError
+
+
+def _instance(name, instance_id):
+    return {'name': name,
+            'id': instance_id,
+            'zone': 'projects/p/zones/zone-a',
+            'networkInterfaces': [{'name': 'nic0',
+                                   'subnetwork': 'projects/p/regions/r/subnetworks/subnet-1',
+                                   'networkIP': '10.0.0.2',
+                                   'accessConfigs': [{'natIP': '35.1.1.1'}]}]}
+
+
+class TestGCPService(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('ccp.gcp.gcp_service.get_credentials')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = MagicMock()
+        self.service = GCPService(project='project', json_cred_path='creds.json', logger=MagicMock())
+        self.service.client = self.client
+
+    def test_get_vms_details_uses_one_aggregated_list(self):
+        instances = self.client.instances()
+        instances.aggregatedList().execute.return_value = {'items': {
+            'zones/zone-a': {'instances': [_instance('vm-1', '1'), _instance('vm-3', '3')]},
+            'zones/zone-b': {'warning': {'code': 'NO_RESULTS_ON_PAGE'}},
+        }}
+        instances.aggregatedList_next.return_value = None
+        instances.aggregatedList.reset_mock()
+
+        results = self.service.get_vms_details(['vm-1', 'vm-2', 'vm-3'])
+
+        self.assertEqual(instances.aggregatedList.call_count, 1)
+        instances.get.assert_not_called()
+        self.assertEqual([r.appName for r in results], ['vm-1', 'vm-2', 'vm-3'])
+        self.assertEqual(results[0].vmInstanceData[0].value, '1')
+        self.assertEqual(results[0].vmNetworkData[0].publicIpAddress, '35.1.1.1')
+        self.assertTrue(results[1].errorMessage)
+        self.assertFalse(results[2].errorMessage)
+
+    @patch('ccp.gcp.gcp_service.global_wait')
+    def test_subnet_failures_only_fail_their_own_action(self, global_wait):
+        global_wait.return_value = {'targetLink': 'projects/project/global/networks/netvpc-r1'}
+        self.client.subnetworks().insert().execute.side_effect = [{'name': 'op-a'}, ValueError('bad cidr'),
+                                                                  {'name': 'op-c'}]
+        ok, failed = MagicMock(), MagicMock()
+        ok.result.return_value = {'status': 'DONE'}
+        failed.result.side_effect = OperationError({'error': {'errors': [{'code': 'IP_SPACE_EXHAUSTED'}]}})
+        tracker = MagicMock()
+        tracker.register.side_effect = lambda response, region: {'op-a': ok, 'op-c': failed}[response['name']]
+        self.service._get_tracker = MagicMock(return_value=tracker)
+        subnets = [MagicMock(actionId=action_id, actionParams=MagicMock(alias=action_id, cidr='10.0.0.0/24'))
+                   for action_id in ('a', 'b', 'c')]
+
+        results = self.service.prepare_sandbox_infra(MagicMock(region='r'), MagicMock(actionId='infra'),
+                                                     MagicMock(actionId='keys'), subnets, None, 'r1')
+
+        subnet_results = results[2:]
+        self.assertEqual([r.actionId for r in subnet_results], ['a', 'b', 'c'])
+        self.assertEqual([r.success for r in subnet_results], [True, False, False])
+        self.assertTrue(subnet_results[0].subnetId.startswith('a-'))
+        self.assertIn('bad cidr', subnet_results[1].errorMessage)
+        self.assertIn('IP_SPACE_EXHAUSTED', subnet_results[2].errorMessage)
+        self.assertTrue(results[0].success)
+        self.assertEqual(tracker.register.call_count, 2)
+
+    @patch('ccp.gcp.gcp_service.global_wait')
+    def test_prepare_takes_the_network_link_from_its_operation(self, global_wait):
+        global_wait.return_value = {'targetLink': 'projects/project/global/networks/netvpc-r1'}
+        self.service._get_tracker = MagicMock()
+        subnet = MagicMock(actionId='a', actionParams=MagicMock(alias='a', cidr='10.0.0.0/24'))
+
+        self.service.prepare_sandbox_infra(MagicMock(region='r'), MagicMock(actionId='infra'),
+                                           MagicMock(actionId='keys'), [subnet], None, 'r1')
+
+        self.client.networks().get.assert_not_called()
+        body = self.client.subnetworks().insert.call_args[1]['body']
+        self.assertEqual(body['network'], 'projects/project/global/networks/netvpc-r1')
+
+    def test_deployed_instance_details_come_from_its_operation_and_addresses(self):
+        instances = self.client.instances()
+        address_only = _instance('vm-1', None)
+        del address_only['id']
+        instances.get().execute.return_value = address_only
+        instances.get.reset_mock()
+
+        details = self.service._deployed_vm_details({'targetId': '42'}, 'vm-1', 'zone-a')
+
+        instances.get.assert_called_once_with(project='project', zone='zone-a', instance='vm-1',
+                                              fields=ASSIGNED_ADDRESS_FIELDS)
+        self.assertEqual(details.vmInstanceData[0].value, '42')
+        self.assertEqual(details.vmNetworkData[0].privateIpAddress, '10.0.0.2')
+
+    def test_zone_race_loser_does_not_replace_the_placed_instance(self):
+        instance_zone_cache.set(('project', 'vm-1'), 'zone-a')
+        self.addCleanup(instance_zone_cache.clear)
+        loser = dict(_instance('vm-1', '2'), zone='projects/p/zones/zone-b', status='STOPPING')
+        winner = dict(_instance('vm-1', '1'), status='RUNNING')
+        instances = self.client.instances()
+        instances.aggregatedList().execute.return_value = {'items': {
+            'zones/zone-a': {'instances': [winner]},
+            'zones/zone-b': {'instances': [loser]},
+        }}
+        instances.aggregatedList_next.return_value = None
+
+        results = self.service.get_vms_details(['vm-1'])
+
+        self.assertEqual(results[0].vmInstanceData[0].value, '1')
+        self.assertEqual(instance_zone_cache.get(('project', 'vm-1')), 'zone-a')
+
+        instance_zone_cache.clear()
+        self.assertEqual(self.service._pick_instance('vm-1', [loser, winner]), winner)
+
+    def test_zone_race_losers_are_deleted_unless_out_of_capacity(self):
+        losers = queue.Queue()
+        losers.put(('zone-b', 'details', None))
+        losers.put(('zone-c', None, OperationTimeoutError('op-1')))
+        losers.put(('zone-d', None, OperationError({'error': {'errors': [{'code': 'ZONE_RESOURCE_POOL_EXHAUSTED'}]}})))
+        instances = self.client.instances()
+        instances.delete().execute.side_effect = [{}, HttpError(MagicMock(status=404), b'not found')]
+        instances.delete.reset_mock()
+
+        self.service._delete_race_losers(losers, 3, 'vm-1').join()
+
+        self.assertEqual([c[1]['zone'] for c in instances.delete.call_args_list], ['zone-b', 'zone-c'])
+        self.service.logger.exception.assert_not_called()
+
+    @patch('ccp.gcp.gcp_service.deploy_coalescer')
+    def test_deploys_are_not_coalesced_by_default(self, coalescer):
+        self.service._insert_single_instance = MagicMock(return_value='details')
+
+        self.assertEqual(self.service._insert_instance('zone-a', {'name': 'vm-1'}), 'details')
+        coalescer.submit.assert_not_called()
+
+    def test_coalesced_deploys_send_instance_properties(self):
+        self.service._get_tracker = MagicMock()
+        self.service.get_vms_details = MagicMock(return_value=[])
+        shape = {'kind': 'compute#instance',
+                 'zone': 'projects/project/zones/zone-a',
+                 'machineType': 'projects/project/zones/zone-a/machineTypes/n1-standard-1',
+                 'disks': [{'boot': True, 'initializeParams': {
+                     'sourceImage': 'projects/debian-cloud/global/images/debian-9',
+                     'diskType': 'projects/project/zones/zone-a/diskTypes/pd-standard'}}],
+                 'labels': {'cloudshell-reservation-id': 'r-1'},
+                 'deletionProtection': False}
+
+        self.service._insert_instances('zone-a', shape, ['vm-1', 'vm-2'])
+
+        self.client.instances().bulkInsert.assert_called_once_with(project='project', zone='zone-a', body={
+            'count': 2,
+            'perInstanceProperties': {'vm-1': {}, 'vm-2': {}},
+            'instanceProperties': {
+                'machineType': 'n1-standard-1',
+                'disks': [{'boot': True, 'initializeParams': {
+                    'sourceImage': 'projects/debian-cloud/global/images/debian-9', 'diskType': 'pd-standard'}}],
+                'labels': {'cloudshell-reservation-id': 'r-1'}}})
+
+    def test_image_family_is_resolved_once(self):
+        image_cache.clear()
+        images = self.client.images()
+        images.get().execute.side_effect = HttpError(MagicMock(status=404), b'not found')
+        images.getFromFamily().execute.return_value = {'selfLink': 'projects/debian-cloud/global/images/debian-9-v1',
+                                                       'status': 'READY'}
+        images.getFromFamily.reset_mock()
+
+        for _ in range(3):
+            link = self.service._prepare_source_image('debian-9', 'debian-cloud', 'public')
+
+        self.assertEqual(link, 'projects/debian-cloud/global/images/debian-9-v1')
+        self.assertEqual(images.getFromFamily.call_count, 1)
+        self.assertEqual(image_cache.stats()['hits'], 2)
+
+    def test_unknown_image_fails_before_insert(self):
+        image_cache.clear()
+        images = self.client.images()
+        images.get().execute.side_effect = HttpError(MagicMock(status=404), b'not found')
+        images.getFromFamily().execute.side_effect = HttpError(MagicMock(status=404), b'not found')
+
+        with self.assertRaises(ValueError):
+            self.service._prepare_source_image('missing', 'debian-cloud', 'public')
+        self.client.instances().insert.assert_not_called()
+
+    def test_candidate_zones_prefer_app_then_provider_zones(self):
+        region_zones_cache.clear()
+        self.client.regions().get().execute.return_value = {'zones': ['zones/us-east1-b', 'zones/us-east1-c',
+                                                                      'zones/us-east1-d']}
+        provider = MagicMock(region='us-east1', zones='us-east1-d, us-east1-c')
+
+        zones = self.service._candidate_zones(provider, app_zone='us-east1-c')
+
+        self.assertEqual(zones, ['us-east1-c', 'us-east1-d', 'us-east1-b'])
+
+    def test_candidate_zones_outside_the_region_are_rejected(self):
+        region_zones_cache.clear()
+        self.client.regions().get().execute.return_value = {'zones': ['zones/us-east1-b', 'zones/us-east1-c']}
+
+        with self.assertRaises(ValueError):
+            self.service._candidate_zones(MagicMock(region='us-east1', zones='europe-west1-b'))
+        with self.assertRaises(ValueError):
+            self.service._candidate_zones(MagicMock(region='us-east1', zones=''), app_zone='us-west1-b')
+
+    def test_candidate_zones_default_to_the_previous_zone(self):
+        region_zones_cache.clear()
+        self.client.regions().get().execute.return_value = {'zones': ['zones/us-west1-a', 'zones/us-west1-b']}
+
+        zones = self.service._candidate_zones(MagicMock(region='us-west1', zones=''))
+
+        self.assertEqual(zones, ['us-west1-b', 'us-west1-a'])
+
+    def test_place_instance_moves_on_when_zone_is_out_of_capacity(self):
+        stockout = OperationError({'error': {'errors': [{'code': 'ZONE_RESOURCE_POOL_EXHAUSTED'}]}})
+        self.service._candidate_zones = MagicMock(return_value=['zone-a', 'zone-b'])
+        self.service._insert_instance = MagicMock(side_effect=[stockout, 'details'])
+        provider = MagicMock(zone_race_count='1')
+
+        zone, details = self.service._place_instance(provider, '', lambda z: {'name': 'vm-1', 'zone': z})
+
+        self.assertEqual((zone, details), ('zone-b', 'details'))
+        self.assertEqual(self.service._insert_instance.call_args[0][0], 'zone-b')
+
+    def test_set_power_state_resumes_suspended_and_starts_stopped(self):
+        instances = self.client.instances()
+        instances.aggregatedList().execute.return_value = {'items': {'zones/zone-a': {'instances': [
+            dict(_instance('vm-1', '1'), status='SUSPENDED'),
+            dict(_instance('vm-2', '2'), status='TERMINATED'),
+            dict(_instance('vm-3', '3'), status='RUNNING'),
+        ]}}}
+        instances.aggregatedList_next.return_value = None
+        tracker = MagicMock()
+        tracker.register.return_value.exception.return_value = None
+        self.service._get_tracker = MagicMock(return_value=tracker)
+
+        errors = self.service.set_power_state(['vm-1', 'vm-2', 'vm-3'], power_on=True)
+
+        self.assertEqual(errors, {'vm-1': None, 'vm-2': None, 'vm-3': None})
+        self.assertEqual(instances.resume.call_args[1]['instance'], 'vm-1')
+        self.assertEqual(instances.start.call_args[1]['instance'], 'vm-2')
+        self.assertEqual(tracker.register.call_count, 2)
+
+    def test_reservation_instances_are_found_by_label(self):
+        instances = self.client.instances()
+        instances.aggregatedList().execute.return_value = {'items': {'zones/zone-a': {'instances': [
+            _instance('vm-1', '1')]}}}
+        instances.aggregatedList_next.return_value = None
+        instances.aggregatedList.reset_mock()
+
+        found = self.service._reservation_instances('5A1B-C2D3')
+
+        self.assertEqual([instance['name'] for instance in found], ['vm-1'])
+        instances.aggregatedList.assert_called_once_with(
+            project='project', filter='labels.cloudshell-reservation-id = "5a1b-c2d3"')
+        self.client.networks().get.assert_not_called()
+
+    def test_teardown_skips_disks_still_attached_to_an_instance(self):
+        self.service._aggregated_instances = MagicMock(return_value=[_instance('vm-1', '1')])
+        disks = self.client.disks()
+        disks.aggregatedList().execute.return_value = {'items': {'zones/zone-a': {'disks': [
+            {'name': 'vm-1', 'zone': 'projects/p/zones/zone-a', 'users': ['projects/p/zones/zone-a/instances/vm-1']},
+            {'name': 'orphan', 'zone': 'projects/p/zones/zone-a', 'users': []}]}}}
+        disks.aggregatedList_next.return_value = None
+        for resource in (self.client.firewalls(), self.client.routes()):
+            resource.list().execute.return_value = {}
+            resource.list_next.return_value = None
+
+        layers = self.service._reservation_teardown_layers('r-1', {'name': 'net', 'selfLink': 'networks/net'})
+
+        self.assertEqual([[(node.kind, node.name) for node in layer] for layer in layers],
+                         [[('instance', 'vm-1')], [('disk', 'orphan')], [('network', 'net')]])
+
+    @patch('ccp.gcp.gcp_service.time.sleep')
+    def test_refresh_ip_waits_for_public_ip(self, sleep):
+        self.service._find_instance_zone = MagicMock(return_value='zone-a')
+        instances = self.client.instances()
+        instances.get().execute.side_effect = [
+            {'networkInterfaces': [{'networkIP': '10.0.0.2', 'accessConfigs': [{}]}]},
+            {'networkInterfaces': [{'networkIP': '10.0.0.2', 'accessConfigs': [{'natIP': '35.1.1.1'}]}]},
+        ]
+        session = MagicMock()
+
+        self.service.refresh_ip(session, 'vm-1', '10.0.0.2', None, '.*', timeout=60)
+
+        session.UpdateResourceAddress.assert_not_called()
+        session.SetAttributeValue.assert_called_once_with('vm-1', 'Public IP', '35.1.1.1')
+        self.assertTrue(sleep.called)
+
+    @patch('ccp.gcp.gcp_service.time.sleep')
+    def test_refresh_ip_ignores_public_ip_rejected_by_regex(self, sleep):
+        self.service._find_instance_zone = MagicMock(return_value='zone-a')
+        self.client.instances().get().execute.return_value = {
+            'networkInterfaces': [{'networkIP': '10.0.0.2', 'accessConfigs': [{'natIP': '35.1.1.1'}]}]}
+        session = MagicMock()
+
+        self.service.refresh_ip(session, 'vm-1', None, None, '^10\\.', timeout=60)
+
+        session.UpdateResourceAddress.assert_called_once_with('vm-1', '10.0.0.2')
+        session.SetAttributeValue.assert_not_called()
+        self.assertFalse(sleep.called)
+
+    @patch('ccp.gcp.gcp_service.time.sleep')
+    def test_refresh_ip_sets_public_ip_when_only_it_matches(self, sleep):
+        self.service._find_instance_zone = MagicMock(return_value='zone-a')
+        self.client.instances().get().execute.return_value = {
+            'networkInterfaces': [{'networkIP': '10.0.0.2', 'accessConfigs': [{'natIP': '35.1.1.1'}]}]}
+        session = MagicMock()
+
+        self.service.refresh_ip(session, 'vm-1', None, None, '^35\\.', timeout=60)
+
+        session.UpdateResourceAddress.assert_not_called()
+        session.SetAttributeValue.assert_called_once_with('vm-1', 'Public IP', '35.1.1.1')
+        self.assertFalse(sleep.called)
+
+    def test_refresh_ip_stops_when_cancelled(self):
+        self.service._find_instance_zone = MagicMock(return_value='zone-a')
+        self.client.instances().get().execute.return_value = {
+            'networkInterfaces': [{'networkIP': '10.0.0.2', 'accessConfigs': [{}]}]}
+        session = MagicMock()
+
+        self.service.refresh_ip(session, 'vm-1', None, None, '.*', timeout=60,
+                                cancellation_context=MagicMock(is_cancelled=True))
+
+        session.UpdateResourceAddress.assert_not_called()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
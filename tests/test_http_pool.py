@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `HttpPool`
+"""
+
+import threading
+import time
+import unittest
+
+from mock import MagicMock
+
+from ccp.gcp.http_pool import HttpPool
+
+
+class TestHttpPool(unittest.TestCase):
+
+    def setUp(self):
+        self.https = []
+
+        def factory():
+            http = MagicMock()
+            http.request.side_effect = lambda uri, *args, **kwargs: time.sleep(0.05) or (200, uri)
+            self.https.append(http)
+            return http
+
+        self.pool = HttpPool(credentials=None, max_size=2, http_factory=factory)
+
+    def test_sequential_requests_reuse_one_connection(self):
+        for uri in ('a', 'b', 'c'):
+            self.assertEqual(self.pool.request(uri), (200, uri))
+
+        self.assertEqual(len(self.https), 1)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_concurrent_requests_are_capped_at_max_size(self):
+        threads = [threading.Thread(target=self.pool.request, args=(str(i),)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = self.pool.stats()
+        self.assertEqual(len(self.https), 2)
+        self.assertEqual((stats['created'], stats['in_use'], stats['idle']), (2, 0, 2))
+        self.assertEqual(sum(http.request.call_count for http in self.https), 6)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
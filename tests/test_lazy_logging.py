@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `lazy_logging`
+"""
+
+import json
+import logging
+import unittest
+
+from mock import MagicMock
+
+from ccp.gcp.lazy_logging import BackgroundHandler, LogPayload, flush_logs, queue_logger
+from driver import GcCloudProviderDriver
+
+
+class Model(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestLazyLogging(unittest.TestCase):
+
+    def test_payload_is_redacted(self):
+        context = Model(resource=Model(attributes={'Google Cloud Provider.Password': 'hunter2', 'Region': 'r'}))
+        request = json.dumps({'actions': [{'attributes': [{'attributeName': 'App.Password', 'attributeValue': 'pw'}],
+                                           'accessKey': 'abcd', 'deployedAppJson': json.dumps({'token': 't0k'})}]})
+
+        rendered = str(LogPayload(context)) + str(LogPayload(request))
+
+        for secret in ('hunter2', '"pw"', 'abcd', 't0k'):
+            self.assertNotIn(secret, rendered)
+        self.assertIn('"Region":"r"', rendered)
+
+    def test_large_payload_is_truncated_without_full_serialization(self):
+        payload = LogPayload([Model(name='vm-{0}'.format(i), password='secret') for i in range(100000)],
+                             max_chars=1000)
+
+        rendered = str(payload)
+
+        self.assertTrue(rendered.endswith('... [truncated, more than 1000 chars]'))
+        self.assertLess(len(rendered), 1100)
+        self.assertNotIn('secret', rendered)
+
+    def test_payload_is_not_rendered_below_info(self):
+        logger = MagicMock()
+        logger.isEnabledFor.return_value = False
+
+        GcCloudProviderDriver()._log(logger, 'deploy_request', Model(name='x'))
+
+        self.assertFalse(logger.info.called)
+
+    def test_records_are_written_by_the_logging_thread(self):
+        logger = logging.getLogger('test_lazy_logging')
+        logger.propagate = False
+        handler = RecordingHandler()
+        logger.addHandler(handler)
+        self.addCleanup(logger.handlers.pop)
+
+        queue_logger(queue_logger(logger))
+        logger.warning('%s', LogPayload({'password': 'x', 'name': 'vm'}))
+        flush_logs()
+
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0], BackgroundHandler)
+        self.assertEqual(handler.messages, ['{"name":"vm","password":"***"}'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
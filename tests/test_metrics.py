@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `metrics`
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from googleapiclient.errors import HttpError
+from mock import MagicMock, patch
+
+from ccp.gcp.api_executor import RetryPolicy, execute
+from ccp.gcp.metrics import MetricsExporter, command_scope, registry, start_export, stop_export
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    @patch('ccp.gcp.api_executor.time.sleep')
+    def test_api_calls_are_labelled_by_method_zone_and_command(self, _):
+        request = MagicMock(method='POST', methodId='compute.instances.insert',
+                            uri='https://compute/projects/p/zones/zone-a/instances?alt=json')
+        request.execute.side_effect = [HttpError(MagicMock(status=503), b'{}'), {}]
+
+        with command_scope('Deploy'):
+            execute(request, 'project', policy=RetryPolicy())
+
+        text = registry.render()
+        labels = 'command="Deploy",method="compute.instances.insert",zone="zone-a"'
+        self.assertIn('gcp_api_request_duration_seconds_count{' + labels + '} 2', text)
+        self.assertIn('gcp_api_errors_total{code="503",' + labels + '} 1', text)
+        self.assertIn('gcp_api_retries_total{command="Deploy",method="compute.instances.insert",reason="http_503",'
+                      'zone="zone-a"} 1', text)
+        self.assertIn('gcp_command_duration_seconds_count{command="Deploy"} 1', text)
+        self.assertEqual(registry.summary()['compute.instances.insert']['calls'], 2)
+
+    def test_exporter_writes_textfile_with_pid(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        registry.inc('gcp_test_total', {'method': 'm'})
+        logger = MagicMock()
+
+        exporter = MetricsExporter(registry, directory=directory, logger=logger)
+        exporter.export()
+
+        with open(exporter.path) as f:
+            text = f.read()
+        self.assertIn('# TYPE gcp_test_total counter', text)
+        self.assertIn('gcp_test_total{command="",method="m",pid="' + str(os.getpid()) + '"} 1', text)
+        self.assertTrue(logger.info.called)
+
+
+    def test_export_is_opt_in_and_its_textfile_removed_on_stop(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(stop_export)
+
+        self.assertIsNone(start_export(''))
+        exporter = start_export(directory)
+        exporter.export()
+        self.assertTrue(os.path.exists(exporter.path))
+
+        stop_export()
+
+        self.assertEqual(os.listdir(directory), [])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
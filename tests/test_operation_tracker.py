@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `OperationTracker`
+"""
+
+import unittest
+
+from mock import MagicMock
+
+from ccp.gcp.operation_tracker import OperationTracker
+from ccp.gcp.wait_operations import OperationError
+
+
+class TestOperationTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.zoneOperations().list_next.return_value = None
+        self.tracker = OperationTracker(self.client, 'project')
+        # drive polling from the test instead of the background thread
+        self.tracker._thread = MagicMock()
+
+    def test_single_list_call_resolves_all_operations_in_zone(self):
+        futures = [self.tracker.register({'name': 'op-{0}'.format(i), 'status': 'PENDING'}, zone='zone-a')
+                   for i in range(3)]
+        self.client.zoneOperations().list().execute.return_value = {'items': [
+            {'name': 'op-0', 'status': 'DONE'},
+            {'name': 'op-1', 'status': 'RUNNING'},
+            {'name': 'op-2', 'status': 'DONE', 'error': {'errors': []}},
+        ]}
+        self.client.zoneOperations().list.reset_mock()
+
+        self.assertEqual(self.tracker.poll(), 2)
+
+        self.assertEqual(self.client.zoneOperations().list.call_count, 1)
+        self.assertEqual(futures[0].result(0), {'name': 'op-0', 'status': 'DONE'})
+        self.assertFalse(futures[1].done())
+        self.assertIsInstance(futures[2].exception(0), OperationError)
+        self.assertEqual(self.tracker.pending_count(), 1)
+
+    def test_callback_and_already_done_operation(self):
+        done = []
+        future = self.tracker.register({'name': 'op-0', 'status': 'DONE', 'zone': 'zones/zone-a'})
+        future.add_done_callback(done.append)
+
+        self.assertEqual(done, [future])
+        self.assertEqual(future.zone, 'zone-a')
+        self.assertEqual(self.tracker.pending_count(), 0)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
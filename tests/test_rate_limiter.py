@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `RateLimiter`
+"""
+
+import unittest
+
+from mock import MagicMock, patch
+
+from ccp.gcp.rate_limiter import RateLimiter, TokenBucket, is_mutation
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    @patch('ccp.gcp.rate_limiter.time.time', return_value=100.0)
+    def test_bucket_queues_callers_past_the_burst(self, _):
+        bucket = TokenBucket(rate=2, burst=2)
+
+        delays = [bucket.reserve() for _ in range(4)]
+
+        self.assertEqual(delays, [0.0, 0.0, 0.5, 1.0])
+
+    @patch('ccp.gcp.rate_limiter.time.sleep')
+    def test_reads_and_mutations_have_separate_budgets(self, sleep):
+        limiter = RateLimiter(read_rate=1, mutation_rate=1)
+
+        limiter.acquire(mutation=False)
+        limiter.acquire(mutation=True)
+        limiter.acquire(mutation=True)
+
+        stats = limiter.stats()
+        self.assertEqual((stats['read']['calls'], stats['read']['queued']), (1, 0))
+        self.assertEqual((stats['mutation']['calls'], stats['mutation']['queued']), (2, 1))
+        self.assertEqual(stats['mutation']['waiting'], 0)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_operations_wait_is_a_read(self):
+        self.assertTrue(is_mutation(MagicMock(method='POST', methodId='compute.instances.insert')))
+        self.assertFalse(is_mutation(MagicMock(method='POST', methodId='compute.zoneOperations.wait')))
+        self.assertFalse(is_mutation(MagicMock(method='GET', methodId='compute.instances.get')))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
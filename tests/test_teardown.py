@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `TeardownEngine`
+"""
+
+import unittest
+
+from mock import MagicMock
+
+from ccp.gcp.teardown import TeardownEngine, TeardownNode
+
+
+class TestTeardownEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = MagicMock()
+        self.tracker.register.return_value.exception.return_value = None
+        self.engine = TeardownEngine(self.tracker, MagicMock(), retry_delay=0)
+
+    def test_retries_only_failed_nodes(self):
+        ok = MagicMock(return_value={'name': 'op-1'})
+        flaky = MagicMock(side_effect=[Exception('resource in use'), {'name': 'op-2'}])
+        network = MagicMock(return_value={'name': 'op-3'})
+        layers = [[TeardownNode('subnetwork', 'a', ok), TeardownNode('subnetwork', 'b', flaky)],
+                  [TeardownNode('network', 'net', network)]]
+
+        failed = self.engine.run(layers)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(ok.call_count, 1)
+        self.assertEqual(flaky.call_count, 2)
+        self.assertEqual(network.call_count, 1)
+        self.assertTrue(all(node.duration is not None for layer in layers for node in layer))
+
+    def test_stops_after_failed_layer(self):
+        broken = MagicMock(side_effect=Exception('quota'))
+        network = MagicMock()
+        layers = [[TeardownNode('instance', 'vm', broken)], [TeardownNode('network', 'net', network)]]
+
+        failed = self.engine.run(layers)
+
+        self.assertEqual([node.name for node in failed], ['vm'])
+        self.assertEqual(broken.call_count, 3)
+        network.assert_not_called()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
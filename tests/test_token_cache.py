@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `FileTokenCache`
+"""
+
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+from ccp.gcp.token_cache import FileTokenCache
+
+
+def _credentials(email='driver@project.iam.gserviceaccount.com'):
+    credentials = MagicMock(service_account_email=email, scopes=['https://www.googleapis.com/auth/cloud-platform'],
+                            token=None, expiry=None)
+
+    def refresh(request):
+        credentials.token = 'token-{0}'.format(credentials.refresh.call_count)
+        credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    credentials.refresh.side_effect = refresh
+    return credentials
+
+
+class TestFileTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_token_is_reused_by_another_process(self):
+        first, second = _credentials(), _credentials()
+
+        FileTokenCache(self.directory).refresh(first, request=None)
+        FileTokenCache(self.directory).refresh(second, request=None)
+
+        self.assertEqual(first.refresh.call_count, 1)
+        second.refresh.assert_not_called()
+        self.assertEqual(second.token, first.token)
+
+    def test_expiring_or_foreign_tokens_are_not_reused(self):
+        credentials = _credentials()
+        FileTokenCache(self.directory).refresh(credentials, request=None)
+
+        expiring = _credentials()
+        FileTokenCache(self.directory, margin=datetime.timedelta(hours=2)).refresh(expiring, request=None)
+        other_account = _credentials('other@project.iam.gserviceaccount.com')
+        FileTokenCache(self.directory).refresh(other_account, request=None)
+
+        self.assertEqual(expiring.refresh.call_count, 1)
+        self.assertEqual(other_account.refresh.call_count, 1)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `tracing`
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ccp.gcp.tracing import JsonLinesSpanExporter, set_exporter, span, start_tracing
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.exporter = JsonLinesSpanExporter(os.path.join(directory, 'spans.jsonl'))
+        set_exporter(self.exporter)
+        self.addCleanup(set_exporter, None)
+
+    def _exported(self):
+        self.exporter.flush()
+        with open(self.exporter.path) as f:
+            return dict((s['name'], s) for s in (json.loads(line) for line in f))
+
+    def test_child_spans_inherit_trace_and_reservation(self):
+        with span('Deploy', command='Deploy', reservation_id='r-1') as root:
+            root.set_attribute('action_id', 'a-1')
+            with span('insert', zone='zone-a'):
+                pass
+
+            def work():
+                with span('zone_attempt', parent=root):
+                    pass
+
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        spans = self._exported()
+        self.assertEqual(spans['insert']['traceId'], spans['Deploy']['traceId'])
+        self.assertEqual(spans['insert']['parentSpanId'], spans['Deploy']['spanId'])
+        self.assertEqual(spans['zone_attempt']['parentSpanId'], spans['Deploy']['spanId'])
+        self.assertEqual(spans['insert']['attributes'],
+                         {'command': 'Deploy', 'reservation_id': 'r-1', 'action_id': 'a-1', 'zone': 'zone-a'})
+        self.assertEqual(spans['Deploy']['parentSpanId'], '')
+
+    def test_failed_span_records_the_error(self):
+        with self.assertRaises(ValueError):
+            with span('Deploy'):
+                raise ValueError('no image')
+
+        status = self._exported()['Deploy']['status']
+        self.assertEqual(status, {'code': 'ERROR', 'message': 'ValueError: no image'})
+
+
+    def test_tracing_is_off_without_a_directory(self):
+        set_exporter(None)
+
+        self.assertIsNone(start_tracing(''))
+        self.assertIsNone(start_tracing(None))
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
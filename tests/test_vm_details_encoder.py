@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `vm_details_encoder`
+"""
+
+import unittest
+
+from mock import patch
+from cloudshell.cp.core.models import VmDetailsData, VmDetailsProperty
+
+from ccp.gcp.vm_details_encoder import encode_vm_details
+from tests.vm_details_benchmark import reflective_dumps, vm_details
+
+
+class TestVmDetailsEncoder(unittest.TestCase):
+
+    def test_output_matches_reflective_json(self):
+        details = vm_details(3)
+        details.append(VmDetailsData(appName='missing', errorMessage=u'VM missing was not found – "quoted"'))
+        details[0].vmInstanceData[0].hidden = None
+        details[1].extra = {'b': 1.5, 'a': [VmDetailsProperty(key='k')]}  # not part of the schema
+
+        self.assertEqual(encode_vm_details(details), reflective_dumps(details))
+        self.assertEqual(encode_vm_details([]), reflective_dumps([]))
+
+
+    @patch('ccp.gcp.vm_details_encoder._fallback')
+    def test_native_and_unicode_strings_are_encoded_without_json_dumps(self, fallback):
+        fallback.return_value = '""'
+        encode_vm_details(VmDetailsData(appName='native', errorMessage=u'unicode'))
+
+        fallback.assert_not_called()
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `wait_operations`
+"""
+
+import unittest
+
+from mock import MagicMock, patch
+
+from ccp.gcp.wait_operations import zone_wait, global_wait, OperationError, OperationTimeoutError
+
+
+class TestWaitOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+
+    @patch('ccp.gcp.wait_operations.time.sleep')
+    def test_long_poll_returns_done_operation(self, sleep):
+        self.client.zoneOperations().wait().execute.side_effect = [{'status': 'RUNNING'}, {'status': 'DONE'}]
+
+        result = zone_wait(self.client, 'project', 'zone', 'op-1')
+
+        self.assertEqual(result, {'status': 'DONE'})
+        self.client.zoneOperations().get.assert_not_called()
+
+    def test_operation_error_is_raised(self):
+        self.client.globalOperations().wait().execute.return_value = {'status': 'DONE', 'error': {'errors': []}}
+
+        with self.assertRaises(OperationError):
+            global_wait(self.client, 'project', 'op-1')
+
+    @patch('ccp.gcp.wait_operations.time.sleep')
+    def test_falls_back_to_get_with_backoff(self, sleep):
+        self.client.zoneOperations().wait.side_effect = AttributeError('wait')
+        self.client.zoneOperations().get().execute.side_effect = [{'status': 'RUNNING'}] * 4 + [{'status': 'DONE'}]
+
+        result = zone_wait(self.client, 'project', 'zone', 'op-1')
+
+        self.assertEqual(result, {'status': 'DONE'})
+        intervals = [c[0][0] for c in sleep.call_args_list]
+        self.assertEqual(len(intervals), 4)
+        self.assertLessEqual(intervals[0], 1.0)
+        self.assertGreaterEqual(intervals[-1], 4.0)
+
+    @patch('ccp.gcp.wait_operations.time.sleep')
+    def test_long_poll_that_returns_early_backs_off(self, sleep):
+        self.client.zoneOperations().wait().execute.side_effect = [{'status': 'RUNNING'}] * 4 + [{'status': 'DONE'}]
+
+        result = zone_wait(self.client, 'project', 'zone', 'op-1')
+
+        self.assertEqual(result, {'status': 'DONE'})
+        intervals = [c[0][0] for c in sleep.call_args_list]
+        self.assertEqual(len(intervals), 4)
+        self.assertGreaterEqual(intervals[-1], 4.0)
+
+    @patch('ccp.gcp.wait_operations.time.sleep')
+    def test_long_poll_is_not_used_closer_to_the_deadline(self, sleep):
+        self.client.zoneOperations().get().execute.side_effect = [{'status': 'RUNNING'}, {'status': 'DONE'}]
+
+        result = zone_wait(self.client, 'project', 'zone', 'op-1', timeout=60)
+
+        self.assertEqual(result, {'status': 'DONE'})
+        self.client.zoneOperations().wait().execute.assert_not_called()
+
+    @patch('ccp.gcp.wait_operations.time.sleep')
+    def test_deadline(self, sleep):
+        self.client.zoneOperations().get().execute.return_value = {'status': 'RUNNING'}
+
+        with self.assertRaises(OperationTimeoutError):
+            zone_wait(self.client, 'project', 'zone', 'op-1', timeout=0)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
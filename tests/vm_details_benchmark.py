@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of `encode_vm_details` against the reflective json.dumps GetVmDetails used before it.
+
+Encodes the results of GetVmDetails for a sandbox of N VMs both ways, checks they are byte identical and reports
+the best time of each.
+
+    PYTHONPATH=src python -m tests.vm_details_benchmark --vms 2000 --nics 2 --repeat 5
+"""
+
+import argparse
+import json
+import timeit
+
+from cloudshell.cp.core.models import VmDetailsData, VmDetailsNetworkInterface, VmDetailsProperty
+
+from ccp.gcp.vm_details_encoder import encode_vm_details
+
+
+def reflective_dumps(obj):
+    return json.dumps(obj, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+
+
+def vm_details(count, nics=2):
+    """ output: GetVmDetails results for count VMs, each with nics network interfaces
+    """
+    results = []
+    for i in range(count):
+        network_data = [VmDetailsNetworkInterface(interfaceId=n, networkId=u'subnet-{0}'.format(n), isPredefined=True,
+                                                  networkData=[VmDetailsProperty(key='Name', value='nic{0}'.format(n))],
+                                                  privateIpAddress='10.0.{0}.{1}'.format(n, i % 250),
+                                                  publicIpAddress='' if n else '35.1.{0}.{1}'.format(i // 250, i % 250))
+                        for n in range(nics)]
+        results.append(VmDetailsData(vmInstanceData=[VmDetailsProperty(key='Instance Id', value=str(10 ** 15 + i))],
+                                     vmNetworkData=network_data, appName=u'app-{0}--a1b2c3'.format(i)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vms', type=int, default=2000, help='VMs in the sandbox')
+    parser.add_argument('--nics', type=int, default=2, help='network interfaces per VM')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each encoder, the best one is reported')
+    args = parser.parse_args(argv)
+
+    details = vm_details(args.vms, args.nics)
+    if encode_vm_details(details) != reflective_dumps(details):
+        raise SystemExit('encode_vm_details and json.dumps disagree')
+
+    encoder = min(timeit.repeat(lambda: encode_vm_details(details), number=1, repeat=args.repeat))
+    reflective = min(timeit.repeat(lambda: reflective_dumps(details), number=1, repeat=args.repeat))
+    print('{0} VMs: encoder {1:.1f} ms, json.dumps {2:.1f} ms, {3:.1f}x'.format(
+        args.vms, encoder * 1000, reflective * 1000, reflective / encoder))
+
+
+if __name__ == '__main__':
+    main()